@@ -1,32 +1,99 @@
 # This script analyses the audio file formats and bitrates in a given directory and provides a summary of the results.
-# It uses the Mutagen library to extract audio file information such as format and bitrate.
+# MP3, FLAC and WAV files are read from their headers only (see audio_headers.py); other formats, and files whose headers
+# can't be read, are parsed with the Mutagen library.
+# The directory is listed with os.scandir and files are read by a pool of threads, since on network shares the time goes
+# on waiting for each file to open rather than on parsing it.
 # The script can be run from the command line with the directory path as the first argument or by entering the directory path when prompted.
+# Probe results are shared with remux_to_mp3_320.py through the library's .probe_cache.sqlite, so unchanged files are not re-read.
+# Usage: python analyse_file_formats.py [<directory>] [--workers N] [--report report.json|report.csv]
+# A JSON report holds every file plus the totals per folder and per format; a CSV report is written as two files, one
+# row per file (report.csv) and one row per folder and format (report_folders.csv).
 
+import argparse
+import csv
+import json
 import os
-import sys
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from mutagen import File
 from mutagen.mp3 import MP3
-from collections import defaultdict
+from audio_headers import read_audio_header
+from log_error_to_file import log_error_to_file
+from probe_cache import ProbeCache
+from run_metrics import stage
+
+AUDIO_EXTENSIONS = ('.mp3', '.flac', '.wav', '.aac', '.ogg')  # Add more formats as needed
+
+# Files are waiting on the disk or network, not the CPU, so more threads than cores pay off
+DEFAULT_WORKERS = 16
+
+FILE_REPORT_COLUMNS = [
+    'path', 'folder', 'format', 'bitrate', 'codec', 'sample_rate', 'channels', 'duration', 'size', 'average_kbps'
+]
+FOLDER_REPORT_COLUMNS = ['folder', 'format', 'files', 'bytes', 'duration']
 
 # Dictionary to track file summaries
 file_summary = defaultdict(int)
+# Total size in bytes and duration in seconds per summary key
+file_totals = defaultdict(lambda: [0, 0.0])
+
+def summary_key(audio_info):
+    return f"{audio_info['format']} - {audio_info['bitrate'] or 'Unknown Bitrate'}"
+
+def get_audio_info(file_path, cache=None, stat=None):
+    if cache is None:
+        return probe_audio_file(file_path, stat)
+    try:
+        stat = stat or os.stat(file_path)
+        file_info = cache.get(file_path, stat)
+        if file_info is None:
+            file_info = probe_audio_file(file_path, stat)
+            # Failed probes are not cached so they are retried (and reported) on the next run
+            if file_info is not None:
+                cache.put(file_path, file_info, stat)
+        return file_info
+    except OSError as e:
+        print(f"Error processing {file_path}: {e}")
+        return None
+
+def probe_audio_file(file_path, stat=None):
+    try:
+        header = read_audio_header(file_path, stat.st_size if stat else None)
+    except Exception:
+        # Truncated or unusual headers: Mutagen reads the whole file and reports the problem properly
+        header = None
+    if header is not None:
+        return {
+            'format': header['format'],
+            'bitrate': header_bitrate(header),
+            'duration': header['duration'],
+            'codec': header['codec'],
+            'sample_rate': header['sample_rate'],
+            'channels': header['channels'],
+        }
 
-def get_audio_info(file_path):
     try:
         audio = File(file_path)
         if audio is None:
             return None
-        
+
+        # Not every Mutagen file type has a MIME type
+        mime = audio.mime[0] if getattr(audio, 'mime', None) else 'unknown'
         file_info = {
-            'format': audio.mime[0],  # The MIME type gives the format (e.g., audio/mp3, audio/flac)
-            'bitrate': None
+            'format': mime,  # The MIME type gives the format (e.g., audio/mp3, audio/flac)
+            'bitrate': None,
+            'duration': getattr(audio.info, 'length', None),
+            'codec': type(audio).__name__,
+            'sample_rate': getattr(audio.info, 'sample_rate', None),
+            'channels': getattr(audio.info, 'channels', None),
         }
 
         # If it's an MP3 file, use MP3-specific processing
         if isinstance(audio, MP3):
             bitrate = audio.info.bitrate // 1000  # Bitrate in kbps
             file_info['bitrate'] = f"{bitrate}kbps"
-        elif audio.mime[0] == 'audio/flac':
+        elif mime == 'audio/flac':
             file_info['bitrate'] = "Lossless (FLAC)"
 
         return file_info
@@ -34,16 +101,137 @@ def get_audio_info(file_path):
         print(f"Error processing {file_path}: {e}")
         return None
 
-def walk_directory(directory):
-    for subdir, _, files in os.walk(directory):
-        for file in files:
-            file_path = os.path.join(subdir, file)
-            if file_path.lower().endswith(('.mp3', '.flac', '.wav', '.aac', '.ogg')):  # Add more formats as needed
-                audio_info = get_audio_info(file_path)
-                if audio_info:
-                    # Update the summary
-                    key = f"{audio_info['format']} - {audio_info['bitrate'] or 'Unknown Bitrate'}"
-                    file_summary[key] += 1
+def header_bitrate(header):
+    """Returns the bitrate label used in the summary, matching the one derived from Mutagen."""
+    if header['format'].startswith('audio/mp'):
+        return f"{header['bitrate']}kbps"
+    if header['format'] == 'audio/flac':
+        return "Lossless (FLAC)"
+    return None
+
+def scan_audio_files(directory):
+    """Yields (path, stat) for every audio file under directory, listing each folder once with os.scandir."""
+    pending = [directory]
+    while pending:
+        folder = pending.pop()
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            pending.append(entry.path)
+                        elif entry.name.lower().endswith(AUDIO_EXTENSIONS):
+                            yield entry.path, entry.stat()
+                    except OSError as e:
+                        log_error_to_file(__file__, f"Error reading {entry.path}: {e}")
+        except OSError as e:
+            print(f"Error listing {folder}: {e}")
+            log_error_to_file(__file__, f"Error listing {folder}: {e}")
+
+def analyse_file(directory, file_path, stat, cache):
+    audio_info = get_audio_info(file_path, cache, stat)
+    if audio_info is None:
+        return None
+    duration = audio_info['duration']
+    return {
+        'path': os.path.relpath(file_path, directory),
+        'folder': os.path.relpath(os.path.dirname(file_path), directory),
+        'format': audio_info['format'],
+        'bitrate': audio_info['bitrate'],
+        'codec': audio_info['codec'],
+        'sample_rate': audio_info.get('sample_rate'),
+        'channels': audio_info.get('channels'),
+        'duration': duration,
+        'size': stat.st_size,
+        'average_kbps': round(stat.st_size * 8 / duration / 1000) if duration else None,
+    }
+
+def walk_directory(directory, workers=DEFAULT_WORKERS):
+    """
+    Analyses every audio file under directory and adds it to the summary.
+
+    Returns:
+        list: One dictionary per file that could be read (see FILE_REPORT_COLUMNS), sorted by path.
+    """
+    cache = ProbeCache.for_directory(directory)
+    seen_paths = []
+    records = []
+    try:
+        with stage("analyse_file_formats", directory=directory, workers=workers) as timer:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = []
+                for file_path, stat in scan_audio_files(directory):
+                    seen_paths.append(file_path)
+                    futures.append(executor.submit(analyse_file, directory, file_path, stat, cache))
+                for future in futures:
+                    record = future.result()
+                    if record:
+                        # Update the summary
+                        key = summary_key(record)
+                        file_summary[key] += 1
+                        file_totals[key][0] += record['size']
+                        file_totals[key][1] += record['duration'] or 0
+                        records.append(record)
+            timer.files = len(seen_paths)
+            timer.bytes = sum(record['size'] for record in records)
+        # Drop cache entries for files that no longer exist in the library
+        cache.evict_missing(directory, seen_paths)
+    finally:
+        cache.close()
+    records.sort(key=lambda record: record['path'])
+    return records
+
+def folder_totals(records):
+    """Returns {folder: {summary key: {'files', 'bytes', 'duration'}}}."""
+    totals = defaultdict(lambda: defaultdict(lambda: {'files': 0, 'bytes': 0, 'duration': 0.0}))
+    for record in records:
+        bucket = totals[record['folder']][summary_key(record)]
+        bucket['files'] += 1
+        bucket['bytes'] += record['size']
+        bucket['duration'] += record['duration'] or 0
+    for buckets in totals.values():
+        for bucket in buckets.values():
+            bucket['duration'] = round(bucket['duration'], 3)
+    return {folder: dict(buckets) for folder, buckets in sorted(totals.items())}
+
+def write_report(report_path, directory, records):
+    """Writes records as a JSON report, or as CSV reports if report_path ends in .csv."""
+    folders = folder_totals(records)
+    if report_path.lower().endswith('.csv'):
+        with open(report_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=FILE_REPORT_COLUMNS)
+            writer.writeheader()
+            writer.writerows(records)
+        folder_report_path = os.path.splitext(report_path)[0] + '_folders.csv'
+        with open(folder_report_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(FOLDER_REPORT_COLUMNS)
+            for folder, buckets in folders.items():
+                for key, bucket in sorted(buckets.items()):
+                    writer.writerow([folder, key, bucket['files'], bucket['bytes'], bucket['duration']])
+        print(f"Report written to {report_path} and {folder_report_path}")
+        return
+
+    formats = {}
+    for buckets in folders.values():
+        for key, bucket in buckets.items():
+            total = formats.setdefault(key, {'files': 0, 'bytes': 0, 'duration': 0.0})
+            for field in total:
+                total[field] += bucket[field]
+    report = {
+        'directory': os.path.abspath(directory),
+        'generated_at': datetime.now().isoformat(timespec='seconds'),
+        'formats': formats,
+        'folders': folders,
+        'files': records,
+    }
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {report_path}")
+
+def format_duration(seconds):
+    hours, remainder = divmod(int(seconds), 3600)
+    return f"{hours}:{remainder // 60:02d}:{remainder % 60:02d}"
 
 def print_summary():
     print("\n--- Summary ---")
@@ -51,20 +239,27 @@ def print_summary():
     print(f"Total files processed: {total_files}")
     print("\nBreakdown by format and bitrate:")
     for key, count in file_summary.items():
-        print(f"{key}: {count}")
+        size, duration = file_totals[key]
+        print(f"{key}: {count} ({size / (1024 * 1024):.1f} MB, {format_duration(duration)})")
     print("-" * 50)
 
 # Entry point
 if __name__ == '__main__':
-    # Check if the directory is passed as an argument
-    if len(sys.argv) > 1:
-        directory = sys.argv[1]
-    else:
-        # Prompt the user for the directory
-        directory = input("Enter the directory to process: ").strip()
+    parser = argparse.ArgumentParser(description="Summarise the audio formats and bitrates in a directory.")
+    parser.add_argument("directory", nargs="?", default=None, help="Directory to analyse (prompted for if omitted).")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help=f"Number of files read at once (default {DEFAULT_WORKERS}).")
+    parser.add_argument("--report", default=None,
+                        help="Write a report of every file and folder to this .json or .csv file.")
+    args = parser.parse_args()
+
+    # Prompt the user for the directory if it wasn't passed as an argument
+    directory = args.directory or input("Enter the directory to process: ").strip()
 
     if os.path.isdir(directory):
-        walk_directory(directory)
+        records = walk_directory(directory, max(1, args.workers))
         print_summary()
+        if args.report:
+            write_report(args.report, directory, records)
     else:
         print("Invalid directory. Please check the path and try again.")
@@ -0,0 +1,226 @@
+# Index of local music archive folders, used by `replace_failed_downloads.py` to find replacements automatically.
+# Every audio file in the archive folders is recorded with its artist and title (from its tags, or from an
+# "Artist - Title" file name) and a normalised search key, in a SQLite database next to the failed downloads list
+# (archive_index.sqlite). Updates are incremental: only files whose size or modification time changed are re-read.
+# Failed downloads are matched against the whole index in bulk: exact key matches are looked up directly and the rest
+# are scored with RapidFuzz. Each match is graded as "auto" (safe to apply without asking), "ambiguous" (worth
+# suggesting) or "unmatched".
+
+import os
+import re
+import sqlite3
+import time
+import unicodedata
+from collections import namedtuple
+import numpy as np
+from mutagen import File
+from rapidfuzz import fuzz, process
+
+ARCHIVE_INDEX_DB = '../archive_index.sqlite'
+
+AUDIO_EXTENSIONS = ('.mp3', '.flac', '.wav', '.aiff', '.aif', '.aac', '.m4a', '.ogg')
+
+# Number of index updates after which they are committed to disk
+COMMIT_EVERY = 500
+
+# A match is applied automatically at or above AUTO_MATCH_SCORE if no other track scores within AUTO_MATCH_MARGIN
+# of it. Matches from CANDIDATE_SCORE upwards are offered as suggestions.
+AUTO_MATCH_SCORE = 95
+AUTO_MATCH_MARGIN = 5
+CANDIDATE_SCORE = 75
+
+# Number of suggestions kept per failed download, and number of failed downloads scored against the index at once
+MAX_CANDIDATES = 3
+MATCH_CHUNK_SIZE = 256
+
+AUTO = 'auto'
+AMBIGUOUS = 'ambiguous'
+UNMATCHED = 'unmatched'
+
+ArchiveTrack = namedtuple('ArchiveTrack', ['path', 'artist', 'title', 'key', 'size'])
+Match = namedtuple('Match', ['row', 'status', 'score', 'track', 'candidates'])
+
+# Decorations that differ between copies of the same track: "(feat. X)", "[Free Download]", "ft. X"
+BRACKETED_PATTERN = re.compile(r"[\(\[][^\)\]]*(feat\.?|ft\.?|featuring|free download|free dl)[^\)\]]*[\)\]]")
+FEATURING_PATTERN = re.compile(r"\b(feat\.?|ft\.?|featuring)\s.*$")
+NON_WORD_PATTERN = re.compile(r"[^\w]+")
+
+def normalise(text):
+    """Returns a search key for an artist/title string: lower case, no accents, punctuation or featured artists."""
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(character for character in text if not unicodedata.combining(character)).casefold()
+    text = BRACKETED_PATTERN.sub(' ', text.replace('&', ' and '))
+    text = FEATURING_PATTERN.sub(' ', text)
+    return ' '.join(NON_WORD_PATTERN.sub(' ', text).replace('_', ' ').split())
+
+def search_key(artist, title):
+    # Sorting the words makes a plain edit-distance ratio order-insensitive ("Title - Artist" file names still match),
+    # without re-sorting every archive key on every comparison
+    return ' '.join(sorted(normalise(f"{artist} {title}").split()))
+
+def read_artist_and_title(file_path):
+    """Reads artist and title from the file's tags, falling back to an "Artist - Title" file name."""
+    artist = title = None
+    try:
+        audio = File(file_path, easy=True)
+        if audio is not None and audio.tags:
+            artist = (audio.tags.get('artist') or [None])[0]
+            title = (audio.tags.get('title') or [None])[0]
+    except Exception:
+        pass
+
+    if not artist or not title:
+        stem = os.path.splitext(os.path.basename(file_path))[0]
+        if ' - ' in stem:
+            name_artist, name_title = stem.split(' - ', 1)
+            artist, title = artist or name_artist, title or name_title
+        else:
+            title = title or stem
+    return (artist or '').strip(), (title or '').strip()
+
+class ArchiveIndex:
+    """SQLite index of the audio files in one or more archive folders."""
+
+    def __init__(self, db_path=ARCHIVE_INDEX_DB):
+        self.db_path = db_path
+        self.connection = sqlite3.connect(db_path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS tracks (
+                path TEXT PRIMARY KEY,
+                root TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                artist TEXT,
+                title TEXT,
+                key TEXT NOT NULL,
+                indexed_at REAL NOT NULL
+            )"""
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS tracks_root ON tracks (root)")
+        self.connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def roots(self):
+        """Returns the archive folders that have been indexed."""
+        return [row[0] for row in self.connection.execute("SELECT DISTINCT root FROM tracks ORDER BY root")]
+
+    def update(self, root):
+        """
+        Brings the index up to date with an archive folder, re-reading only new and changed files.
+
+        Returns:
+            tuple: (files re-read, files removed from the index)
+        """
+        root = os.path.abspath(root)
+        known = {
+            path: (size, mtime_ns)
+            for path, size, mtime_ns in self.connection.execute(
+                "SELECT path, size, mtime_ns FROM tracks WHERE root = ?", (root,)
+            )
+        }
+        seen = set()
+        updated = 0
+        for subdir, _, files in os.walk(root):
+            for file in files:
+                if not file.lower().endswith(AUDIO_EXTENSIONS):
+                    continue
+                file_path = os.path.join(subdir, file)
+                try:
+                    stat = os.stat(file_path)
+                except OSError:
+                    continue
+                seen.add(file_path)
+                if known.get(file_path) == (stat.st_size, stat.st_mtime_ns):
+                    continue
+
+                artist, title = read_artist_and_title(file_path)
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO tracks (path, root, size, mtime_ns, artist, title, key, indexed_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (file_path, root, stat.st_size, stat.st_mtime_ns, artist, title, search_key(artist, title),
+                     time.time())
+                )
+                updated += 1
+                if updated % COMMIT_EVERY == 0:
+                    self.connection.commit()
+
+        removed = [(path,) for path in known if path not in seen]
+        self.connection.executemany("DELETE FROM tracks WHERE path = ?", removed)
+        self.connection.commit()
+        return updated, len(removed)
+
+    def tracks(self):
+        return [
+            ArchiveTrack(*row)
+            for row in self.connection.execute("SELECT path, artist, title, key, size FROM tracks WHERE key != ''")
+        ]
+
+    def close(self):
+        self.connection.close()
+
+def match_failed_downloads(rows, tracks):
+    """
+    Matches failed downloads against archive tracks.
+
+    Args:
+        rows (list): Rows of failed_downloads.csv (see failed_downloads_store.COLUMNS).
+        tracks (list): ArchiveTrack entries, e.g. ArchiveIndex.tracks().
+
+    Returns:
+        list: A Match per row, in the same order. `track` is the best candidate (or None) and `candidates` the
+            best few distinct tracks, best first.
+    """
+    # Exact key matches need no scoring; copies of the same track are ranked largest first
+    by_key = {}
+    for track in sorted(tracks, key=lambda track: -track.size):
+        by_key.setdefault(track.key, track)
+    keys = list(by_key)
+    distinct_tracks = list(by_key.values())
+
+    matches = [None] * len(rows)
+    fuzzy = []
+    for position, row in enumerate(rows):
+        query = search_key(row[2], row[1])
+        if not query:
+            matches[position] = Match(row, UNMATCHED, 0, None, [])
+        elif query in by_key:
+            matches[position] = Match(row, AUTO, 100, by_key[query], [by_key[query]])
+        else:
+            fuzzy.append((position, query))
+
+    limit = min(MAX_CANDIDATES, len(keys))
+    for start in range(0, len(fuzzy), MATCH_CHUNK_SIZE):
+        chunk = fuzzy[start:start + MATCH_CHUNK_SIZE]
+        if not limit:
+            for position, _ in chunk:
+                matches[position] = Match(rows[position], UNMATCHED, 0, None, [])
+            continue
+        # One score per (failed download, archive track) pair, computed in parallel in C
+        scores = process.cdist([query for _, query in chunk], keys, scorer=fuzz.ratio, dtype=np.uint8, workers=-1,
+                               score_cutoff=CANDIDATE_SCORE)
+        best_indices = np.argpartition(scores, -limit, axis=1)[:, -limit:]
+        for offset, (position, _) in enumerate(chunk):
+            ranked = sorted(best_indices[offset], key=lambda index: -int(scores[offset, index]))
+            matches[position] = grade(rows[position], [(int(scores[offset, index]), distinct_tracks[index])
+                                                       for index in ranked])
+    return matches
+
+def grade(row, scored_tracks):
+    """Grades the ranked (score, track) pairs for one failed download."""
+    candidates = [(score, track) for score, track in scored_tracks if score >= CANDIDATE_SCORE]
+    if not candidates:
+        return Match(row, UNMATCHED, 0, None, [])
+
+    best_score, best_track = candidates[0]
+    runner_up = candidates[1][0] if len(candidates) > 1 else 0
+    if best_score >= AUTO_MATCH_SCORE and best_score - runner_up >= AUTO_MATCH_MARGIN:
+        status = AUTO
+    else:
+        status = AMBIGUOUS
+    return Match(row, status, best_score, best_track, [track for _, track in candidates])
@@ -0,0 +1,182 @@
+# Reads format, codec, bitrate, sample rate, channels and duration from the first few kilobytes of MP3, FLAC and WAV
+# files, without parsing the whole file. Used by the scan in analyse_file_formats.py.
+# Formats and bitrates are reported the way Mutagen reports them (e.g. "audio/mp3" and 320 for a 320kbps MP3), so results
+# can be shared with the Mutagen probes in .probe_cache.sqlite. Other formats return None, so callers can fall back to
+# a full Mutagen parse.
+
+import os
+import struct
+
+# How much of the file is read after any ID3v2 tag to find the first MP3 frame
+MP3_SCAN_BYTES = 64 * 1024
+
+MP3_BITRATES = {
+    (1, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (1, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (1, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (2, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (2, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (2, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+MP3_SAMPLE_RATES = {1: [44100, 48000, 32000], 2: [22050, 24000, 16000], 2.5: [11025, 12000, 8000]}
+
+def id3v2_size(header):
+    """Returns the total size of the ID3v2 tag starting at header, or 0 if there is none."""
+    if len(header) < 10 or header[:3] != b'ID3':
+        return 0
+    size = (header[6] << 21) | (header[7] << 14) | (header[8] << 7) | header[9]
+    return 10 + size + (10 if header[5] & 0x10 else 0)
+
+def parse_mp3_frame_header(data, offset):
+    """Returns the fields of the MPEG audio frame header at offset, or None if it isn't a valid one."""
+    if offset + 4 > len(data) or data[offset] != 0xFF or data[offset + 1] & 0xE0 != 0xE0:
+        return None
+    version_bits = (data[offset + 1] >> 3) & 3
+    layer_bits = (data[offset + 1] >> 1) & 3
+    bitrate_index = data[offset + 2] >> 4
+    sample_rate_index = (data[offset + 2] >> 2) & 3
+    if version_bits == 1 or layer_bits == 0 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+
+    version = {3: 1, 2: 2, 0: 2.5}[version_bits]
+    layer = 4 - layer_bits
+    bitrate = MP3_BITRATES[(1 if version == 1 else 2, layer)][bitrate_index]
+    sample_rate = MP3_SAMPLE_RATES[version][sample_rate_index]
+    padding = (data[offset + 2] >> 1) & 1
+    mono = (data[offset + 3] >> 6) == 3
+    if layer == 1:
+        samples_per_frame = 384
+        frame_length = (12 * bitrate * 1000 // sample_rate + padding) * 4
+    else:
+        samples_per_frame = 1152 if layer == 2 or version == 1 else 576
+        frame_length = (samples_per_frame // 8) * bitrate * 1000 // sample_rate + padding
+    return {
+        'version': version, 'layer': layer, 'bitrate': bitrate, 'sample_rate': sample_rate, 'mono': mono,
+        'samples_per_frame': samples_per_frame, 'frame_length': frame_length,
+    }
+
+def find_mp3_frame(data):
+    """Returns (offset, header) of the first frame header that is followed by another valid frame."""
+    offset = data.find(b'\xff')
+    while 0 <= offset < len(data) - 4:
+        header = parse_mp3_frame_header(data, offset)
+        if header and header['frame_length'] > 0:
+            following = offset + header['frame_length']
+            # Accept a header at the very end of what was read; otherwise require the next frame to line up
+            if following + 4 > len(data) or parse_mp3_frame_header(data, following):
+                return offset, header
+        offset = data.find(b'\xff', offset + 1)
+    return None, None
+
+def read_mp3(f, size):
+    start = 0
+    # Some files carry more than one ID3v2 tag back to back
+    tag_size = id3v2_size(f.read(10))
+    while tag_size:
+        start += tag_size
+        f.seek(start)
+        tag_size = id3v2_size(f.read(10))
+    f.seek(start)
+    data = f.read(MP3_SCAN_BYTES)
+    offset, header = find_mp3_frame(data)
+    if header is None:
+        return None
+
+    end = size
+    f.seek(max(0, size - 128))
+    if f.read(3) == b'TAG':
+        end -= 128
+    audio_bytes = end - start - offset
+
+    # Frame count and bytes they take up, from a VBR header if there is one
+    frames = stream_bytes = None
+    # The Xing/Info header sits after the side information; VBRI sits at a fixed offset
+    side_info = (17 if header['mono'] else 32) if header['version'] == 1 else (9 if header['mono'] else 17)
+    xing = offset + 4 + side_info
+    if data[xing:xing + 4] in (b'Xing', b'Info') and len(data) >= xing + 8:
+        flags = struct.unpack('>I', data[xing + 4:xing + 8])[0]
+        position = xing + 8
+        if flags & 1 and len(data) >= position + 4:
+            frames = struct.unpack('>I', data[position:position + 4])[0]
+            position += 4
+        if flags & 2 and len(data) >= position + 4:
+            # The count includes the header frame, which isn't in the frame count
+            stream_bytes = max(0, struct.unpack('>I', data[position:position + 4])[0] - header['frame_length'])
+    elif data[offset + 36:offset + 40] == b'VBRI' and len(data) >= offset + 54:
+        stream_bytes, frames = struct.unpack('>II', data[offset + 46:offset + 54])
+
+    if frames:
+        duration = frames * header['samples_per_frame'] / header['sample_rate']
+        bitrate = header['bitrate']
+        if stream_bytes and duration:
+            # Average bitrate, in whole kbps as Mutagen reports it
+            bitrate = round(stream_bytes * 8 / duration) // 1000
+    else:
+        # Constant bitrate: the duration follows from the size of the audio data
+        bitrate = header['bitrate']
+        duration = audio_bytes * 8 / (bitrate * 1000)
+    return {
+        'format': f"audio/mp{header['layer']}", 'codec': f"MPEG-{header['version']} Layer {'I' * header['layer']}",
+        'bitrate': bitrate, 'sample_rate': header['sample_rate'], 'channels': 1 if header['mono'] else 2,
+        'duration': duration,
+    }
+
+def read_flac(f, size):
+    start = id3v2_size(f.read(10))
+    f.seek(start)
+    if f.read(4) != b'fLaC':
+        return None
+    block_header = f.read(4)
+    if len(block_header) < 4 or block_header[0] & 0x7F != 0:
+        return None
+    stream_info = f.read(34)
+    if len(stream_info) < 18:
+        return None
+    packed = int.from_bytes(stream_info[10:18], 'big')
+    sample_rate = packed >> 44
+    channels = ((packed >> 41) & 7) + 1
+    total_samples = packed & 0xFFFFFFFFF
+    duration = total_samples / sample_rate if sample_rate else 0
+    return {
+        'format': 'audio/flac', 'codec': 'FLAC',
+        'bitrate': int(size * 8 / duration) // 1000 if duration else None,
+        'sample_rate': sample_rate, 'channels': channels, 'duration': duration,
+    }
+
+def read_wav(f, size):
+    riff = f.read(12)
+    if len(riff) < 12 or riff[:4] != b'RIFF' or riff[8:12] != b'WAVE':
+        return None
+    info = None
+    position = 12
+    while position + 8 <= size:
+        f.seek(position)
+        chunk_id, chunk_size = struct.unpack('<4sI', f.read(8))
+        if chunk_id == b'fmt ':
+            audio_format, channels, sample_rate, byte_rate = struct.unpack('<HHII', f.read(12))
+            info = {
+                'format': 'audio/wav', 'codec': 'PCM' if audio_format in (1, 0xFFFE) else f'format 0x{audio_format:04x}',
+                'bitrate': byte_rate * 8 // 1000, 'sample_rate': sample_rate, 'channels': channels,
+                'duration': None, 'byte_rate': byte_rate,
+            }
+        elif chunk_id == b'data' and info is not None:
+            data_size = min(chunk_size, size - position - 8)
+            info['duration'] = data_size / info.pop('byte_rate') if info['byte_rate'] else None
+            return info
+        position += 8 + chunk_size + (chunk_size & 1)
+    return None
+
+HEADER_READERS = {'.mp3': read_mp3, '.flac': read_flac, '.wav': read_wav}
+
+def read_audio_header(file_path, size=None):
+    """
+    Returns a dictionary with format, codec, bitrate (kbps), sample_rate, channels and duration (seconds), read from
+    the file's headers. Returns None if the format is not supported here or the headers could not be read.
+    """
+    reader = HEADER_READERS.get(os.path.splitext(file_path)[1].lower())
+    if reader is None:
+        return None
+    if size is None:
+        size = os.path.getsize(file_path)
+    with open(file_path, 'rb') as f:
+        return reader(f, size)
@@ -0,0 +1,301 @@
+# Benchmarks the library-processing scripts against a synthetic library (see synthetic_library.py).
+# ffmpeg and sldl are replaced by the offline stand-ins in benchmark_stubs/, so runs need no network and give the same
+# results every time for the same arguments. Each benchmark runs in a freshly generated workspace.
+# Every result is appended as one JSON line to the results file, tagged with the git commit and the library size, so
+# runs can be compared across commits and sizes (e.g. --tracks 10000 against --tracks 100000).
+# Usage: python benchmark.py [--tracks N] [--playlists N] [--failed N] [--only BENCHMARK ...] [--output FILE]
+#        Run with --help for all options.
+
+import argparse
+import contextlib
+import json
+import logging
+import os
+import platform
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from synthetic_library import generate_workspace, parse_format_mix, DEFAULT_FORMAT_MIX
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+STUBS_DIR = os.path.join(SCRIPTS_DIR, 'benchmark_stubs')
+
+DEFAULT_RESULTS_FILE = os.path.join('..', 'benchmark_results.jsonl')
+
+# Playlist folders (and tracks in each) added after a full pass by the post_process_delta benchmark
+DELTA_PLAYLISTS = 2
+DELTA_TRACKS = 5
+
+# Share of retried failed downloads that the sldl stand-in fails again (one in this many)
+RETRY_STUB_FAIL_EVERY = 4
+
+def completion_events(workspace, count):
+    """Returns sldl completion events: half clear an existing failed download, half report a new one."""
+    events = []
+    for row in workspace['failed_rows'][:count // 2]:
+        path, title, artist = row[0], row[1], row[2]
+        events.append([path + '.mp3', title, artist, '', '', row[5], '', 'Downloaded'])
+    for index in range(count - len(events)):
+        events.append(['', f"New Failure {index:06d}", f"New Artist {index}", '', '', '200', 'NoSuitableFileFound',
+                       'Failed'])
+    return events
+
+def run_in_pool(function, items, concurrency):
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        # Consume the iterator so that exceptions from any item are raised here
+        list(executor.map(function, items))
+
+def benchmark_remux_cold(workspace, options):
+    from remux_to_mp3_320 import remux_to_mp3_320
+    remux_to_mp3_320(workspace['library'], options.workers)
+    return options.tracks
+
+def benchmark_remux_warm(workspace, options):
+    from remux_to_mp3_320 import remux_to_mp3_320
+    # The first pass converts everything and fills the probe cache; only the second, no-op pass is timed
+    yield 'setup'
+    remux_to_mp3_320(workspace['library'], options.workers)
+    yield 'start'
+    remux_to_mp3_320(workspace['library'], options.workers)
+    yield options.tracks
+
+def benchmark_rename_playlists(workspace, options):
+    from rename_playlists import rename_playlists
+    rename_playlists(workspace['library'])
+    return options.playlists
+
+def benchmark_post_process_delta(workspace, options):
+    from remux_to_mp3_320 import remux_to_mp3_320
+    from rename_playlists import rename_playlists
+    from run_manifest import RunManifest
+    from synthetic_library import write_audio
+    library = workspace['library']
+    # Post-process the whole library first, then time only the folders a run adds on top of it
+    yield 'setup'
+    remux_to_mp3_320(library, options.workers)
+    rename_playlists(library)
+    manifest = RunManifest(library, os.path.join(os.path.dirname(library), 'run_manifest.json'))
+    file_count = 0
+    for playlist in range(DELTA_PLAYLISTS):
+        folder = os.path.join(library, f"New Playlist {playlist:04d}")
+        os.makedirs(folder)
+        file_names = [f"New Artist {track} - New Track {playlist:04d}-{track:03d}.flac" for track in range(DELTA_TRACKS)]
+        for file_name in file_names:
+            write_audio(os.path.join(folder, file_name), 'flac')
+        with open(os.path.join(folder, '_playlist.m3u8'), 'w', encoding='utf-8') as f:
+            f.writelines(f"{file_name}\n" for file_name in file_names)
+        file_count += len(file_names)
+    yield 'start'
+    manifest.collect_folder_changes()
+    folders = manifest.sorted_folders()
+    rename_playlists(library, folders)
+    remux_to_mp3_320(library, options.workers, folders)
+    manifest.clear()
+    yield file_count
+
+def benchmark_analyse_cold(workspace, options):
+    import analyse_file_formats
+    analyse_file_formats.file_summary.clear()
+    analyse_file_formats.file_totals.clear()
+    analyse_file_formats.walk_directory(workspace['library'])
+    return options.tracks
+
+def benchmark_analyse_warm(workspace, options):
+    import analyse_file_formats
+    yield 'setup'
+    analyse_file_formats.walk_directory(workspace['library'])
+    analyse_file_formats.file_summary.clear()
+    analyse_file_formats.file_totals.clear()
+    yield 'start'
+    analyse_file_formats.walk_directory(workspace['library'])
+    yield options.tracks
+
+def benchmark_process_completed_download(workspace, options):
+    # One process per event, at most --concurrency at once, the same way sldl runs its on-complete hook
+    script = os.path.join(SCRIPTS_DIR, 'process_completed_download.py')
+    events = completion_events(workspace, options.events)
+    run_in_pool(
+        lambda event: subprocess.run([sys.executable, script, *event], stdout=subprocess.DEVNULL, check=True),
+        events, options.concurrency
+    )
+    return len(events)
+
+def benchmark_completion_daemon(workspace, options):
+    from completion_daemon import start_daemon
+    script = os.path.join(SCRIPTS_DIR, 'notify_completed_download.py')
+    events = completion_events(workspace, options.events)
+    daemon = start_daemon()
+    if daemon is None:
+        raise RuntimeError("The completion daemon's port is in use; is a download run in progress?")
+    try:
+        run_in_pool(
+            lambda event: subprocess.run([sys.executable, script, *event], stdout=subprocess.DEVNULL, check=True),
+            events, options.concurrency
+        )
+    finally:
+        # Stopping drains the queue, so the timing includes applying every event
+        daemon.stop()
+    return len(events)
+
+def benchmark_replace_failed_downloads(workspace, options):
+    import replace_failed_downloads
+    replace_failed_downloads.destination_dir = workspace['library']
+    rows = workspace['failed_rows'][:options.replacements]
+    for path, title, artist, *_ in rows:
+        replace_failed_downloads.process_replacement(title, path + '.mp3', artist)
+    return len(rows)
+
+def benchmark_download_playlists(workspace, options):
+    from playlist_scheduler import PlaylistScheduler, slot_arguments
+    playlists = [(f"https://open.spotify.com/playlist/benchmark{index:04d}", f"Benchmark {index:04d}")
+                 for index in range(options.playlists)]
+    failures = PlaylistScheduler(slot_arguments(None, options.concurrency)).run(playlists)
+    if failures:
+        raise RuntimeError(f"{len(failures)} playlist(s) failed: {failures[0][1]}")
+    return len(playlists)
+
+def benchmark_retry_failed_downloads(workspace, options):
+    from retry_failed_downloads import retry_failed_downloads
+    # Every failed download is retried at once; the stand-in fails every RETRY_STUB_FAIL_EVERY-th track again
+    retried, _ = retry_failed_downloads(ignore_backoff=True)
+    return retried
+
+# Name -> function(workspace, options). A function either returns the number of items it processed, or is a generator
+# that yields 'setup', then 'start' when the timed part begins, and finally the number of items.
+BENCHMARKS = {
+    'remux_cold': benchmark_remux_cold,
+    'remux_warm': benchmark_remux_warm,
+    'rename_playlists': benchmark_rename_playlists,
+    'post_process_delta': benchmark_post_process_delta,
+    'analyse_cold': benchmark_analyse_cold,
+    'analyse_warm': benchmark_analyse_warm,
+    'process_completed_download': benchmark_process_completed_download,
+    'completion_daemon': benchmark_completion_daemon,
+    'replace_failed_downloads': benchmark_replace_failed_downloads,
+    'download_playlists': benchmark_download_playlists,
+    'retry_failed_downloads': benchmark_retry_failed_downloads,
+}
+
+def time_benchmark(function, workspace, options):
+    """Returns (items, seconds) for one benchmark, excluding any setup the benchmark declares."""
+    start = time.perf_counter()
+    outcome = function(workspace, options)
+    if not hasattr(outcome, '__next__'):
+        return outcome, time.perf_counter() - start
+
+    for step in outcome:
+        if step == 'start':
+            start = time.perf_counter()
+        elif step != 'setup':
+            return step, time.perf_counter() - start
+    raise RuntimeError("Benchmark finished without reporting an item count")
+
+def git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=SCRIPTS_DIR, capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=SCRIPTS_DIR,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+def use_stubs(options):
+    """Points the scripts at the offline ffmpeg and sldl stand-ins. Must run before the scripts are imported."""
+    os.environ['FFMPEG_COMMAND'] = shlex.join([sys.executable, os.path.join(STUBS_DIR, 'ffmpeg.py')])
+    os.environ['SLDL_COMMAND'] = shlex.join([sys.executable, os.path.join(STUBS_DIR, 'sldl.py')])
+    os.environ['FFMPEG_STUB_SECONDS'] = str(options.encode_seconds)
+    # The synthetic files hold no audio that PyAV could decode, and "auto" would time the stand-in against real encoding
+    os.environ['REMUX_ENCODER'] = 'ffmpeg'
+    os.environ['SLDL_STUB_SECONDS'] = str(options.download_seconds)
+    os.environ['SLDL_STUB_FAIL_EVERY'] = str(RETRY_STUB_FAIL_EVERY)
+
+def run_benchmark(name, options, base_record):
+    root = tempfile.mkdtemp(prefix=f'sldl-benchmark-{name}-', dir=options.work_dir)
+    record = dict(base_record, benchmark=name, timestamp=datetime.now().isoformat(timespec='seconds'))
+    original_cwd = os.getcwd()
+    try:
+        setup_start = time.perf_counter()
+        workspace = generate_workspace(
+            root, options.tracks, options.playlists, options.failed, options.format_mix, options.seed
+        )
+        record['setup_seconds'] = round(time.perf_counter() - setup_start, 4)
+
+        # The scripts resolve ../failed_downloads.csv and error_logs/ against the working directory
+        os.chdir(workspace['scripts'])
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            items, seconds = time_benchmark(BENCHMARKS[name], workspace, options)
+        record.update(status='ok', items=items, seconds=round(seconds, 4),
+                      items_per_second=round(items / seconds, 2) if seconds else None)
+    except Exception as e:
+        record.update(status='error', error=f"{type(e).__name__}: {e}")
+        traceback.print_exc()
+    finally:
+        os.chdir(original_cwd)
+        if options.keep:
+            record['workspace'] = root
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+    return record
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the library-processing scripts on a synthetic library.")
+    parser.add_argument('--tracks', type=int, default=1000, help="Number of audio files in the library.")
+    parser.add_argument('--playlists', type=int, default=20, help="Number of playlist folders.")
+    parser.add_argument('--failed', type=int, default=500, help="Number of rows in failed_downloads.csv.")
+    parser.add_argument('--format-mix', type=parse_format_mix, default=DEFAULT_FORMAT_MIX,
+                        help="Share of each format, e.g. mp3_320=0.6,mp3_192=0.1,flac=0.2,wav=0.1")
+    parser.add_argument('--seed', type=int, default=0, help="Seed for the synthetic library.")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Remux worker threads.")
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help="Concurrent completion hooks and sldl processes (sldl.conf uses concurrent-downloads = 4).")
+    parser.add_argument('--events', type=int, default=200, help="Completion events to send.")
+    parser.add_argument('--replacements', type=int, default=20, help="Failed downloads to replace.")
+    parser.add_argument('--encode-seconds', type=float, default=0, help="Simulated ffmpeg time per file.")
+    parser.add_argument('--download-seconds', type=float, default=0, help="Simulated sldl time per playlist.")
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS), help="Benchmarks to run (default: all).")
+    parser.add_argument('--output', default=DEFAULT_RESULTS_FILE, help="JSON lines file to append results to.")
+    parser.add_argument('--work-dir', default=None, help="Where to create the workspaces (default: system temp).")
+    parser.add_argument('--keep', action='store_true', help="Keep the workspaces for inspection.")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    options = parse_arguments(argv)
+    options.output = os.path.abspath(options.output)
+    use_stubs(options)
+    # rename_playlists logs every file at DEBUG level; that output would dominate the timings
+    logging.disable(logging.CRITICAL)
+
+    commit, dirty = git_commit()
+    base_record = {
+        'commit': commit,
+        'dirty': dirty,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': {
+            'tracks': options.tracks, 'playlists': options.playlists, 'failed': options.failed,
+            'format_mix': options.format_mix, 'seed': options.seed, 'workers': options.workers,
+            'concurrency': options.concurrency, 'events': options.events, 'replacements': options.replacements,
+            'encode_seconds': options.encode_seconds, 'download_seconds': options.download_seconds,
+        },
+    }
+
+    print(f"{'benchmark':<28} {'items':>8} {'seconds':>10} {'items/s':>10}")
+    for name in options.only or BENCHMARKS:
+        record = run_benchmark(name, options, base_record)
+        with open(options.output, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record) + "\n")
+        if record['status'] == 'ok':
+            print(f"{name:<28} {record['items']:>8} {record['seconds']:>10.3f} {record['items_per_second'] or 0:>10.1f}")
+        else:
+            print(f"{name:<28} {record['error']}")
+    print(f"\nResults appended to {options.output}")
+
+if __name__ == '__main__':
+    main()
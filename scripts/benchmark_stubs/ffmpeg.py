@@ -0,0 +1,33 @@
+# Offline stand-in for ffmpeg, used by benchmark.py through FFMPEG_COMMAND.
+# Writes a small 320kbps MP3 to the output path (the last argument) instead of transcoding the input, so remux runs are
+# fast and deterministic. Set FFMPEG_STUB_SECONDS to simulate a fixed encode time per file.
+# When the ebur128 filter is asked for, a fixed loudness summary is logged the way ffmpeg logs it, and with an output of
+# "-" (a measurement-only run) nothing is written.
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from synthetic_library import write_mp3
+
+LOUDNESS_SUMMARY = """[Parsed_ebur128_0 @ 0x0] Summary:
+
+  Integrated loudness:
+    I:          -9.0 LUFS
+    Threshold: -19.0 LUFS
+
+  True peak:
+    Peak:        0.5 dBFS"""
+
+if __name__ == '__main__':
+    arguments = sys.argv[1:]
+    if '-i' not in arguments or not os.path.exists(arguments[arguments.index('-i') + 1]):
+        print("ffmpeg stand-in: input file not found", file=sys.stderr)
+        sys.exit(1)
+
+    time.sleep(float(os.environ.get('FFMPEG_STUB_SECONDS', '0')))
+    if arguments[-1] != '-':
+        write_mp3(arguments[-1], 320)
+    if any(argument.startswith('ebur128') for argument in arguments):
+        print(LOUDNESS_SUMMARY, file=sys.stderr)
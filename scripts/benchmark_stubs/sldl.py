@@ -0,0 +1,63 @@
+# Offline stand-in for sldl, used by benchmark.py through SLDL_COMMAND.
+# Instead of searching Soulseek, it writes a playlist folder the way sldl does: SLDL_STUB_TRACKS small 320kbps MP3s,
+# a _playlist.m3u8 and an _index.sldl, in ../tracks_and_playlists/<name of the input CSV or URL> (or under --path).
+# A CSV with Artist and Title columns (as written by retry_failed_downloads.py) gets one file per row instead, with
+# every SLDL_STUB_FAIL_EVERY-th row recorded as failed.
+# Set SLDL_STUB_SECONDS to simulate a fixed download time per playlist.
+
+import csv
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from synthetic_library import write_mp3
+
+LIBRARY = os.path.join('..', 'tracks_and_playlists')
+
+def playlist_name(source):
+    if source.lower().endswith('.csv'):
+        return os.path.splitext(os.path.basename(source))[0]
+    return source.rstrip('/').rsplit('/', 1)[-1]
+
+def listed_tracks(source):
+    """Returns the (artist, title) rows of a CSV input with Artist and Title columns, or None for other inputs."""
+    if not source.lower().endswith('.csv') or not os.path.isfile(source):
+        return None
+    with open(source, 'r', newline='', encoding='utf-8') as f:
+        rows = list(csv.DictReader(f))
+    if not rows or 'Artist' not in rows[0] or 'Title' not in rows[0]:
+        return None
+    return [(row['Artist'], row['Title']) for row in rows]
+
+def quote(field):
+    return f'"{field}"' if any(character in field for character in ',;"') else field
+
+if __name__ == '__main__':
+    # Options ("--profile name", "--desperate", ...) come first and the input comes last
+    source = sys.argv[-1]
+    library = sys.argv[sys.argv.index('--path') + 1] if '--path' in sys.argv else LIBRARY
+    playlist_dir = os.path.join(library, playlist_name(source))
+    os.makedirs(playlist_dir, exist_ok=True)
+
+    time.sleep(float(os.environ.get('SLDL_STUB_SECONDS', '0')))
+    tracks = listed_tracks(source)
+    if tracks is None:
+        tracks = [(f"Artist {index}", f"{playlist_name(source)} {index:03d}")
+                  for index in range(int(os.environ.get('SLDL_STUB_TRACKS', '10')))]
+    fail_every = int(os.environ.get('SLDL_STUB_FAIL_EVERY', '0'))
+    file_names = []
+    entries = []
+    for index, (artist, title) in enumerate(tracks):
+        if fail_every and index % fail_every == fail_every - 1:
+            entries.append(f",{quote(artist)},,{quote(title)},180,0,2,3;")
+            continue
+        file_name = f"{artist} - {title}.mp3"
+        write_mp3(os.path.join(playlist_dir, file_name), 320)
+        file_names.append(file_name)
+        entries.append(f"{quote(file_name)},{quote(artist)},,{quote(title)},180,0,1,0;")
+
+    with open(os.path.join(playlist_dir, '_playlist.m3u8'), 'w', encoding='utf-8') as f:
+        f.writelines(f"{file_name}\n" for file_name in file_names)
+    with open(os.path.join(playlist_dir, '_index.sldl'), 'w', encoding='utf-8') as f:
+        f.write('#SLDL:' + ''.join(entries))
@@ -0,0 +1,152 @@
+# Long-running listener for sldl completion events.
+# `notify_completed_download.py` (the on-complete hook in sldl.conf) forwards each event here over a local socket, so the
+# per-track hook no longer has to open the failed downloads store itself. Events are queued, applied in batches under a
+# single write lock with the same remove/append semantics as `process_completed_download.process_download`, and the
+# failed downloads CSV is re-exported periodically.
+# `download_and_process_playlists.py` starts the listener for the duration of a run; it can also be run on its own:
+# Usage: python completion_daemon.py
+
+import json
+import queue
+import socketserver
+import threading
+import time
+import traceback
+from failed_downloads_store import FailedDownloadStore
+from log_error_to_file import log_error_to_file
+from run_metrics import timed
+from process_completed_download import log_debug, process_download
+
+# Address the daemon listens on; notify_completed_download.py connects to the same address
+DAEMON_ADDRESS = ('127.0.0.1', 47813)
+
+# Maximum number of events applied in one transaction, and how long to wait for a batch to fill up
+BATCH_SIZE = 100
+BATCH_WINDOW = 0.5
+
+class CompletionEventHandler(socketserver.StreamRequestHandler):
+    """Reads newline-delimited JSON events from a client and acknowledges each one once it is queued."""
+
+    def handle(self):
+        for line in self.rfile:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                file_details = json.loads(line.decode('utf-8'))
+            except ValueError as e:
+                self.wfile.write(b"error\n")
+                log_error_to_file(__file__, f"Malformed completion event: {line!r}: {e}")
+                continue
+            self.server.events.put(file_details)
+            self.wfile.write(b"ok\n")
+
+class CompletionDaemon(socketserver.ThreadingTCPServer):
+    """
+    Socket server that queues completion events and applies them to the failed downloads store in batches.
+
+    Args:
+        address (tuple): (host, port) to listen on.
+        listeners (list): Optional callables invoked with each event after it has been applied.
+    """
+
+    daemon_threads = True
+    # SO_REUSEADDR would let a second daemon bind the same port on Windows, so it is left off
+    allow_reuse_address = False
+
+    def __init__(self, address=DAEMON_ADDRESS, listeners=None):
+        super().__init__(address, CompletionEventHandler)
+        self.events = queue.Queue()
+        self.listeners = list(listeners or [])
+        self.stopping = threading.Event()
+        self.server_thread = None
+        self.worker_thread = None
+
+    def next_batch(self):
+        """Blocks for the first event, then collects more for up to BATCH_WINDOW seconds."""
+        try:
+            batch = [self.events.get(timeout=BATCH_WINDOW)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + BATCH_WINDOW
+        while len(batch) < BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.events.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def apply_batch(self, store, batch):
+        with timed("batch", stage="completion_events") as timer, store.write_transaction():
+            timer.files = len(batch)
+            for file_details in batch:
+                process_download(file_details, store)
+        log_debug(f"Applied {len(batch)} completion event(s)")
+
+        for file_details in batch:
+            for listener in self.listeners:
+                try:
+                    listener(file_details)
+                except Exception:
+                    log_error_to_file(__file__, f"Completion listener failed:\n{traceback.format_exc()}")
+
+    def process_events(self):
+        store = FailedDownloadStore()
+        try:
+            # Keep draining after a stop request so that no acknowledged event is lost
+            while not (self.stopping.is_set() and self.events.empty()):
+                batch = self.next_batch()
+                if not batch:
+                    continue
+                try:
+                    self.apply_batch(store, batch)
+                    store.export_csv_if_stale()
+                except Exception:
+                    log_error_to_file(__file__, f"Failed to apply completion events:\n{traceback.format_exc()}")
+            store.export_csv()
+        finally:
+            store.close()
+
+    def start(self):
+        """Starts serving and processing events on background threads."""
+        self.server_thread = threading.Thread(target=self.serve_forever, name="completion-daemon-server", daemon=True)
+        self.worker_thread = threading.Thread(target=self.process_events, name="completion-daemon-worker", daemon=True)
+        self.server_thread.start()
+        self.worker_thread.start()
+        log_debug(f"Listening for completion events on {self.server_address[0]}:{self.server_address[1]}")
+        return self
+
+    def stop(self):
+        """Stops accepting events, applies everything already queued and exports the CSV."""
+        self.shutdown()
+        self.server_close()
+        self.stopping.set()
+        if self.worker_thread is not None:
+            self.worker_thread.join()
+
+def start_daemon(listeners=None):
+    """
+    Starts a completion daemon in the background.
+
+    Returns:
+        CompletionDaemon: The running daemon, or None if the address is already in use (e.g. another daemon is
+        running, in which case hooks will reach that one instead).
+    """
+    try:
+        return CompletionDaemon(DAEMON_ADDRESS, listeners).start()
+    except OSError as e:
+        log_debug(f"Completion daemon not started: {e}")
+        return None
+
+if __name__ == "__main__":
+    daemon = CompletionDaemon(DAEMON_ADDRESS).start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print("\nStopping completion daemon...")
+    finally:
+        daemon.stop()
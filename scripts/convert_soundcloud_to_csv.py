@@ -1,6 +1,9 @@
 # Uses Selenium to scrape a SoundCloud playlist and save the track information to a CSV file.
 # The CSV file is later used to download the tracks using slsk-batchdl.
 # This is necessary because slsk-batchdl does not support SoundCloud URLs directly, but it does support csv files.
+# Tracks are read from the page's embedded hydration data where possible (see soundcloud_hydration.py); rendering the
+# page in Selenium and parsing it with BeautifulSoup is the fallback.
+# A SoundCloudScraper session can be passed in to reuse one browser across all the SoundCloud playlists in a run.
 
 import sys
 import os
@@ -8,10 +11,14 @@ import logging
 from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.common.exceptions import TimeoutException
 from bs4 import BeautifulSoup
 import csv
-import time
+import requests
 from log_error_to_file import log_error_to_file
+from soundcloud_hydration import extract_playlist_tracks
+from run_metrics import timed
 
 # Path to your WebDriver (update with the correct path for your system)
 CHROME_DRIVER_PATH = r"C:\Program Files\Google\chromedriver-win64\chromedriver.exe"
@@ -22,77 +29,180 @@ logging.basicConfig(
     format="%(asctime)s - %(levelname)s - %(message)s",
 )
 
-def scroll_to_bottom(driver):
+# How long to wait for the track list to appear, and for more tracks to load after each scroll
+PAGE_LOAD_TIMEOUT = 30
+SCROLL_TIMEOUT = 10
+
+TRACK_ITEM_SELECTOR = 'li.trackList__item'
+
+# Requests the scraper never needs: artwork and other images, fonts, and audio/video streams
+BLOCKED_URL_PATTERNS = [
+    "*.jpg", "*.jpeg", "*.png", "*.gif", "*.webp", "*.svg", "*.ico",
+    "*.woff", "*.woff2", "*.ttf", "*.otf",
+    "*.mp3", "*.m4a", "*.opus", "*.ogg", "*.m3u8", "*.mp4",
+    "*sndcdn.com/artworks*", "*sndcdn.com/avatars*", "*media.sndcdn.com*",
+]
+
+def count_track_items(driver):
+    return driver.execute_script(f"return document.querySelectorAll('{TRACK_ITEM_SELECTOR}').length")
+
+def get_declared_track_count(driver):
+    """Returns the track total SoundCloud declares for the playlist, or None if it can't be found."""
+    try:
+        return driver.execute_script(
+            "const playlist = (window.__sc_hydration || []).find(h => h.hydratable === 'playlist');"
+            "return playlist && playlist.data ? playlist.data.track_count : null;"
+        )
+    except Exception:
+        return None
+
+def scroll_to_bottom(driver, expected_count=None):
     """
-    Scrolls to the bottom of the page to load all content.
-    
+    Scrolls to the bottom of the page until all tracks have loaded.
+
+    Instead of sleeping for a fixed time after each scroll, waits until more tracks appear in the list. Stops as soon
+    as the number of tracks matches the playlist's declared total, or when a scroll loads nothing new.
+
     Args:
         driver (webdriver.Chrome): The WebDriver instance.
+        expected_count (int): The playlist's declared track total, if known.
     """
-    last_height = driver.execute_script("return document.body.scrollHeight")
-    while True:
+    count = count_track_items(driver)
+    while expected_count is None or count < expected_count:
         driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-        time.sleep(2)  # Wait for new content to load
-        new_height = driver.execute_script("return document.body.scrollHeight")
-        if new_height == last_height:
-            break
-        last_height = new_height
-
-def scrape_soundcloud_playlist(url, output_csv):
+        try:
+            WebDriverWait(driver, SCROLL_TIMEOUT, poll_frequency=0.25).until(
+                lambda d: count_track_items(d) > count
+            )
+        except TimeoutException:
+            break  # Nothing more loaded
+        count = count_track_items(driver)
+    logging.debug(f"Loaded {count} tracks (declared: {expected_count}).")
+
+class SoundCloudScraper:
     """
-    Scrapes a SoundCloud playlist and saves the track information to a CSV file.
+    Scraping session that reuses one headless Chrome for every playlist in a run.
 
-    Args:
-        url (str): The URL of the SoundCloud playlist.
-        output_csv (str): The filename of the CSV file to save data.
+    Images, fonts and media are blocked so pages load only what is needed to list the tracks. The browser is only
+    started if a playlist has to fall back to the rendered page; hydration data requests share one HTTP session.
+    Use as a context manager, or call close() when finished. A session must only be used from one thread at a time.
     """
-    try:
+
+    def __init__(self):
+        self.driver = None
+        self.http_session = requests.Session()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def start_driver(self):
         logging.info("Initializing WebDriver.")
-        # Set up the WebDriver
         service = Service(CHROME_DRIVER_PATH)
         options = webdriver.ChromeOptions()
         options.add_argument("--headless")  # Run in headless mode
         options.add_argument("--mute-audio")  # Prevent SoundCloud starting playback
+        options.add_argument("--blink-settings=imagesEnabled=false")
         options.add_experimental_option("excludeSwitches", ["enable-logging"])
+        options.add_experimental_option("prefs", {
+            "profile.managed_default_content_settings.images": 2,
+            "profile.managed_default_content_settings.media_stream": 2,
+        })
         driver = webdriver.Chrome(service=service, options=options)
-        
-        # import logging
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": BLOCKED_URL_PATTERNS})
+
         logger = logging.getLogger('urllib3.connectionpool')
         logger.setLevel(logging.INFO)
 
         logger = logging.getLogger('selenium.webdriver.remote.remote_connection')
         logger.setLevel(logging.WARNING)
+        return driver
+
+    def get_page_source(self, url):
+        """Loads a playlist, scrolls until every track is listed and returns the rendered page source."""
+        if self.driver is None:
+            self.driver = self.start_driver()
+
+        try:
+            logging.info(f"Loading URL: {url}")
+            self.driver.get(url)
+            # Wait for the first tracks to render (or for an empty playlist) rather than a fixed sleep
+            WebDriverWait(self.driver, PAGE_LOAD_TIMEOUT, poll_frequency=0.25).until(
+                lambda d: count_track_items(d) > 0 or get_declared_track_count(d) == 0
+            )
+
+            logging.debug("Scrolling to load all content.")
+            with timed("playlist", stage="selenium_scroll", playlist=url) as timer:
+                scroll_to_bottom(self.driver, get_declared_track_count(self.driver))
+                timer.files = count_track_items(self.driver)
+
+            logging.debug("Retrieving page source.")
+            return self.driver.page_source
+        except Exception:
+            # Start from a fresh browser for the next playlist in case this one left it in a bad state
+            self.quit_driver()
+            raise
+
+    def quit_driver(self):
+        if self.driver is not None:
+            try:
+                self.driver.quit()  # Close the browser
+            finally:
+                self.driver = None
+
+    def close(self):
+        self.http_session.close()
+        self.quit_driver()
+
+def scrape_tracks_from_dom(url, scraper=None):
+    """Renders the playlist in the browser and reads [artist, track] rows from its track list."""
+    if scraper is None:
+        with SoundCloudScraper() as own_scraper:
+            page_source = own_scraper.get_page_source(url)
+    else:
+        page_source = scraper.get_page_source(url)
+
+    logging.debug("Parsing page content.")
+    # Parse the HTML content with BeautifulSoup
+    soup = BeautifulSoup(page_source, 'html.parser')
+
+    # Find the playlist items
+    playlist_items = soup.select(TRACK_ITEM_SELECTOR)
+
+    # Prepare the data
+    data = []
+    for item in playlist_items:
+        artist_tag = item.select_one('.trackItem__username')
+        track_tag = item.select_one('.trackItem__trackTitle')
+        if artist_tag and track_tag:
+            artist = artist_tag.text.strip()
+            track = track_tag.text.strip()
+            logging.debug(f"Found track: Artist = {artist}, Track = {track}")
+            data.append([artist, track])
+    return data
+
+def scrape_soundcloud_playlist(url, output_csv, scraper=None):
+    """
+    Scrapes a SoundCloud playlist and saves the track information to a CSV file.
 
-        logging.info(f"Loading URL: {url}")
-        # Load the URL
-        driver.get(url)
-        time.sleep(5)  # Wait for the page to load completely
-
-        logging.debug("Scrolling to load all content.")
-        scroll_to_bottom(driver)  # Scroll to load all content
-
-        logging.debug("Retrieving page source.")
-        # Get the page source after rendering JavaScript
-        page_source = driver.page_source
-        driver.quit()  # Close the browser
-
-        logging.debug("Parsing page content.")
-        # Parse the HTML content with BeautifulSoup
-        soup = BeautifulSoup(page_source, 'html.parser')
-
-        # Find the playlist items
-        playlist_items = soup.select('li.trackList__item')
-
-        # Prepare the data
-        data = []
-        for item in playlist_items:
-            artist_tag = item.select_one('.trackItem__username')
-            track_tag = item.select_one('.trackItem__trackTitle')
-            if artist_tag and track_tag:
-                artist = artist_tag.text.strip()
-                track = track_tag.text.strip()
-                logging.debug(f"Found track: Artist = {artist}, Track = {track}")
-                data.append([artist, track])
+    Args:
+        url (str): The URL of the SoundCloud playlist.
+        output_csv (str): The filename of the CSV file to save data.
+        scraper (SoundCloudScraper): Session to reuse. If omitted, a browser is started for this playlist only.
+    """
+    try:
+        with timed("playlist", stage="scrape_soundcloud", playlist=url) as timer:
+            try:
+                data = extract_playlist_tracks(url, scraper.http_session if scraper else None)
+                timer.fields['method'] = "hydration"
+            except Exception as e:
+                logging.warning(f"Could not read hydration data ({e}); falling back to the rendered page.")
+                data = scrape_tracks_from_dom(url, scraper)
+                timer.fields['method'] = "dom"
+            timer.files = len(data)
 
         # Ensure the directory exists
         os.makedirs(os.path.dirname(output_csv), exist_ok=True)
@@ -111,7 +221,7 @@ def scrape_soundcloud_playlist(url, output_csv):
         log_error_to_file(__file__, error_message)
         raise  # Re-raise the exception for further handling
     
-def convert_soundcloud_to_csv(url):
+def convert_soundcloud_to_csv(url, scraper=None):
     try:
         # Get the URL and derive the CSV filename
         output_csv = "soundcloud_playlists/" + url.split("/")[-1] + ".csv"
@@ -120,7 +230,7 @@ def convert_soundcloud_to_csv(url):
         logging.info(f"Output CSV will be: {output_csv}")
 
         # Call the scraping function
-        scrape_soundcloud_playlist(url, output_csv)
+        scrape_soundcloud_playlist(url, output_csv, scraper)
         return output_csv  # Return the CSV path
     except Exception as e:
         logging.error("Unhandled exception occurred. Exiting.")
@@ -0,0 +1,332 @@
+# Finds tracks that were downloaded more than once (sldl writes every playlist into its own folder) and collapses the
+# copies into one file on disk with hard links.
+# Files are compared by a hash of their audio data only, ignoring tags (ID3, APE and FLAC/WAV metadata), so copies that
+# were tagged differently are still found. Hashes are cached in the library's .content_hashes.sqlite against each file's
+# size and modification time, and only files whose audio data is the same length as another file's are hashed at all.
+# Where a hard link can't be made (e.g. the file system doesn't support them), the duplicate is deleted and the
+# playlists and indexes that referred to it are pointed at the kept copy instead.
+# A pass can be limited to some folders (e.g. the ones a run changed): only their files are read, and they are compared
+# against the rest of the library through the cache, so files that no full pass has seen yet aren't matched.
+# Usage: python dedupe_library.py <directory> [--dry-run]
+
+import argparse
+import hashlib
+import os
+import sqlite3
+import struct
+import threading
+from collections import defaultdict
+from log_error_to_file import log_error_to_file
+from playlist_index import PlaylistRewriter
+from run_metrics import stage
+
+HASH_CACHE_FILE_NAME = '.content_hashes.sqlite'
+
+AUDIO_EXTENSIONS = ('.mp3', '.flac', '.wav', '.aac', '.ogg')
+
+# Suffix of the temporary link that is renamed over a duplicate
+LINK_SUFFIX = '.dedupe-link'
+
+READ_SIZE = 1024 * 1024
+
+def syncsafe(data):
+    return (data[0] << 21) | (data[1] << 14) | (data[2] << 7) | data[3]
+
+def mp3_audio_range(f, size):
+    """Returns the (start, end) of an MP3's frames, excluding ID3v2, ID3v1 and APEv2 tags."""
+    start, end = 0, size
+    header = f.read(10)
+    while len(header) == 10 and header[:3] == b'ID3':
+        # Some files carry more than one ID3v2 tag back to back
+        start += 10 + syncsafe(header[6:10]) + (10 if header[5] & 0x10 else 0)
+        f.seek(start)
+        header = f.read(10)
+
+    if end - start >= 128:
+        f.seek(end - 128)
+        if f.read(3) == b'TAG':
+            end -= 128
+    if end - start >= 32:
+        f.seek(end - 32)
+        footer = f.read(32)
+        if footer[:8] == b'APETAGEX':
+            # The tag size excludes the APE header, which is present if bit 31 of the flags is set
+            tag_size, flags = struct.unpack('<I4xI', footer[12:24])
+            end -= tag_size + (32 if flags & 0x80000000 else 0)
+    return start, max(start, end)
+
+def flac_audio_range(f, size):
+    """Returns the (start, end) of a FLAC stream's frames, after its metadata blocks."""
+    if f.read(4) != b'fLaC':
+        return 0, size
+    position = 4
+    while True:
+        block_header = f.read(4)
+        if len(block_header) < 4:
+            return 0, size
+        position += 4 + int.from_bytes(block_header[1:4], 'big')
+        if block_header[0] & 0x80:
+            return position, size
+        f.seek(position)
+
+def wav_audio_range(f, size):
+    """Returns the (start, end) of a RIFF/WAVE file's data chunk."""
+    if f.read(12)[8:12] != b'WAVE':
+        return 0, size
+    position = 12
+    while position + 8 <= size:
+        f.seek(position)
+        chunk_id, chunk_size = struct.unpack('<4sI', f.read(8))
+        if chunk_id == b'data':
+            return position + 8, min(size, position + 8 + chunk_size)
+        position += 8 + chunk_size + (chunk_size & 1)
+    return 0, size
+
+AUDIO_RANGE_READERS = {'.mp3': mp3_audio_range, '.flac': flac_audio_range, '.wav': wav_audio_range}
+
+def audio_range(file_path, size):
+    """Returns the (start, end) byte range of a file's audio data; the whole file for formats that aren't parsed."""
+    reader = AUDIO_RANGE_READERS.get(os.path.splitext(file_path)[1].lower())
+    if reader is None:
+        return 0, size
+    with open(file_path, 'rb') as f:
+        return reader(f, size)
+
+def hash_audio(file_path, start, end):
+    digest = hashlib.blake2b(digest_size=20)
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            chunk = f.read(min(READ_SIZE, remaining))
+            if not chunk:
+                break
+            digest.update(chunk)
+            remaining -= len(chunk)
+    return digest.hexdigest()
+
+class ContentHashCache:
+    """
+    SQLite-backed cache of each file's audio range and audio hash, valid while its size and modification time are
+    unchanged. Safe to share between threads.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS hashes (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                audio_start INTEGER NOT NULL,
+                audio_end INTEGER NOT NULL,
+                hash TEXT
+            )"""
+        )
+        # Scoped passes look files up by the length of their audio data
+        self.connection.execute("CREATE INDEX IF NOT EXISTS hashes_audio_length ON hashes (audio_end - audio_start)")
+        self.connection.commit()
+
+    @classmethod
+    def for_directory(cls, directory):
+        return cls(os.path.join(directory, HASH_CACHE_FILE_NAME))
+
+    @staticmethod
+    def key(file_path):
+        return os.path.normcase(os.path.abspath(file_path))
+
+    def get(self, file_path, stat):
+        """Returns (audio_start, audio_end, hash or None) for file_path, or None if it is not cached or stale."""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT size, mtime_ns, audio_start, audio_end, hash FROM hashes WHERE path = ?", (self.key(file_path),)
+            ).fetchone()
+        if row is None or row[0] != stat.st_size or row[1] != stat.st_mtime_ns:
+            return None
+        return row[2], row[3], row[4]
+
+    def put(self, file_path, stat, audio_start, audio_end, audio_hash=None):
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO hashes (path, size, mtime_ns, audio_start, audio_end, hash) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (self.key(file_path), stat.st_size, stat.st_mtime_ns, audio_start, audio_end, audio_hash)
+            )
+
+    def paths_with_audio_length(self, length):
+        """Returns the cached paths whose audio data is length bytes long. Their entries may be stale."""
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT path FROM hashes WHERE audio_end - audio_start = ?", (length,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def close(self):
+        with self.lock:
+            self.connection.commit()
+            self.connection.close()
+
+def find_audio_files(directory):
+    for subdir, _, files in os.walk(directory):
+        for file in files:
+            if file.lower().endswith(AUDIO_EXTENSIONS):
+                yield os.path.join(subdir, file)
+
+def find_duplicates(directory, cache, folders=None):
+    """
+    Returns groups of files with identical audio data, each a list of paths with at least two distinct files.
+
+    Files that are already hard links of each other count as one file. If folders is given, only the files in those
+    folders are read, and they are matched against the files elsewhere in the library that the cache knows about.
+    """
+    if folders is None:
+        file_paths = find_audio_files(directory)
+    else:
+        file_paths = (file_path for folder in sorted(set(folders)) for file_path in find_audio_files(folder))
+
+    by_length = defaultdict(list)
+    stats = {}
+    for file_path in file_paths:
+        try:
+            stat = os.stat(file_path)
+            cached = cache.get(file_path, stat)
+            if cached is None:
+                start, end = audio_range(file_path, stat.st_size)
+                cache.put(file_path, stat, start, end)
+                cached = (start, end, None)
+        except OSError as e:
+            log_error_to_file(__file__, f"Error reading {file_path}: {e}")
+            continue
+        stats[file_path] = (stat, cached)
+        extension = os.path.splitext(file_path)[1].lower()
+        by_length[(extension, cached[1] - cached[0])].append(file_path)
+
+    if folders is not None:
+        seen = {ContentHashCache.key(file_path) for file_path in stats}
+        for extension, length in list(by_length):
+            for file_path in cache.paths_with_audio_length(length):
+                if file_path in seen or not file_path.lower().endswith(extension):
+                    continue
+                try:
+                    stat = os.stat(file_path)
+                except OSError:
+                    # Gone since the cache entry was written
+                    continue
+                cached = cache.get(file_path, stat)
+                if cached is None:
+                    # Changed since it was cached; the next full pass reads it again
+                    continue
+                seen.add(file_path)
+                stats[file_path] = (stat, cached)
+                by_length[(extension, length)].append(file_path)
+
+    by_hash = defaultdict(list)
+    for (extension, _), file_paths in by_length.items():
+        if len({(stats[path][0].st_dev, stats[path][0].st_ino) for path in file_paths}) < 2:
+            # Only one distinct file has audio of this length, so it can't have a duplicate
+            continue
+        for file_path in file_paths:
+            stat, (start, end, audio_hash) = stats[file_path]
+            if audio_hash is None:
+                try:
+                    audio_hash = hash_audio(file_path, start, end)
+                except OSError as e:
+                    log_error_to_file(__file__, f"Error hashing {file_path}: {e}")
+                    continue
+                cache.put(file_path, stat, start, end, audio_hash)
+            by_hash[(extension, audio_hash)].append(file_path)
+
+    groups = []
+    for file_paths in by_hash.values():
+        if len({(stats[path][0].st_dev, stats[path][0].st_ino) for path in file_paths}) > 1:
+            groups.append(sorted(file_paths, key=lambda path: (-stats[path][0].st_nlink, path)))
+    return groups
+
+def link_duplicate(canonical_path, duplicate_path):
+    """Replaces duplicate_path with a hard link to canonical_path. Raises OSError if links aren't possible."""
+    link_path = duplicate_path + LINK_SUFFIX
+    if os.path.lexists(link_path):
+        os.remove(link_path)
+    os.link(canonical_path, link_path)
+    try:
+        os.replace(link_path, duplicate_path)
+    except OSError:
+        os.remove(link_path)
+        raise
+
+def dedupe_library(directory, dry_run=False, folders=None):
+    """
+    Collapses duplicate tracks in directory into hard links of one copy.
+    If folders is given, only the duplicates of the files in those folders are looked for.
+
+    Returns:
+        tuple: (number of duplicate files collapsed, bytes reclaimed)
+    """
+    if not os.path.isdir(directory):
+        print(f"The provided path is not a valid directory: {directory}")
+        return 0, 0
+
+    cache = ContentHashCache.for_directory(directory)
+    rewriter = PlaylistRewriter(directory)
+    collapsed = reclaimed = 0
+    try:
+        with stage("dedupe", directory=directory, dry_run=dry_run, scoped=folders is not None) as timer:
+            groups = find_duplicates(directory, cache, folders)
+            for group in groups:
+                canonical_path = group[0]
+                canonical_stat = os.stat(canonical_path)
+                for duplicate_path in group[1:]:
+                    duplicate_stat = os.stat(duplicate_path)
+                    if (duplicate_stat.st_dev, duplicate_stat.st_ino) == (canonical_stat.st_dev, canonical_stat.st_ino):
+                        continue
+                    if dry_run:
+                        print(f"Duplicate: {duplicate_path} (same audio as {canonical_path})")
+                    else:
+                        try:
+                            link_duplicate(canonical_path, duplicate_path)
+                            # The duplicate now has the canonical file's size and mtime; carry its hash over
+                            cached = cache.get(canonical_path, canonical_stat)
+                            if cached is not None:
+                                cache.put(duplicate_path, canonical_stat, *cached)
+                            print(f"Linked {duplicate_path} -> {canonical_path}")
+                        except OSError:
+                            # No hard links here: drop the copy and point its playlists at the kept file instead
+                            try:
+                                os.remove(duplicate_path)
+                            except OSError as e:
+                                # e.g. open in a player on Windows, or read-only; it is tried again on the next pass
+                                error_message = f"Could not remove duplicate {duplicate_path}: {e}"
+                                print(error_message)
+                                log_error_to_file(__file__, error_message)
+                                continue
+                            rewriter.add(duplicate_path, canonical_path)
+                            print(f"Removed {duplicate_path}; playlists now refer to {canonical_path}")
+                    collapsed += 1
+                    # Only the last link to a file frees its space
+                    if duplicate_stat.st_nlink == 1:
+                        reclaimed += duplicate_stat.st_size
+            timer.files = collapsed
+            timer.bytes = reclaimed
+            timer.fields['groups'] = len(groups)
+    except Exception as e:
+        error_message = f"Error deduplicating {directory}: {e}"
+        print(error_message)
+        log_error_to_file(__file__, error_message)
+    finally:
+        rewriter.flush()
+        cache.close()
+
+    action = "Found" if dry_run else "Collapsed"
+    print(f"{action} {collapsed} duplicate file(s), {reclaimed / (1024 * 1024):.1f} MB.")
+    return collapsed, reclaimed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Collapse duplicate tracks in a library into hard links.")
+    parser.add_argument("directory", nargs="?", default=None, help="Library directory (prompted for if omitted).")
+    parser.add_argument("--dry-run", action="store_true", help="Only report the duplicates.")
+    args = parser.parse_args()
+    directory = args.directory or input("Please enter the top-level directory: ").strip()
+    dedupe_library(directory, args.dry_run)
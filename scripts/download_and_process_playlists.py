@@ -1,13 +1,41 @@
 # Download and process Spotify and SoundCloud playlists using sldl and other scripts.
 # This is the 'master' script that calls other scripts to download and process playlists.
+# Usage: python download_and_process_playlists.py [--max-concurrent N] [--profiles PROFILE [PROFILE ...]]
+# Playlists are downloaded concurrently (see playlist_scheduler.py); each concurrent sldl process needs its own
+# Soulseek login, so pass one sldl profile per download slot with --profiles.
+# Timings for each stage, playlist and file are written to scripts/metrics/ (see run_metrics.py); pass
+# --profile-stage with stage names (e.g. remux rename_playlists, or all) to also profile those stages.
+# Playlists are synced stalest first and an interrupted run carries on where it stopped (see playlist_state.py); pass
+# --skip-window DAYS to skip playlists that were unchanged at a sync within that many days, and --restart to start
+# from the top instead of resuming.
+# Renaming and remuxing only look at the playlist folders this run changed (see run_manifest.py); pass --full to sweep
+# the whole library instead.
+# After the playlists, failed downloads that are due for a retry are retried in batches (see retry_failed_downloads.py);
+# pass --no-retry to skip that.
+# Pass --plan to only print which playlists would be synced and what post-processing the library needs (see
+# run_plan.py), and --max-encode-minutes / --max-bytes-written to cap the remuxing a run does (see run_budget.py);
+# files beyond the budget are left for the next run.
 
-import os
+import argparse
 import subprocess
+import sys
 import csv
 from log_error_to_file import log_error_to_file
-from convert_soundcloud_to_csv import convert_soundcloud_to_csv
+from playlist_scheduler import PlaylistScheduler, slot_arguments, print_failures
+from playlist_state import PlaylistStateStore
 from rename_playlists import rename_playlists
-from remux_to_mp3_320 import remux_to_mp3_320
+from remux_to_mp3_320 import remux_to_mp3_320, StreamingRemuxer
+from encoders import AUTO, ENCODERS, select_encoder
+import loudness
+from dedupe_library import dedupe_library
+from failed_downloads_store import FailedDownloadStore
+from retry_failed_downloads import retry_failed_downloads
+from completion_daemon import start_daemon
+from run_manifest import RunManifest
+from run_metrics import Timer, emit, enable_profiling, stage
+from run_budget import RunBudget, parse_size
+
+LIBRARY = "../tracks_and_playlists/"
 
 def read_playlists_from_file(file_path):
     playlists = []
@@ -23,30 +51,108 @@ def read_playlists_from_file(file_path):
                     playlists.append(url)
     return playlists
 
+parser = argparse.ArgumentParser(description="Download and process the playlists in playlists.csv.")
+parser.add_argument("--max-concurrent", type=int, default=1,
+                    help="Number of sldl processes to run at once when no profiles are given (they share one login).")
+parser.add_argument("--profiles", nargs="+", default=None,
+                    help="sldl profiles to run concurrently, one per download slot, each with its own Soulseek login.")
+parser.add_argument("--no-stream", action="store_true",
+                    help="Don't remux files as they finish downloading; leave everything to the final pass.")
+parser.add_argument("--profile-stage", nargs="+", default=None, metavar="STAGE",
+                    help="Run these stages under cProfile and tracemalloc (e.g. download_playlists remux, or all).")
+parser.add_argument("--skip-window", type=float, default=0, metavar="DAYS",
+                    help="Skip playlists whose track list was unchanged at a sync less than DAYS days ago.")
+parser.add_argument("--restart", action="store_true",
+                    help="Sync every playlist again instead of resuming an interrupted run.")
+parser.add_argument("--full", action="store_true",
+                    help="Rename and remux across the whole library, not just the folders this run changed.")
+parser.add_argument("--encoder", choices=[AUTO, *ENCODERS], default=None,
+                    help="How files are encoded to mp3: ffmpeg per file, pyav in-process, or auto to time both "
+                         "(default: REMUX_ENCODER, or auto).")
+parser.add_argument("--no-loudness", action="store_true",
+                    help="Don't measure loudness or write ReplayGain tags while remuxing.")
+parser.add_argument("--no-retry", action="store_true",
+                    help="Don't retry the failed downloads that are due (see retry_failed_downloads.py).")
+parser.add_argument("--plan", action="store_true",
+                    help="Only print which playlists would be synced and what post-processing the library needs.")
+parser.add_argument("--plan-output", default=None, metavar="FILE",
+                    help="With --plan, also write the full post-processing plan to this JSON file.")
+parser.add_argument("--max-encode-minutes", type=float, default=None,
+                    help="Remux at most this many minutes of audio in this run; the rest waits for the next run.")
+parser.add_argument("--max-bytes-written", type=parse_size, default=None, metavar="SIZE",
+                    help="Write at most this much remuxed audio (e.g. 500M or 2G) in this run.")
+args = parser.parse_args()
+
+if args.profile_stage:
+    enable_profiling(args.profile_stage)
+if args.encoder:
+    select_encoder(args.encoder)
+if args.no_loudness:
+    loudness.set_enabled(False)
+budget = None
+if args.max_encode_minutes is not None or args.max_bytes_written is not None:
+    budget = RunBudget(args.max_encode_minutes, args.max_bytes_written)
+
+def print_run_plan():
+    """Prints the playlists this run would sync and the post-processing the library needs as it stands."""
+    from run_plan import plan_library, print_plan, write_plan
+    playlists = read_playlists_from_file('../playlists.csv')
+    items = [(item[0], item[1], item) if isinstance(item, tuple) else (item, None, item) for item in playlists]
+    with PlaylistStateStore() as playlist_state:
+        # The same resume decision as the run itself, so playlists an interrupted run already synced aren't listed
+        if playlist_state.peek_run(resume=not args.restart):
+            print("An interrupted run would be resumed.")
+        ordered, skipped = playlist_state.plan(items, args.skip_window * 86400)
+    print(f"Playlists to sync, in order ({len(ordered)}):")
+    for item in ordered:
+        print(f"  {item[1] if isinstance(item, tuple) else item}")
+    for item, reason in skipped:
+        print(f"Skipped: {item[1] if isinstance(item, tuple) else item} ({reason})")
+
+    # Without --full only the folders an earlier unfinished run changed are pending; this run's downloads add to them
+    paths = None if args.full else RunManifest(LIBRARY).sorted_folders()
+    print(f"\nPost-processing {'the whole library' if paths is None else f'{len(paths)} pending folder(s)'}:")
+    plan = plan_library(LIBRARY, paths, budget)
+    print_plan(plan)
+    if args.plan_output:
+        write_plan(plan, args.plan_output)
+
+if args.plan:
+    print_run_plan()
+    sys.exit(0)
+
+run_timer = Timer()
+
+# Remux each file as soon as sldl reports it downloaded, so transcoding overlaps the (network-bound) downloads
+streaming_remuxer = None if args.no_stream else StreamingRemuxer(LIBRARY, budget=budget)
+
+# Record what this run downloads, so post-processing can skip the rest of the library
+manifest = RunManifest(LIBRARY)
+
+# Receive sldl's on-complete events in this process rather than one interpreter per track
+listeners = [manifest.on_completion_event]
+if streaming_remuxer is not None:
+    listeners.append(streaming_remuxer.on_completion_event)
+completion_daemon = start_daemon(listeners)
+
 try:
     # Read playlists from file
     playlists = read_playlists_from_file('../playlists.csv')
-    total_playlists = len(playlists)
-
-    # Process all playlists
-    for index, item in enumerate(playlists):
-        print(f"\n\nProcessing playlist {index + 1}/{total_playlists}")
-        if isinstance(item, tuple):
-            url, comment = item
-            if "spotify.com" in url:
-                print(f"Downloading Spotify playlist: {comment}")
-                subprocess.run(["sldl", url], check=True)
-        elif isinstance(item, str) and "soundcloud.com" in item:
-            print(f"\nProcessing SoundCloud playlist: {item}")
-            
-            print("\nParsing SoundCloud playlist and printing to CSV...")
-            csv_path = convert_soundcloud_to_csv(item)
-            
-            print(f"\nPassing SoundCloud CSV to sldl: {csv_path}")
-            subprocess.run(["sldl", "--desperate", "--strict-artist", csv_path], check=True)
-            
-            print(f"\nRemoving CSV")
-            os.remove(csv_path)
+
+    # Process all playlists, several at a time; failed playlists are reported without stopping the others
+    slots = slot_arguments(args.profiles, args.max_concurrent)
+    if len(slots) > 1 and not args.profiles:
+        print("Warning: concurrent sldl processes sharing one Soulseek login may disconnect each other. Use --profiles.")
+    with PlaylistStateStore() as playlist_state:
+        scheduler = PlaylistScheduler(slots, state=playlist_state, skip_window=args.skip_window * 86400,
+                                      resume=not args.restart)
+        failures = scheduler.run(playlists)
+    print_failures(failures)
+
+    # Retry earlier failures in a few batched sldl runs rather than waiting for their playlists to be re-synced
+    if not args.no_retry:
+        print("\nRetrying failed downloads...")
+        retry_failed_downloads(scheduler.run_sldl)
 
 except KeyboardInterrupt:
     print("\nProcess interrupted by user. Proceeding to rename and remux tasks...")
@@ -62,12 +168,53 @@ except Exception as e:
     print(f"\nAn unexpected error occurred. Details written to the log file: {e}")
 
 finally:
+    # Bring failed_downloads.csv up to date with every completion event from this run
+    print("\nExporting failed downloads...")
+    try:
+        with stage("export_failed_downloads"):
+            if completion_daemon is not None:
+                # Applies any events still queued, then exports the CSV
+                completion_daemon.stop()
+            else:
+                with FailedDownloadStore() as store:
+                    store.export_csv()
+    except Exception as e:
+        log_error_to_file("download_and_process_playlists.py", f"Failed to export failed downloads: {e}")
+
+    # None means the whole library
+    changed_folders = None
+    try:
+        manifest.collect_folder_changes()
+        if not args.full:
+            changed_folders = manifest.sorted_folders()
+            print(f"\n{len(changed_folders)} playlist folder(s) changed in this run.")
+    except Exception as e:
+        log_error_to_file("download_and_process_playlists.py", f"Failed to collect the run manifest: {e}")
+
+    if streaming_remuxer is not None:
+        print("\nWaiting for files remuxed during the download...")
+        streaming_remuxer.finish(changed_folders)
+
     # Rename m3u8 playlists
     print("\nRenaming playlists...")
-    rename_playlists("../tracks_and_playlists/")
+    rename_playlists(LIBRARY, changed_folders)
 
-    # Remux all files to mp3 320kbps
+    # Collapse tracks downloaded into several playlist folders into hard links, so they are only remuxed once.
+    # Without --full only the changed folders are read; their duplicates elsewhere are found through the cached hashes
+    print("\nDeduplicating tracks...")
+    dedupe_library(LIBRARY, folders=changed_folders)
+
+    # Remux to mp3 320kbps; this also catches anything the streaming remux missed
     print("\nRemuxing files to mp3 320kbps...")
-    remux_to_mp3_320("../tracks_and_playlists/")
+    remux_to_mp3_320(LIBRARY, paths=changed_folders, budget=budget)
+
+    # Everything the manifest listed has now been post-processed, apart from the files the budget left for next time
+    manifest.clear()
+    if budget is not None and budget.deferred:
+        for file_path in budget.deferred:
+            manifest.add_file(file_path)
+        manifest.save()
 
+    run_timer.stop()
+    emit("stage", stage="run", **run_timer.summary())
     print("All tasks completed!")
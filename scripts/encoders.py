@@ -0,0 +1,257 @@
+# Encoder backends for remux_to_mp3_320.py. Each one encodes an audio file to 320kbps CBR MP3, carrying its tags over,
+# and measures its loudness with ffmpeg's ebur128 filter in the same decode pass (see loudness.py).
+#   * ffmpeg: runs the ffmpeg command line tool once per file (FFMPEG_COMMAND)
+#   * pyav: decodes and encodes in this process with PyAV (pip install av), whose wheels bundle ffmpeg's libraries and
+#     LAME, so no process is started per file. Both use the same LAME encoder and MP3 muxer, so the output is the same.
+# The backend is chosen with REMUX_ENCODER (or --encoder): "ffmpeg", "pyav", or "auto" (the default), which times
+# every available backend on a few seconds of generated audio the first time a file is converted and uses the fastest.
+# Files that don't need converting can be measured on their own with analyse(), which decodes without encoding.
+
+import math
+import os
+import shlex
+import shutil
+import struct
+import subprocess
+import tempfile
+import threading
+import time
+import wave
+from log_error_to_file import log_error_to_file
+from loudness import EBUR128_OPTIONS, parse_ebur128_metadata, parse_ebur128_summary
+
+try:
+    import av
+except ImportError:
+    av = None
+
+# Command used to run ffmpeg. Set FFMPEG_COMMAND to use a specific build, or a stand-in (see benchmark.py)
+FFMPEG_COMMAND = shlex.split(os.environ.get("FFMPEG_COMMAND", "ffmpeg"))
+
+AUTO = 'auto'
+
+BITRATE = 320000
+
+# Sample formats the PyAV backend encodes sources that LAME can't take as they are in, most precise first
+HIGH_RESOLUTION_FORMATS = ['fltp', 's32p']
+
+# Length of the generated audio the backends are timed on when choosing one automatically
+SAMPLE_SECONDS = 5
+
+class FfmpegEncoder:
+    name = 'ffmpeg'
+
+    def available(self):
+        if not FFMPEG_COMMAND:
+            return False
+        return shutil.which(FFMPEG_COMMAND[0]) is not None or os.path.isfile(FFMPEG_COMMAND[0])
+
+    def encode(self, source_path, output_path, measure=True):
+        """Encodes source_path into output_path. Returns the loudness result if measure is set, otherwise None."""
+        # ffmpeg command to remux to 320kbps MP3
+        command = [
+            *FFMPEG_COMMAND, '-y',  # Overwrite without prompting
+            '-nostdin', '-hide_banner',
+            # Only errors are kept, so a long batch doesn't buffer progress output. The loudness summary is logged at
+            # the info level, so that is kept when measuring.
+            '-loglevel', 'info' if measure else 'error',
+            '-i', source_path,  # Input file
+            *(['-af', f'ebur128={EBUR128_OPTIONS}'] if measure else []),  # Measure loudness; the audio is unchanged
+            '-b:a', '320k',  # Audio bitrate
+            '-map_metadata', '0',  # Copy metadata
+            '-vn',  # Exclude video (if any)
+            '-f', 'mp3',  # The staging file's extension doesn't tell ffmpeg the format
+            output_path  # Output staging file
+        ]
+        log = self.run(command)
+        return parse_ebur128_summary(log) if measure else None
+
+    def analyse(self, source_path):
+        """Measures the loudness of source_path without encoding it. Returns None if ffmpeg didn't report it."""
+        command = [
+            *FFMPEG_COMMAND, '-nostdin', '-hide_banner', '-loglevel', 'info',
+            '-i', source_path, '-vn', '-af', f'ebur128={EBUR128_OPTIONS}',
+            '-f', 'null', '-'  # Decode only
+        ]
+        return parse_ebur128_summary(self.run(command))
+
+    @staticmethod
+    def run(command):
+        """Runs an ffmpeg command and returns its log output."""
+        try:
+            result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True)
+        except subprocess.CalledProcessError as e:
+            print(f"Subprocess failed with return code {e.returncode}")
+            print(f"Subprocess stderr: {e.stderr.decode(errors='replace')}")
+            raise
+        return result.stderr.decode(errors='replace')
+
+class PyAVEncoder:
+    name = 'pyav'
+
+    def available(self):
+        if av is None:
+            return False
+        try:
+            av.codec.Codec('libmp3lame', 'w')
+        except Exception:
+            return False
+        return True
+
+    def encode(self, source_path, output_path, measure=True):
+        """Encodes source_path into output_path. Returns the loudness result if measure is set, otherwise None."""
+        with av.open(source_path) as source:
+            if not source.streams.audio:
+                raise ValueError(f"No audio stream in {source_path}")
+            input_stream = source.streams.audio[0]
+            with av.open(output_path, 'w', format='mp3') as output:
+                # The same tags ffmpeg's -map_metadata 0 copies: the input's global metadata
+                output.metadata.update(source.metadata)
+
+                rate = self.output_rate(input_stream.rate)
+                layout = 'mono' if input_stream.channels == 1 else 'stereo'
+                sample_format = self.sample_format(input_stream.format)
+                output_stream = output.add_stream('libmp3lame', rate=rate, layout=layout, format=sample_format)
+                output_stream.bit_rate = BITRATE
+                resampler = av.AudioResampler(format=sample_format, layout=layout, rate=rate)
+                meter = LoudnessMeter(input_stream) if measure else None
+
+                frames = 0
+                for frame in source.decode(input_stream):
+                    frames += 1
+                    for measured in (meter.push(frame) if meter else [frame]):
+                        for resampled in resampler.resample(measured):
+                            output.mux(output_stream.encode(resampled))
+                if not frames:
+                    # Nothing would be written, not even the container header
+                    raise ValueError(f"No audio could be decoded from {source_path}")
+                for measured in (meter.push(None) if meter else []):
+                    for resampled in resampler.resample(measured):
+                        output.mux(output_stream.encode(resampled))
+                for resampled in resampler.resample(None):
+                    output.mux(output_stream.encode(resampled))
+                output.mux(output_stream.encode(None))
+        return meter.loudness() if meter else None
+
+    def analyse(self, source_path):
+        """Measures the loudness of source_path without encoding it."""
+        with av.open(source_path) as source:
+            if not source.streams.audio:
+                raise ValueError(f"No audio stream in {source_path}")
+            input_stream = source.streams.audio[0]
+            meter = LoudnessMeter(input_stream)
+            for frame in source.decode(input_stream):
+                meter.push(frame)
+            meter.push(None)
+        return meter.loudness()
+
+    @staticmethod
+    def sample_format(input_format):
+        """
+        Returns the sample format to encode in, as the ffmpeg command line picks it: the source's own format if LAME
+        takes it, so 16-bit sources stay 16-bit, and otherwise the most precise one LAME takes (float, then 32-bit), so
+        24-bit and float sources aren't truncated to 16 bits.
+        """
+        supported = [audio_format.name for audio_format in av.codec.Codec('libmp3lame', 'w').audio_formats or []]
+        if input_format is not None and input_format.planar.name in supported:
+            return input_format.planar.name
+        for name in HIGH_RESOLUTION_FORMATS:
+            if name in supported:
+                return name
+        return 's16p'
+
+    @staticmethod
+    def output_rate(rate):
+        """Returns the closest sample rate MP3 supports, as the ffmpeg command line picks it."""
+        supported = av.codec.Codec('libmp3lame', 'w').audio_rates or [44100]
+        return min(supported, key=lambda candidate: abs(candidate - rate))
+
+class LoudnessMeter:
+    """Runs decoded frames through ffmpeg's ebur128 filter, which measures them and passes the audio on unchanged."""
+
+    def __init__(self, stream):
+        self.graph = av.filter.Graph()
+        source = self.graph.add_abuffer(template=stream)
+        meter = self.graph.add('ebur128', EBUR128_OPTIONS)
+        sink = self.graph.add('abuffersink')
+        source.link_to(meter)
+        meter.link_to(sink)
+        self.graph.configure()
+        self.metadata = {}
+
+    def push(self, frame):
+        """Pushes a frame (or None at the end of the stream) and returns the frames that came out of the filter."""
+        self.graph.push(frame)
+        frames = []
+        while True:
+            try:
+                measured = self.graph.pull()
+            except (av.BlockingIOError, av.EOFError):
+                return frames
+            # Each measured frame carries the running values, so the last one has the result for the whole file
+            if 'lavfi.r128.I' in measured.metadata:
+                self.metadata = dict(measured.metadata)
+            frames.append(measured)
+
+    def loudness(self):
+        return parse_ebur128_metadata(self.metadata)
+
+ENCODERS = {encoder.name: encoder for encoder in (FfmpegEncoder(), PyAVEncoder())}
+
+selected_name = os.environ.get("REMUX_ENCODER", AUTO)
+selected_encoder = None
+selection_lock = threading.Lock()
+
+def select_encoder(name):
+    """Sets the backend used from now on: a name from ENCODERS, or "auto"."""
+    global selected_name, selected_encoder
+    if name != AUTO and name not in ENCODERS:
+        raise ValueError(f"Unknown encoder {name!r}; choose from {', '.join([AUTO, *ENCODERS])}")
+    with selection_lock:
+        selected_name = name
+        selected_encoder = None
+
+def get_encoder():
+    """Returns the selected backend, timing the available ones the first time if the selection is "auto"."""
+    global selected_encoder
+    with selection_lock:
+        if selected_encoder is None:
+            if selected_name == AUTO:
+                selected_encoder = choose_fastest([encoder for encoder in ENCODERS.values() if encoder.available()])
+            else:
+                selected_encoder = ENCODERS[selected_name]
+        return selected_encoder
+
+def write_sample(path, seconds=SAMPLE_SECONDS, rate=44100):
+    """Writes a stereo test tone to a WAV file."""
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(2)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(b''.join(
+            struct.pack('<hh', int(8000 * math.sin(index / 20)), int(8000 * math.sin(index / 30)))
+            for index in range(rate * seconds)
+        ))
+
+def choose_fastest(encoders):
+    """Returns whichever of encoders converts a short sample fastest. Falls back to ffmpeg if none of them work."""
+    if len(encoders) < 2:
+        return encoders[0] if encoders else ENCODERS[FfmpegEncoder.name]
+
+    timings = {}
+    with tempfile.TemporaryDirectory() as directory:
+        sample_path = os.path.join(directory, 'sample.wav')
+        write_sample(sample_path)
+        for encoder in encoders:
+            try:
+                start = time.perf_counter()
+                encoder.encode(sample_path, os.path.join(directory, f'{encoder.name}.mp3'))
+                timings[encoder.name] = time.perf_counter() - start
+            except Exception as e:
+                log_error_to_file(__file__, f"Encoder {encoder.name} failed on the sample and won't be used: {e}")
+    if not timings:
+        return ENCODERS[FfmpegEncoder.name]
+    fastest = min(timings, key=timings.get)
+    print("Encoder timings: " + ", ".join(f"{name} {seconds:.3f}s" for name, seconds in timings.items())
+          + f"; using {fastest}")
+    return ENCODERS[fastest]
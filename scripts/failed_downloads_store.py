@@ -0,0 +1,206 @@
+# Indexed store of failed downloads, keyed on (title, artist).
+# Replaces reading and rewriting the whole of failed_downloads.csv on every completion event: each event is now a
+# single indexed INSERT or DELETE in a SQLite database that sits next to the CSV (failed_downloads.sqlite).
+# The CSV is still exported for `replace_failed_downloads.py` and for humans, and edits made to the CSV by hand are
+# picked up again the next time the store is opened.
+# Each entry also records how often it has been retried automatically and when it is next due (see
+# retry_failed_downloads.py). These are kept when the store is reloaded from a hand-edited CSV.
+
+import csv
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+
+FAILED_DOWNLOADS_CSV = '../failed_downloads.csv'
+FAILED_DOWNLOADS_DB = '../failed_downloads.sqlite'
+
+# Columns of failed_downloads.csv, in order. The CSV has no header row.
+COLUMNS = ['path', 'title', 'artist', 'album', 'uri', 'length', 'failure_reason', 'state']
+
+# Columns that are only kept in the store, not in the CSV
+RETRY_COLUMNS = {'retry_attempts': 'INTEGER NOT NULL DEFAULT 0', 'last_retry_at': 'REAL', 'next_retry_at': 'REAL'}
+
+# Minimum number of seconds between automatic CSV exports from completion events
+EXPORT_INTERVAL = 60
+
+class FailedDownloadStore:
+    """
+    SQLite-backed list of failed downloads with O(log n) add and remove by (title, artist).
+
+    Multiple processes may open the store at once; SQLite's own locking serializes writers.
+    """
+
+    def __init__(self, db_path=FAILED_DOWNLOADS_DB, csv_path=FAILED_DOWNLOADS_CSV):
+        self.db_path = db_path
+        self.csv_path = csv_path
+        # A generous timeout lets concurrent completion hooks queue on the write lock instead of failing.
+        # Transactions are managed explicitly (see write_transaction) so that CSV syncs and exports hold the write lock.
+        self.connection = sqlite3.connect(db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS failed_downloads (
+                path TEXT,
+                title TEXT NOT NULL,
+                artist TEXT NOT NULL,
+                album TEXT,
+                uri TEXT,
+                length TEXT,
+                failure_reason TEXT,
+                state TEXT,
+                added_at REAL NOT NULL,
+                retry_attempts INTEGER NOT NULL DEFAULT 0,
+                last_retry_at REAL,
+                next_retry_at REAL,
+                UNIQUE (title, artist)
+            )"""
+        )
+        # Stores created before automatic retries
+        columns = {row[1] for row in self.connection.execute("PRAGMA table_info(failed_downloads)")}
+        for column, definition in RETRY_COLUMNS.items():
+            if column not in columns:
+                self.connection.execute(f"ALTER TABLE failed_downloads ADD COLUMN {column} {definition}")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.sync_from_csv()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @contextmanager
+    def write_transaction(self):
+        """
+        Holds SQLite's write lock for the duration of the block, committing on success.
+
+        Nested blocks join the outer transaction, so a batch of events can be applied under one lock and one commit.
+        """
+        if self.connection.in_transaction:
+            yield self.connection
+            return
+
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.connection
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        self.connection.execute("COMMIT")
+
+    def _get_meta(self, key):
+        row = self.connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key, value):
+        self.connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def sync_from_csv(self):
+        """
+        Reloads the store from the CSV if the CSV has changed since it was last exported.
+
+        This covers the first run after upgrading (the CSV exists but the store is empty) and rows removed or added
+        by hand. Returns True if the store was reloaded.
+        """
+        if not self.csv_path or not os.path.exists(self.csv_path):
+            return False
+
+        if str(os.stat(self.csv_path).st_mtime_ns) == self._get_meta('csv_mtime_ns'):
+            return False
+
+        with self.write_transaction():
+            # Check again under the lock: another process may have just exported the CSV
+            csv_mtime = str(os.stat(self.csv_path).st_mtime_ns)
+            if csv_mtime == self._get_meta('csv_mtime_ns'):
+                return False
+
+            with open(self.csv_path, 'r', newline='', encoding='utf-8') as f:
+                rows = [row for row in csv.reader(f) if len(row) >= 3]
+
+            # Entries that are still listed keep when they were added and their retry history
+            history = {
+                (title, artist): rest for title, artist, *rest in self.connection.execute(
+                    "SELECT title, artist, added_at, retry_attempts, last_retry_at, next_retry_at FROM failed_downloads"
+                )
+            }
+            self.connection.execute("DELETE FROM failed_downloads")
+            now = time.time()
+            padded_rows = [(row + [''] * len(COLUMNS))[:len(COLUMNS)] for row in rows]
+            self.connection.executemany(
+                f"INSERT OR IGNORE INTO failed_downloads ({', '.join(COLUMNS)}, added_at, {', '.join(RETRY_COLUMNS)}) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [[*row, *history.get((row[1], row[2]), (now, 0, None, None))] for row in padded_rows]
+            )
+            self._set_meta('csv_mtime_ns', csv_mtime)
+        return True
+
+    def contains(self, title, artist):
+        row = self.connection.execute(
+            "SELECT 1 FROM failed_downloads WHERE title = ? AND artist = ?", (title, artist)
+        ).fetchone()
+        return row is not None
+
+    def add(self, path, title, artist, album, uri, length, failure_reason, state):
+        """Adds a failed download unless an entry for (title, artist) already exists. Returns True if it was added."""
+        with self.write_transaction():
+            cursor = self.connection.execute(
+                f"INSERT OR IGNORE INTO failed_downloads ({', '.join(COLUMNS)}, added_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (path, title, artist, album, uri, length, failure_reason, state, time.time())
+            )
+        return cursor.rowcount > 0
+
+    def remove(self, title, artist):
+        """Removes the entry for (title, artist). Returns True if there was one."""
+        with self.write_transaction():
+            cursor = self.connection.execute(
+                "DELETE FROM failed_downloads WHERE title = ? AND artist = ?", (title, artist)
+            )
+        return cursor.rowcount > 0
+
+    def rows(self):
+        """Returns all failed downloads as CSV rows, oldest first."""
+        return [list(row) for row in self.connection.execute(
+            f"SELECT {', '.join(COLUMNS)} FROM failed_downloads ORDER BY rowid"
+        )]
+
+    def retry_candidates(self):
+        """Returns every failed download as a dictionary of its columns, added_at and retry columns, oldest first."""
+        cursor = self.connection.execute(
+            f"SELECT {', '.join(COLUMNS)}, added_at, {', '.join(RETRY_COLUMNS)} FROM failed_downloads ORDER BY rowid"
+        )
+        names = [description[0] for description in cursor.description]
+        return [dict(zip(names, row)) for row in cursor]
+
+    def record_retry(self, title, artist, next_retry_at):
+        """Counts a retry of (title, artist) and sets when it is next due. Returns True if the entry exists."""
+        with self.write_transaction():
+            cursor = self.connection.execute(
+                "UPDATE failed_downloads SET retry_attempts = retry_attempts + 1, last_retry_at = ?, next_retry_at = ? "
+                "WHERE title = ? AND artist = ?",
+                (time.time(), next_retry_at, title, artist)
+            )
+        return cursor.rowcount > 0
+
+    def export_csv(self, csv_path=None):
+        """Writes the store out as failed_downloads.csv, replacing the file atomically."""
+        csv_path = csv_path or self.csv_path
+        temp_path = csv_path + '.tmp'
+        # Hold the write lock so that no event lands between reading the rows and recording the export
+        with self.write_transaction():
+            with open(temp_path, 'w', newline='', encoding='utf-8') as f:
+                csv.writer(f).writerows(self.rows())
+            os.replace(temp_path, csv_path)
+
+            if csv_path == self.csv_path:
+                # Remember the exported version so that it is not mistaken for a hand edit
+                self._set_meta('csv_mtime_ns', os.stat(csv_path).st_mtime_ns)
+
+    def export_csv_if_stale(self, interval=EXPORT_INTERVAL):
+        """Exports the CSV if it has not been written for `interval` seconds, so it never lags far behind."""
+        if os.path.exists(self.csv_path) and time.time() - os.path.getmtime(self.csv_path) < interval:
+            return False
+        self.export_csv()
+        return True
+
+    def close(self):
+        self.connection.close()
@@ -1,22 +1,183 @@
-# Logs an error message to a file in the error_logs directory
+# Logs an error message to a file in the error_logs directory next to these scripts
 # The error message is written to a file named with the current date
+# Entries are buffered and written in batches by a background thread (and when the process exits), each batch as a
+# single append, so that concurrent processes never interleave partial entries. Identical errors are collapsed into one
+# entry with a repeat count, and an error already written in the last few minutes is only counted, not repeated in full.
+# The day's file is rotated once it grows past MAX_LOG_BYTES, and logs older than MAX_LOG_AGE_DAYS are deleted.
 
-from datetime import datetime
+from datetime import datetime, timedelta
+import atexit
 import os
+import threading
+import time
+
+try:
+    import portalocker
+except ImportError:
+    portalocker = None
+
+ERROR_LOG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "error_logs")
+
+# How often buffered entries are written, and how many may be buffered before they are written straight away
+FLUSH_INTERVAL = 1
+MAX_PENDING = 200
+
+# An error identical to one written within this many seconds is only counted
+DEDUPE_WINDOW = 300
+
+# Size at which the day's file is rotated, and how many rotated files are kept per day
+MAX_LOG_BYTES = 10 * 1024 * 1024
+BACKUP_COUNT = 5
+
+MAX_LOG_AGE_DAYS = 30
+
+SEPARATOR = "-" * 50
+
+def format_entry(script_name, message, first_seen, last_seen, count):
+    lines = [SEPARATOR, f"{script_name}", f"{first_seen.strftime('%Y-%m-%d %H:%M:%S')}"]
+    if count > 1:
+        lines.append(f"Repeated {count} times, last at {last_seen.strftime('%Y-%m-%d %H:%M:%S')}")
+    lines += ["", "Error log:", f"{message}", "", ""]
+    return "\n".join(lines)
+
+def format_repeat(script_name, message, last_seen, count):
+    first_line = message.strip().splitlines()[0] if message.strip() else ""
+    return (f"{SEPARATOR}\n{script_name}\n{last_seen.strftime('%Y-%m-%d %H:%M:%S')}\n"
+            f"Repeated {count} more time(s) (logged in full earlier): {first_line}\n\n")
+
+class ErrorLogSink:
+    """Buffers error entries and writes them to the day's log file in batches. Safe to use from multiple threads."""
+
+    def __init__(self, directory=ERROR_LOG_DIR):
+        self.directory = directory
+        self.lock = threading.Lock()
+        # Serializes writes from this process; other processes are kept out by the lock file, if portalocker is installed
+        self.write_lock = threading.Lock()
+        # (script_name, message) -> [first seen, last seen, count], in the order the errors were first seen
+        self.pending = {}
+        # (script_name, message) -> when the entry was last written in full
+        self.recent = {}
+        self.wake = threading.Event()
+        self.flusher = None
+        self.cleaned_up = False
+
+    def log(self, script_name, message):
+        now = datetime.now()
+        key = (str(script_name), str(message))
+        with self.lock:
+            entry = self.pending.get(key)
+            if entry is None:
+                self.pending[key] = [now, now, 1]
+            else:
+                entry[1] = now
+                entry[2] += 1
+            if len(self.pending) >= MAX_PENDING:
+                self.wake.set()
+            if self.flusher is None:
+                self.flusher = threading.Thread(target=self.run, name="error-log", daemon=True)
+                self.flusher.start()
+
+    def run(self):
+        while True:
+            self.wake.wait(FLUSH_INTERVAL)
+            self.wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                # The thread must keep running, or later errors would only be written at exit
+                print(f"Could not write to the error log: {e}")
+
+    def flush(self):
+        """Writes every buffered entry to the log file."""
+        with self.write_lock:
+            with self.lock:
+                pending, self.pending = self.pending, {}
+            if not pending:
+                return
+
+            now = time.time()
+            self.recent = {key: written for key, written in self.recent.items() if now - written < DEDUPE_WINDOW}
+            entries = []
+            stamped = []
+            for key, (first_seen, last_seen, count) in pending.items():
+                script_name, message = key
+                if key in self.recent:
+                    entries.append(format_repeat(script_name, message, last_seen, count))
+                else:
+                    entries.append(format_entry(script_name, message, first_seen, last_seen, count))
+                    self.recent[key] = now
+                    stamped.append(key)
+
+            try:
+                self.write("".join(entries))
+            except Exception as e:
+                # OSError, or portalocker's lock exceptions if another process holds the lock file for too long.
+                # There is nowhere else to report this; don't let logging take the caller down
+                print(f"Could not write to the error log: {e}")
+                self.restore(pending, stamped)
+
+    def restore(self, pending, stamped):
+        """Puts a batch that couldn't be written back in front of the entries logged since, to be tried again."""
+        for key in stamped:
+            self.recent.pop(key, None)
+        with self.lock:
+            for key, entry in self.pending.items():
+                if key in pending:
+                    first_seen, last_seen, count = pending[key]
+                    pending[key] = [min(first_seen, entry[0]), max(last_seen, entry[1]), count + entry[2]]
+                else:
+                    pending[key] = entry
+            self.pending = pending
+
+    def write(self, text):
+        os.makedirs(self.directory, exist_ok=True)
+        if portalocker is None:
+            self.append(text)
+            return
+        with portalocker.Lock(os.path.join(self.directory, ".lock"), mode="a", timeout=30):
+            self.append(text)
+
+    def append(self, text):
+        log_path = os.path.join(self.directory, f"{datetime.now().strftime('%Y-%m-%d')}_errors.txt")
+        if not self.cleaned_up:
+            self.cleaned_up = True
+            self.remove_old_logs()
+        try:
+            if os.path.getsize(log_path) >= MAX_LOG_BYTES:
+                self.rotate(log_path)
+        except OSError:
+            pass
+        # One write per batch, so entries from different processes never interleave
+        with open(log_path, "a", encoding="utf-8") as file:
+            file.write(text)
+
+    def rotate(self, log_path):
+        base, extension = os.path.splitext(log_path)
+        for index in range(BACKUP_COUNT - 1, 0, -1):
+            if os.path.exists(f"{base}.{index}{extension}"):
+                os.replace(f"{base}.{index}{extension}", f"{base}.{index + 1}{extension}")
+        os.replace(log_path, f"{base}.1{extension}")
+
+    def remove_old_logs(self):
+        cutoff = (datetime.now() - timedelta(days=MAX_LOG_AGE_DAYS)).strftime('%Y-%m-%d')
+        try:
+            file_names = os.listdir(self.directory)
+        except OSError:
+            return
+        for file_name in file_names:
+            # File names start with the date they were written, so they compare in date order
+            if file_name.endswith(".txt") and file_name[:10] < cutoff:
+                try:
+                    os.remove(os.path.join(self.directory, file_name))
+                except OSError:
+                    pass
+
+sink = ErrorLogSink()
+atexit.register(sink.flush)
 
 def log_error_to_file(script_name, error_message):
-    today_date = datetime.now().strftime("%Y-%m-%d")
-    
-    # Ensure the error_logs directory exists
-    os.makedirs("error_logs", exist_ok=True)
-
-    # Set the error log file path
-    error_log_file = f"error_logs/{today_date}_errors.txt"
-
-    # Append error to the file
-    with open(error_log_file, "a") as file:
-        file.write("--------------------------------------------------\n")
-        file.write(f"{script_name}\n")
-        file.write(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
-        file.write("Error log:\n")
-        file.write(f"{error_message}\n\n")
\ No newline at end of file
+    sink.log(script_name, error_message)
+
+def flush_error_log():
+    """Writes buffered errors now, e.g. before the process is ended without running exit handlers."""
+    sink.flush()
@@ -0,0 +1,72 @@
+# Loudness measurement results and the ReplayGain/R128 tags written from them.
+# Loudness is measured with ffmpeg's ebur128 filter while a file is decoded for remuxing (see encoders.py), so the
+# library isn't decoded a second time by a separate analysis tool. Each result holds:
+#   * integrated: the EBU R128 integrated loudness in LUFS
+#   * true_peak: the highest true peak across channels in dBFS
+#   * gain: the ReplayGain 2.0 track gain in dB, i.e. the adjustment that brings the track to -18 LUFS
+# Tags are written as ID3 TXXX frames: REPLAYGAIN_TRACK_GAIN, REPLAYGAIN_TRACK_PEAK and R128_TRACK_GAIN (the gain to
+# -23 LUFS in 1/256 dB steps, as used by Opus and players that read R128 tags).
+# Set REMUX_LOUDNESS=off (or pass --no-loudness to download_and_process_playlists.py) to skip the measurement.
+
+import math
+import os
+import re
+from mutagen.id3 import ID3, ID3NoHeaderError, TXXX
+
+REPLAYGAIN_REFERENCE = -18.0
+R128_REFERENCE = -23.0
+
+# Options for ffmpeg's ebur128 filter. metadata=1 attaches the running values to each frame (read by the PyAV backend)
+# and moves the per-frame log lines to the verbose level, so only the summary is logged at the info level.
+EBUR128_OPTIONS = 'peak=true:metadata=1'
+
+enabled = os.environ.get("REMUX_LOUDNESS", "on").lower() not in ('0', 'off', 'no', 'false')
+
+def set_enabled(flag):
+    global enabled
+    enabled = bool(flag)
+
+def loudness_values(integrated, true_peak):
+    """Returns the loudness result for an integrated loudness (LUFS) and true peak (dBFS)."""
+    return {
+        'integrated': round(integrated, 2),
+        'true_peak': round(true_peak, 2) if math.isfinite(true_peak) else true_peak,
+        'gain': round(REPLAYGAIN_REFERENCE - integrated, 2),
+    }
+
+SUMMARY_LOUDNESS = re.compile(r'^\s*I:\s+(-?(?:[\d.]+|inf)) LUFS', re.MULTILINE)
+SUMMARY_PEAK = re.compile(r'^\s*Peak:\s+(-?(?:[\d.]+|inf)) dBFS', re.MULTILINE)
+
+def parse_ebur128_summary(log):
+    """Reads the result from the summary the ebur128 filter logs when it finishes, or returns None if there isn't one."""
+    loudness = SUMMARY_LOUDNESS.findall(log)
+    peak = SUMMARY_PEAK.findall(log)
+    if not loudness or not peak:
+        return None
+    return loudness_values(float(loudness[-1]), float(peak[-1]))
+
+def parse_ebur128_metadata(metadata):
+    """Reads the result from the lavfi.r128.* values on the last frame out of the ebur128 filter."""
+    if 'lavfi.r128.I' not in metadata or 'lavfi.r128.true_peak' not in metadata:
+        return None
+    peak = float(metadata['lavfi.r128.true_peak'])
+    return loudness_values(float(metadata['lavfi.r128.I']), 20 * math.log10(peak) if peak > 0 else -math.inf)
+
+def replaygain_tags(loudness):
+    """Returns {TXXX description: value} for a loudness result."""
+    peak = 10 ** (loudness['true_peak'] / 20) if math.isfinite(loudness['true_peak']) else 0.0
+    return {
+        'REPLAYGAIN_TRACK_GAIN': f"{loudness['gain']:.2f} dB",
+        'REPLAYGAIN_TRACK_PEAK': f"{peak:.6f}",
+        'R128_TRACK_GAIN': str(round((R128_REFERENCE - loudness['integrated']) * 256)),
+    }
+
+def write_tags(file_path, loudness):
+    """Adds (or replaces) the ReplayGain and R128 tags of an MP3 file, leaving its other tags alone."""
+    try:
+        tags = ID3(file_path)
+    except ID3NoHeaderError:
+        tags = ID3()
+    for description, value in replaygain_tags(loudness).items():
+        tags.add(TXXX(encoding=3, desc=description, text=[value]))
+    tags.save(file_path)
@@ -0,0 +1,32 @@
+# Thin on-complete hook for sldl.
+# Forwards the completion event to the running completion daemon (see completion_daemon.py) and exits. This keeps the
+# per-track hook down to a socket write, with only standard-library imports.
+# If no daemon is listening, the event is processed in this process exactly as `process_completed_download.py` would.
+
+import json
+import socket
+import sys
+
+# Must match completion_daemon.DAEMON_ADDRESS; duplicated here so the hook does not import the daemon's dependencies
+DAEMON_ADDRESS = ('127.0.0.1', 47813)
+CONNECT_TIMEOUT = 2
+
+FIELDS = ['path', 'title', 'artist', 'album', 'uri', 'length', 'failure-reason', 'state']
+
+def send_to_daemon(file_details):
+    """Returns True if the daemon acknowledged the event."""
+    try:
+        with socket.create_connection(DAEMON_ADDRESS, timeout=CONNECT_TIMEOUT) as connection:
+            connection.sendall(json.dumps(file_details).encode('utf-8') + b"\n")
+            connection.shutdown(socket.SHUT_WR)
+            return connection.makefile('rb').readline().strip() == b"ok"
+    except OSError:
+        return False
+
+if __name__ == "__main__":
+    file_details = dict(zip(FIELDS, sys.argv[1:]))
+
+    if not send_to_daemon(file_details):
+        # No daemon running: fall back to handling the event in this process
+        from process_completed_download import process_download
+        process_download(file_details)
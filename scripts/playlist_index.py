@@ -0,0 +1,287 @@
+# Batches .m3u8 playlist and .sldl index rewrites after files have been moved or re-encoded.
+# Instead of walking the whole library and re-reading every playlist for each converted file, old -> new path
+# substitutions are collected and applied in one pass: a single walk builds an index from track path to the
+# playlists and indexes that reference it, and each affected file is then rewritten exactly once.
+# replace_failed_tracks() points playlists at replacements for failed downloads. Failed tracks are found by their exact
+# title and artist in the .sldl indexes, and only the playlist lines for those entries are rewritten, so a short title
+# such as "Intro" never touches "Intro to the Night".
+
+import os
+import re
+import threading
+from log_error_to_file import log_error_to_file
+from run_metrics import stage
+from sldl_index import SldlIndex, STATE_ALREADY_EXISTS, find_sldl_files, normalise_title
+
+# The comment sldl writes in a playlist in place of a track that failed: "# Failed: Artist - Title [reason]"
+FAILED_LINE = re.compile(r'#\s*Failed:\s*(.*?)\s*(?:\[[^\]]*\])?\s*$')
+
+def normalise_path(path):
+    """Returns a canonical form of a path so that references written in different styles compare equal."""
+    return os.path.normcase(os.path.normpath(os.path.abspath(path)))
+
+def resolve_reference(reference, playlist_dir, directory):
+    """
+    Returns the candidate absolute paths that a playlist entry may refer to.
+
+    sldl writes references relative to the playlist's own folder, but older runs of these scripts wrote them
+    relative to the library root, so both interpretations are indexed.
+    """
+    if os.path.isabs(reference):
+        return [(normalise_path(reference), None)]
+    return [
+        (normalise_path(os.path.join(playlist_dir, reference)), playlist_dir),
+        (normalise_path(os.path.join(directory, reference)), directory),
+    ]
+
+def rewrite_reference(reference, base_dir, old_path, new_path):
+    """Rewrites a single playlist reference to point at new_path, keeping the style of the original reference."""
+    old_name = os.path.basename(old_path)
+    if os.path.dirname(old_path) == os.path.dirname(new_path) and reference.endswith(old_name):
+        # Same folder (e.g. a change of extension): only swap the file name so separators and prefixes are untouched
+        return reference[:len(reference) - len(old_name)] + os.path.basename(new_path)
+    if base_dir is None:
+        return new_path
+    return os.path.relpath(new_path, base_dir)
+
+def read_text(file_path):
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            return f.read()
+    except UnicodeDecodeError:
+        with open(file_path, 'r', encoding='latin1') as f:
+            return f.read()
+
+def m3u8_references(content):
+    """Yields the track references in a .m3u8 playlist, skipping comments and blank lines."""
+    for line in content.splitlines():
+        reference = line.strip()
+        if reference and not reference.startswith('#'):
+            yield reference
+
+def sldl_references(content):
+    """Yields the track path of each entry in a .sldl index."""
+    for entry in SldlIndex('', content).entries:
+        if entry.path.strip():
+            yield entry.path.strip()
+
+def walk_folders(directory, folders=None):
+    """Yields os.walk results for the whole library, or only for the given folders inside it."""
+    if folders is None:
+        yield from os.walk(directory)
+        return
+    for folder in sorted(set(folders)):
+        yield from os.walk(folder)
+
+def build_index(directory, folders=None):
+    """
+    Walks the library once and maps every referenced track path to the playlist and index files that reference it.
+
+    Args:
+        directory (str): The library folder, which relative references may also be resolved against.
+        folders (iterable): Only read the playlists in these folders (e.g. the ones a run changed), if given.
+
+    Returns:
+        dict: normalised track path -> set of .m3u8/.sldl file paths.
+    """
+    index = {}
+    for subdir, _, files in walk_folders(directory, folders):
+        for file in files:
+            lower = file.lower()
+            if lower.endswith('.m3u8'):
+                references = m3u8_references
+            elif lower.endswith('.sldl'):
+                references = sldl_references
+            else:
+                continue
+
+            playlist_path = os.path.join(subdir, file)
+            try:
+                content = read_text(playlist_path)
+            except Exception as e:
+                error_message = f"Error reading playlist {playlist_path}: {e}"
+                print(error_message)
+                log_error_to_file(__file__, error_message)
+                continue
+
+            for reference in references(content):
+                for track_path, _ in resolve_reference(reference, subdir, directory):
+                    index.setdefault(track_path, set()).add(playlist_path)
+    return index
+
+def rewrite_m3u8(playlist_path, directory, substitutions):
+    """Applies all substitutions to a .m3u8 playlist. Returns True if the file was changed."""
+    playlist_dir = os.path.dirname(playlist_path)
+    lines = read_text(playlist_path).splitlines(keepends=True)
+    updated = False
+    for i, line in enumerate(lines):
+        reference = line.strip()
+        if not reference or reference.startswith('#'):
+            continue
+        for track_path, base_dir in resolve_reference(reference, playlist_dir, directory):
+            if track_path in substitutions:
+                old_path, new_path = substitutions[track_path]
+                new_reference = rewrite_reference(reference, base_dir, old_path, new_path)
+                lines[i] = line.replace(reference, new_reference)
+                updated = True
+                break
+
+    if updated:
+        with open(playlist_path, 'w', encoding='utf-8') as f:
+            f.writelines(lines)
+    return updated
+
+def rewrite_sldl(sldl_path, directory, substitutions):
+    """Applies all substitutions to the track paths of a .sldl index. Returns True if the file was changed."""
+    index = SldlIndex.load(sldl_path)
+    for entry in index.entries:
+        reference = entry.path.strip()
+        if not reference:
+            continue
+        for track_path, base_dir in resolve_reference(reference, index.directory, directory):
+            if track_path in substitutions:
+                old_path, new_path = substitutions[track_path]
+                entry.set(path=entry.path.replace(reference, rewrite_reference(reference, base_dir, old_path, new_path)))
+                break
+    return index.save()
+
+class PlaylistRewriter:
+    """
+    Collects old -> new track path substitutions and writes them to the library's playlists in batches.
+
+    Substitutions are applied when flush() is called, or automatically every `checkpoint_every` substitutions
+    so that a long run does not leave every playlist stale until the very end. `on_flush`, if given, is called with
+    the old paths whose references have just been written. If `folders` is set, only the playlists in those folders
+    are read (see run_manifest.py). Safe to use from multiple threads.
+    """
+
+    def __init__(self, directory, checkpoint_every=None, on_flush=None, folders=None):
+        self.directory = directory
+        self.checkpoint_every = checkpoint_every
+        self.on_flush = on_flush
+        self.folders = folders
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+        # Serializes flushes so that two checkpoints never rewrite the same playlist at once
+        self.flush_lock = threading.Lock()
+
+    def add(self, old_path, new_path):
+        """Records that the track at old_path now lives at new_path."""
+        with self.pending_lock:
+            self.pending[normalise_path(old_path)] = (os.path.abspath(old_path), os.path.abspath(new_path))
+            checkpoint = self.checkpoint_every and len(self.pending) >= self.checkpoint_every
+        if checkpoint:
+            self.flush()
+
+    def flush(self):
+        """Writes all pending substitutions, touching each affected playlist or index once."""
+        with self.flush_lock:
+            with self.pending_lock:
+                substitutions, self.pending = self.pending, {}
+            if not substitutions:
+                return
+
+            with stage("playlist_rewrite", directory=self.directory, substitutions=len(substitutions)) as timer:
+                index = build_index(self.directory, self.folders)
+                affected = set()
+                for track_path in substitutions:
+                    affected.update(index.get(track_path, ()))
+                timer.files = len(affected)
+
+                for playlist_path in sorted(affected):
+                    try:
+                        if playlist_path.lower().endswith('.sldl'):
+                            if rewrite_sldl(playlist_path, self.directory, substitutions):
+                                print(f"Updated SLDL file: {playlist_path}")
+                        elif rewrite_m3u8(playlist_path, self.directory, substitutions):
+                            print(f"Updated playlist: {playlist_path}")
+                    except Exception as e:
+                        error_message = f"Error updating playlist {playlist_path}: {e}"
+                        print(error_message)
+                        log_error_to_file(__file__, error_message)
+
+            if self.on_flush is not None:
+                self.on_flush([old_path for old_path, _ in substitutions.values()])
+
+
+def failed_track_key(artist, title):
+    return normalise_title(f"{artist} - {title}")
+
+def rewrite_failed_lines(playlist_path, references):
+    """
+    Replaces the '# Failed: ...' lines of a .m3u8 playlist with references to the tracks' replacements.
+
+    Args:
+        references (dict): failed_track_key() -> reference to write in place of that track's line.
+
+    Returns:
+        bool: True if the file was changed.
+    """
+    lines = read_text(playlist_path).splitlines(keepends=True)
+    updated = False
+    for i, line in enumerate(lines):
+        match = FAILED_LINE.match(line.strip())
+        if match and normalise_title(match.group(1)) in references:
+            lines[i] = references[normalise_title(match.group(1))] + line[len(line.rstrip('\r\n')):]
+            updated = True
+
+    if updated:
+        with open(playlist_path, 'w', encoding='utf-8') as f:
+            f.writelines(lines)
+    return updated
+
+def replace_failed_tracks(directory, replacements):
+    """
+    Points the library's indexes and playlists at replacement files for failed downloads.
+
+    Each track's entries are looked up in the .sldl indexes by exact title and artist, marked as existing and pointed
+    at the replacement. Only the playlist references to those entries are rewritten: references to the entry's old
+    file, if it had one, and otherwise the '# Failed: ...' line sldl wrote for it in the playlists next to the index.
+
+    Args:
+        directory (str): The library folder.
+        replacements (dict): (title, artist) -> path of the replacement file. An artist of None matches any artist;
+            tracks with an empty title are skipped.
+
+    Returns:
+        int: The number of index entries updated.
+    """
+    rewriter = PlaylistRewriter(directory)
+    failed_references = {}
+    updated = 0
+    for sldl_path in find_sldl_files(directory):
+        index = SldlIndex.load(sldl_path)
+        for (title, artist), new_path in replacements.items():
+            if not (title or '').strip():
+                continue
+            for entry in index.find_by_title(title, artist):
+                old_path = index.resolve(entry)
+                if old_path and normalise_path(old_path) == normalise_path(new_path):
+                    # Already points at the replacement, e.g. the index of the retry batch that downloaded it
+                    continue
+                new_reference = index.relative_path(new_path)
+                if old_path:
+                    rewriter.add(old_path, new_path)
+                else:
+                    references = failed_references.setdefault(index.directory, {})
+                    references[failed_track_key(entry.artist, entry.title)] = new_reference
+                print(f"Updating entry in {sldl_path}: {entry.artist} - {entry.title}")
+                entry.set(path=new_reference, tracktype='0', state=STATE_ALREADY_EXISTS, failure_reason='0')
+                updated += 1
+        # Only indexes with a matching entry are written back
+        index.save()
+
+    for folder, references in failed_references.items():
+        for file in sorted(os.listdir(folder)):
+            if not file.lower().endswith('.m3u8'):
+                continue
+            playlist_path = os.path.join(folder, file)
+            try:
+                if rewrite_failed_lines(playlist_path, references):
+                    print(f"Updated playlist: {playlist_path}")
+            except Exception as e:
+                error_message = f"Error updating playlist {playlist_path}: {e}"
+                print(error_message)
+                log_error_to_file(__file__, error_message)
+    rewriter.flush()
+    return updated
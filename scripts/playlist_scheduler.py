@@ -0,0 +1,218 @@
+# Runs the downloads for a list of playlists concurrently.
+# Up to one sldl process per download slot runs at a time, and SoundCloud playlists are scraped on a separate thread
+# so that scraping the next set overlaps with downloads that are already in flight.
+# A failing playlist is reported and logged without stopping the rest of the run.
+#
+# Soulseek only allows one session per account, so every concurrent sldl process needs its own login. Give each
+# download slot its own sldl profile (a [profile-name] section in sldl.conf with a different user/pass) and pass the
+# profile names to `download_and_process_playlists.py --profiles`.
+#
+# Given a PlaylistStateStore (see playlist_state.py), playlists are synced in order of staleness, dormant ones can be
+# skipped, and an interrupted run carries on with the playlists it hadn't synced yet.
+
+import os
+import queue
+import shlex
+import subprocess
+import threading
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+from log_error_to_file import log_error_to_file
+from run_metrics import stage, timed
+from convert_soundcloud_to_csv import convert_soundcloud_to_csv, SoundCloudScraper
+from soundcloud_sync import prepare_incremental_csv, commit_snapshot, discard_snapshot, read_tracks, snapshot_path
+
+print_lock = threading.Lock()
+
+# Command used to run sldl. Set SLDL_COMMAND to use a specific build, or a stand-in (see benchmark.py)
+SLDL_COMMAND = shlex.split(os.environ.get("SLDL_COMMAND", "sldl"))
+
+def log_progress(message):
+    # Keep messages from different threads on separate lines
+    with print_lock:
+        print(message, flush=True)
+
+def slot_arguments(profiles=None, max_concurrent=1):
+    """
+    Returns the extra sldl arguments for each download slot.
+
+    Args:
+        profiles (list): sldl profile names, one per slot. Each profile should use its own Soulseek login.
+        max_concurrent (int): Number of slots to use when no profiles are given. These share the login in sldl.conf.
+    """
+    if profiles:
+        return [["--profile", profile] for profile in profiles]
+    return [[] for _ in range(max(1, max_concurrent))]
+
+class PlaylistScheduler:
+    """
+    Schedules sldl invocations across a fixed set of download slots.
+
+    Args:
+        slots (list): Extra sldl arguments for each slot (see slot_arguments).
+        scrape_soundcloud (callable): Converts a SoundCloud URL to a CSV path for sldl. By default every SoundCloud
+            playlist in the run is scraped with one shared browser session.
+        state (PlaylistStateStore): Per-playlist sync state. Without it, every playlist is synced in file order.
+        skip_window (float): Seconds within which playlists that were unchanged at their last sync are skipped.
+        resume (bool): Carry on with an interrupted run instead of starting again from the first playlist.
+    """
+
+    def __init__(self, slots, scrape_soundcloud=None, state=None, skip_window=0, resume=True):
+        self.slots = queue.Queue()
+        for slot in slots:
+            self.slots.put(slot)
+        self.slot_count = len(slots)
+        self.scraper = None
+        if scrape_soundcloud is None:
+            self.scraper = SoundCloudScraper()
+            scrape_soundcloud = self.scrape_with_session
+        self.scrape_soundcloud = scrape_soundcloud
+        self.state = state
+        self.skip_window = skip_window
+        self.resume = resume
+
+    def scrape_with_session(self, url):
+        return convert_soundcloud_to_csv(url, self.scraper)
+
+    def run_sldl(self, args):
+        # Borrow a slot for the duration of the sldl process so that each concurrent process uses its own login
+        slot = self.slots.get()
+        try:
+            subprocess.run([*SLDL_COMMAND, *slot, *args], check=True)
+        finally:
+            self.slots.put(slot)
+
+    def download_spotify_playlist(self, url, name):
+        log_progress(f"Downloading Spotify playlist: {name}")
+        with timed("playlist", stage="sldl", playlist=name, source="spotify"):
+            self.run_sldl([url])
+        if self.state is not None:
+            self.state.record_success(url, name)
+
+    def download_soundcloud_csv(self, csv_path, url=None):
+        # Only search for tracks added since the last successful sync, plus ones that are still failing
+        wanted, total = prepare_incremental_csv(csv_path)
+        try:
+            if wanted:
+                log_progress(f"\nPassing SoundCloud CSV to sldl: {csv_path} ({wanted} of {total} tracks)")
+                with timed("playlist", stage="sldl", playlist=csv_path, source="soundcloud", tracks=total) as timer:
+                    timer.files = wanted
+                    self.run_sldl(["--desperate", "--strict-artist", csv_path])
+            else:
+                log_progress(f"\nNo new tracks in {csv_path}; skipping sldl")
+        except BaseException:
+            discard_snapshot(csv_path)
+            raise
+        commit_snapshot(csv_path)
+        if self.state is not None and url is not None:
+            # The scraped list is the whole playlist; the CSV sldl saw may only have held the new tracks
+            name = os.path.splitext(os.path.basename(csv_path))[0]
+            self.state.record_success(url, name, tracks=read_tracks(snapshot_path(csv_path)))
+
+        log_progress(f"\nRemoving CSV {csv_path}")
+        os.remove(csv_path)
+
+    def scrape_and_queue_soundcloud_playlist(self, url, downloads):
+        """Scrapes a SoundCloud playlist and queues its download, returning the download's future."""
+        log_progress(f"\nParsing SoundCloud playlist and printing to CSV: {url}")
+        try:
+            csv_path = self.scrape_soundcloud(url)
+        except SystemExit as e:
+            # convert_soundcloud_to_csv exits on failure when run as a script; treat that as this playlist failing
+            raise RuntimeError(f"Scraping failed for {url}") from e
+        return downloads.submit(self.download_soundcloud_csv, csv_path, url)
+
+    def run(self, playlists):
+        """
+        Downloads all playlists and returns the ones that failed.
+
+        Args:
+            playlists (list): Items as returned by read_playlists_from_file.
+
+        Returns:
+            list: (playlist, error message) for each playlist that failed.
+        """
+        with stage("download_playlists", playlists=len(playlists), slots=self.slot_count) as timer:
+            if self.state is not None:
+                playlists = self.plan(playlists)
+            failures = self.download_all(playlists)
+            timer.fields.update(failures=len(failures), synced=len(playlists))
+        # Only reached if the run wasn't interrupted, so the next run starts afresh
+        if self.state is not None:
+            self.state.finish_run()
+        return failures
+
+    def plan(self, playlists):
+        """Returns the playlists to sync this run, in order, and reports the ones that are skipped."""
+        if self.state.begin_run(self.resume):
+            log_progress("Resuming the interrupted run; playlists it already synced are skipped.")
+        items = []
+        for item in playlists:
+            if isinstance(item, tuple):
+                items.append((item[0], item[1], item))
+            else:
+                items.append((item, None, item))
+        ordered, skipped = self.state.plan(items, self.skip_window)
+        for item, reason in skipped:
+            log_progress(f"Skipping {item[1] if isinstance(item, tuple) else item}: {reason}")
+        if skipped:
+            log_progress(f"{len(ordered)} playlist(s) to sync, {len(skipped)} skipped.")
+        return ordered
+
+    def record_failure(self, url, label, error_message):
+        if self.state is not None:
+            self.state.record_failure(url, label, error_message)
+
+    def download_all(self, playlists):
+        total_playlists = len(playlists)
+        failures = []
+        downloads = ThreadPoolExecutor(max_workers=self.slot_count, thread_name_prefix="sldl")
+        scrapes = ThreadPoolExecutor(max_workers=1, thread_name_prefix="soundcloud")
+        try:
+            jobs = []
+            for item in playlists:
+                if isinstance(item, tuple):
+                    url, name = item
+                    if "spotify.com" in url:
+                        jobs.append((url, name, downloads.submit(self.download_spotify_playlist, url, name)))
+                elif isinstance(item, str) and "soundcloud.com" in item:
+                    future = scrapes.submit(self.scrape_and_queue_soundcloud_playlist, item, downloads)
+                    jobs.append((item, item, future))
+
+            for index, (url, label, future) in enumerate(jobs):
+                try:
+                    outcome = future.result()
+                    if isinstance(outcome, Future):
+                        outcome.result()
+                    log_progress(f"\n\nFinished playlist {index + 1}/{total_playlists}: {label}")
+                except subprocess.CalledProcessError as e:
+                    error_message = f"Command '{e.cmd}' returned non-zero exit status {e.returncode}.\n{e.stderr}"
+                    failures.append((label, error_message))
+                    self.record_failure(url, label, error_message)
+                    log_error_to_file("download_and_process_playlists.py", f"Playlist {label} failed:\n{error_message}")
+                    log_progress(f"\nPlaylist {label} failed. Details written to the log file: {e}")
+                except Exception as e:
+                    failures.append((label, str(e)))
+                    self.record_failure(url, label, str(e))
+                    log_error_to_file(
+                        "download_and_process_playlists.py", f"Playlist {label} failed:\n{traceback.format_exc()}"
+                    )
+                    log_progress(f"\nPlaylist {label} failed. Details written to the log file: {e}")
+        except KeyboardInterrupt:
+            # Don't start anything new; sldl processes already running receive the interrupt from the console too
+            scrapes.shutdown(wait=False, cancel_futures=True)
+            downloads.shutdown(wait=False, cancel_futures=True)
+            raise
+        finally:
+            scrapes.shutdown()
+            downloads.shutdown()
+            if self.scraper is not None:
+                self.scraper.close()
+        return failures
+
+def print_failures(failures):
+    if not failures:
+        return
+    print(f"\n{len(failures)} playlist(s) failed:")
+    for label, error_message in failures:
+        print(f"  {label}: {error_message.splitlines()[0] if error_message else 'unknown error'}")
@@ -0,0 +1,230 @@
+# Persistent sync state for each playlist in playlists.csv, kept in ../playlist_state.sqlite.
+# For every playlist it records when it was last attempted and last synced successfully, how many tracks it had, a hash
+# of its track list and how many tracks were new or failed. The track list is the scraped list for SoundCloud playlists
+# and the _index.sldl that sldl leaves in the playlist's folder otherwise.
+# playlist_scheduler.py uses this to:
+#   * order the run: playlists that have never synced first, then the ones that gained tracks last time, then the rest
+#     by how long ago they were synced
+#   * skip playlists whose track list didn't change at their last sync, if that sync is more recent than the skip window
+#   * resume an interrupted run: playlists that already synced during it are not synced again
+# A playlist's folder is found by its name (the comment in playlists.csv for Spotify playlists, the CSV name for
+# SoundCloud ones). Playlists whose folder can't be found have no track list, so they are never skipped.
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from sldl_index import SldlIndex, STATE_FAILED, STATE_NOT_FOUND_LAST_TIME
+
+PLAYLIST_STATE_DB = '../playlist_state.sqlite'
+LIBRARY = '../tracks_and_playlists/'
+
+INDEX_FILE_NAME = '_index.sldl'
+
+SYNCED = 'synced'
+FAILED = 'failed'
+
+class PlaylistStateStore:
+    """SQLite-backed sync state per playlist, and the start of the current run. Safe to share between threads."""
+
+    def __init__(self, db_path=PLAYLIST_STATE_DB, library=LIBRARY):
+        self.db_path = db_path
+        self.library = library
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS playlists (
+                url TEXT PRIMARY KEY,
+                name TEXT,
+                folder TEXT,
+                last_attempt REAL,
+                last_success REAL,
+                last_status TEXT,
+                last_error TEXT,
+                track_count INTEGER,
+                content_hash TEXT,
+                unchanged INTEGER NOT NULL DEFAULT 0,
+                new_tracks INTEGER,
+                failed_tracks INTEGER
+            )"""
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS runs (id INTEGER PRIMARY KEY, started_at REAL NOT NULL, finished_at REAL)"
+        )
+        self.connection.commit()
+        self.run_started_at = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def begin_run(self, resume=True):
+        """
+        Starts a run, or carries on with the last one if it was interrupted (and resume is set).
+
+        Returns:
+            bool: True if an interrupted run is being resumed.
+        """
+        with self.lock:
+            row = self.last_run()
+            if resume and row is not None and row[2] is None:
+                self.run_id, self.run_started_at = row[0], row[1]
+                return True
+            if row is not None and row[2] is None:
+                # Not resuming: the interrupted run is closed off so it isn't resumed later either
+                self.connection.execute("UPDATE runs SET finished_at = ? WHERE id = ?", (time.time(), row[0]))
+            self.run_started_at = time.time()
+            self.run_id = self.connection.execute(
+                "INSERT INTO runs (started_at) VALUES (?)", (self.run_started_at,)
+            ).lastrowid
+            self.connection.commit()
+            return False
+
+    def peek_run(self, resume=True):
+        """
+        Works out what begin_run(resume) would do without starting a run, so that plan() skips the playlists an
+        interrupted run already synced, just as the run itself will. Nothing is written.
+
+        Returns:
+            bool: True if an interrupted run would be resumed.
+        """
+        with self.lock:
+            row = self.last_run()
+        if resume and row is not None and row[2] is None:
+            self.run_started_at = row[1]
+            return True
+        self.run_started_at = None
+        return False
+
+    def last_run(self):
+        """Returns (id, started_at, finished_at) of the latest run, or None. Call with the lock held."""
+        return self.connection.execute(
+            "SELECT id, started_at, finished_at FROM runs ORDER BY id DESC LIMIT 1"
+        ).fetchone()
+
+    def finish_run(self):
+        with self.lock:
+            self.connection.execute("UPDATE runs SET finished_at = ? WHERE id = ?", (time.time(), self.run_id))
+            self.connection.commit()
+
+    def get(self, url):
+        with self.lock:
+            self.connection.row_factory = sqlite3.Row
+            try:
+                row = self.connection.execute("SELECT * FROM playlists WHERE url = ?", (url,)).fetchone()
+            finally:
+                self.connection.row_factory = None
+        return dict(row) if row else None
+
+    def synced_this_run(self, state):
+        return bool(state and self.run_started_at and (state['last_success'] or 0) >= self.run_started_at)
+
+    def is_dormant(self, state, skip_window):
+        """True if the playlist's track list was unchanged at its last sync, and that sync is within skip_window."""
+        if not state or not skip_window or state['last_success'] is None:
+            return False
+        return bool(state['unchanged']) and time.time() - state['last_success'] < skip_window
+
+    def plan(self, items, skip_window=0):
+        """
+        Orders playlists for a run and picks out the ones that can be skipped.
+
+        Args:
+            items (list): (url, name, item) tuples; item is passed through untouched.
+            skip_window (float): Seconds within which playlists whose track list didn't change at their last sync are
+                skipped. 0 syncs every playlist.
+
+        Returns:
+            tuple: (items to sync, in order; (item, reason) for each skipped playlist)
+        """
+        to_sync = []
+        skipped = []
+        for position, (url, name, item) in enumerate(items):
+            state = self.get(url)
+            if self.synced_this_run(state):
+                skipped.append((item, "already synced in the interrupted run"))
+            elif self.is_dormant(state, skip_window):
+                days = (time.time() - state['last_success']) / 86400
+                skipped.append((item, f"unchanged at its last sync, {days:.1f} day(s) ago"))
+            else:
+                to_sync.append((self.priority(state, position), item))
+        to_sync.sort(key=lambda entry: entry[0])
+        return [item for _, item in to_sync], skipped
+
+    @staticmethod
+    def priority(state, position):
+        """Sort key: never synced first, then playlists that gained tracks last time, then the longest unsynced."""
+        if state is None or state['last_success'] is None:
+            return (0, 0, position)
+        if state['new_tracks']:
+            return (1, state['last_success'], position)
+        return (2, state['last_success'], position)
+
+    def folder_for(self, name):
+        return os.path.join(self.library, name) if name else None
+
+    def record_success(self, url, name, folder=None, tracks=None):
+        """
+        Records a successful sync.
+
+        Args:
+            url (str): The playlist's URL, as in playlists.csv.
+            name (str): The playlist's name, which is also the name of its folder unless folder is given.
+            folder (str): The playlist's folder.
+            tracks (list): The playlist's (artist, title) pairs, if known. Otherwise they are read from the
+                _index.sldl in its folder.
+        """
+        folder = folder or self.folder_for(name)
+        index_path = os.path.join(folder, INDEX_FILE_NAME) if folder else None
+        index = SldlIndex.load(index_path) if index_path and os.path.isfile(index_path) else None
+        if tracks is None and index is not None:
+            tracks = [(entry.artist, entry.title) for entry in index.entries]
+
+        track_count = content_hash = new_tracks = failed_tracks = None
+        if tracks is not None:
+            keys = sorted(f"{artist.strip().casefold()}\t{title.strip().casefold()}" for artist, title in tracks)
+            track_count = len(keys)
+            content_hash = hashlib.sha1("\n".join(keys).encode('utf-8')).hexdigest()
+        if index is not None:
+            failed_tracks = sum(1 for entry in index.entries if entry.state in (STATE_FAILED, STATE_NOT_FOUND_LAST_TIME))
+
+        previous = self.get(url)
+        if content_hash is not None and previous and previous['track_count'] is not None:
+            new_tracks = max(0, track_count - previous['track_count'])
+        unchanged = bool(content_hash and previous and previous['content_hash'] == content_hash)
+
+        now = time.time()
+        with self.lock:
+            self.connection.execute(
+                """INSERT INTO playlists (url, name, folder, last_attempt, last_success, last_status, last_error,
+                                          track_count, content_hash, unchanged, new_tracks, failed_tracks)
+                   VALUES (?, ?, ?, ?, ?, ?, NULL, ?, ?, ?, ?, ?)
+                   ON CONFLICT (url) DO UPDATE SET
+                       name = excluded.name, folder = excluded.folder, last_attempt = excluded.last_attempt,
+                       last_success = excluded.last_success, last_status = excluded.last_status, last_error = NULL,
+                       track_count = excluded.track_count, content_hash = excluded.content_hash,
+                       unchanged = excluded.unchanged, new_tracks = excluded.new_tracks,
+                       failed_tracks = excluded.failed_tracks""",
+                (url, name, folder, now, now, SYNCED, track_count, content_hash, int(unchanged), new_tracks,
+                 failed_tracks)
+            )
+            self.connection.commit()
+
+    def record_failure(self, url, name, error):
+        with self.lock:
+            self.connection.execute(
+                """INSERT INTO playlists (url, name, last_attempt, last_status, last_error) VALUES (?, ?, ?, ?, ?)
+                   ON CONFLICT (url) DO UPDATE SET
+                       name = excluded.name, last_attempt = excluded.last_attempt,
+                       last_status = excluded.last_status, last_error = excluded.last_error""",
+                (url, name, time.time(), FAILED, str(error))
+            )
+            self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,181 @@
+# Persistent on-disk cache of audio probe results, so unchanged files are not re-parsed with mutagen on every run.
+# Entries are keyed on the file path and are only valid while the file's size and modification time are unchanged.
+# The cache is a SQLite database stored in the library directory (.probe_cache.sqlite).
+# It also holds the loudness measured for files that didn't need remuxing (see loudness.py), keyed on the file's identity
+# (device and inode) rather than its path, so hard-linked copies of a track are only measured once.
+
+import os
+import sqlite3
+import threading
+import time
+
+CACHE_FILE_NAME = '.probe_cache.sqlite'
+
+# Number of writes after which the cache is committed to disk
+COMMIT_EVERY = 200
+
+def cache_path_for(directory):
+    """Returns the location of the probe cache for a library directory."""
+    return os.path.join(directory, CACHE_FILE_NAME)
+
+class ProbeCache:
+    """
+    SQLite-backed cache of format, bitrate, duration, codec, sample rate and channels per audio file.
+
+    Lookups are keyed on (path, size, mtime), so a file that has been re-encoded or re-tagged is probed again.
+    Safe to share between threads.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.pending_writes = 0
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS probes (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                format TEXT,
+                bitrate TEXT,
+                duration REAL,
+                codec TEXT,
+                probed_at REAL NOT NULL,
+                sample_rate INTEGER,
+                channels INTEGER
+            )"""
+        )
+        # Caches created before sample rate and channels were recorded
+        columns = {row[1] for row in self.connection.execute("PRAGMA table_info(probes)")}
+        for column in ('sample_rate', 'channels'):
+            if column not in columns:
+                self.connection.execute(f"ALTER TABLE probes ADD COLUMN {column} INTEGER")
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS loudness (
+                device INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                integrated REAL,
+                true_peak REAL,
+                gain REAL,
+                measured_at REAL NOT NULL,
+                PRIMARY KEY (device, inode)
+            )"""
+        )
+        self.connection.commit()
+
+    @classmethod
+    def for_directory(cls, directory):
+        return cls(cache_path_for(directory))
+
+    @staticmethod
+    def key(file_path):
+        return os.path.normcase(os.path.abspath(file_path))
+
+    def get(self, file_path, stat=None):
+        """Returns the cached info for file_path, or None if it is missing or stale."""
+        stat = stat or os.stat(file_path)
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT size, mtime_ns, format, bitrate, duration, codec, sample_rate, channels "
+                "FROM probes WHERE path = ?",
+                (self.key(file_path),)
+            ).fetchone()
+        if row is None or row[0] != stat.st_size or row[1] != stat.st_mtime_ns:
+            return None
+        return {
+            'format': row[2], 'bitrate': row[3], 'duration': row[4], 'codec': row[5], 'sample_rate': row[6],
+            'channels': row[7],
+        }
+
+    def put(self, file_path, file_info, stat=None):
+        """Stores the probe result for file_path against its current size and modification time."""
+        stat = stat or os.stat(file_path)
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO probes "
+                "(path, size, mtime_ns, format, bitrate, duration, codec, probed_at, sample_rate, channels) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    self.key(file_path), stat.st_size, stat.st_mtime_ns,
+                    file_info.get('format'), file_info.get('bitrate'),
+                    file_info.get('duration'), file_info.get('codec'), time.time(),
+                    file_info.get('sample_rate'), file_info.get('channels')
+                )
+            )
+            self._commit_if_due()
+
+    def probe(self, file_path, probe_function):
+        """Returns cached info for file_path, calling probe_function(file_path) and caching the result on a miss."""
+        stat = os.stat(file_path)
+        file_info = self.get(file_path, stat)
+        if file_info is not None:
+            return file_info
+
+        file_info = probe_function(file_path)
+        # Failed probes are not cached so they are retried (and reported) on the next run
+        if file_info is not None:
+            self.put(file_path, file_info, stat)
+        return file_info
+
+    def get_loudness(self, stat):
+        """Returns the cached loudness of the file with this stat result, or None if it is missing or stale."""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT size, mtime_ns, integrated, true_peak, gain FROM loudness WHERE device = ? AND inode = ?",
+                (stat.st_dev, stat.st_ino)
+            ).fetchone()
+        if row is None or row[0] != stat.st_size or row[1] != stat.st_mtime_ns:
+            return None
+        return {'integrated': row[2], 'true_peak': row[3], 'gain': row[4]}
+
+    def put_loudness(self, stat, loudness):
+        """Stores the loudness of the file with this stat result against its size and modification time."""
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO loudness "
+                "(device, inode, size, mtime_ns, integrated, true_peak, gain, measured_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns,
+                    loudness['integrated'], loudness['true_peak'], loudness['gain'], time.time()
+                )
+            )
+            self._commit_if_due()
+
+    def forget(self, file_path):
+        """Removes the entry for a file that has been deleted or replaced."""
+        with self.lock:
+            self.connection.execute("DELETE FROM probes WHERE path = ?", (self.key(file_path),))
+            self._commit_if_due()
+
+    def evict_missing(self, directory, seen_paths):
+        """
+        Removes entries under directory whose files were not seen during the last walk (i.e. have been deleted).
+
+        Args:
+            directory (str): The directory that was walked.
+            seen_paths (iterable): The file paths found by the walk.
+        """
+        prefix = os.path.join(self.key(directory), '')
+        seen = {self.key(path) for path in seen_paths}
+        with self.lock:
+            cached = [row[0] for row in self.connection.execute("SELECT path FROM probes")]
+            stale = [(path,) for path in cached if path.startswith(prefix) and path not in seen]
+            self.connection.executemany("DELETE FROM probes WHERE path = ?", stale)
+            self.connection.commit()
+            self.pending_writes = 0
+        return len(stale)
+
+    def _commit_if_due(self):
+        self.pending_writes += 1
+        if self.pending_writes >= COMMIT_EVERY:
+            self.connection.commit()
+            self.pending_writes = 0
+
+    def close(self):
+        with self.lock:
+            self.connection.commit()
+            self.connection.close()
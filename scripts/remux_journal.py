@@ -0,0 +1,162 @@
+# Crash-safe journal of remux jobs.
+# Each job encodes into a staging file next to its destination (so the final rename is atomic and never copies across
+# volumes), and records its progress in .remux_journal.sqlite in the library directory:
+#   encoding -> encoded -> committed -> source_removed -> (done: playlists rewritten, job deleted)
+# If a run is interrupted, resume() picks every unfinished job up exactly where it stopped, and stale staging files
+# left behind by a killed encoder are removed.
+
+import os
+import sqlite3
+import threading
+import time
+
+JOURNAL_FILE_NAME = '.remux_journal.sqlite'
+
+# Suffix of the file an encoder writes to before it is renamed onto the destination
+STAGING_SUFFIX = '.remux-partial'
+
+ENCODING = 'encoding'
+ENCODED = 'encoded'
+COMMITTED = 'committed'
+SOURCE_REMOVED = 'source_removed'
+
+def staging_path_for(destination_path):
+    return destination_path + STAGING_SUFFIX
+
+def same_file_path(first, second):
+    return os.path.normcase(os.path.abspath(first)) == os.path.normcase(os.path.abspath(second))
+
+class RemuxJournal:
+    """
+    Records the state of each remux job so an interrupted run can be resumed. Safe to share between threads.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS jobs (
+                source TEXT PRIMARY KEY,
+                destination TEXT NOT NULL,
+                staging TEXT NOT NULL,
+                state TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )"""
+        )
+        self.connection.commit()
+
+    @classmethod
+    def for_directory(cls, directory):
+        return cls(os.path.join(directory, JOURNAL_FILE_NAME))
+
+    def start(self, source_path, destination_path):
+        """Records a new job and returns the staging path its encoder should write to."""
+        staging_path = staging_path_for(destination_path)
+        self._write(
+            "INSERT OR REPLACE INTO jobs (source, destination, staging, state, updated_at) VALUES (?, ?, ?, ?, ?)",
+            (os.path.abspath(source_path), os.path.abspath(destination_path), os.path.abspath(staging_path),
+             ENCODING, time.time())
+        )
+        return staging_path
+
+    def set_state(self, source_path, state):
+        self._write(
+            "UPDATE jobs SET state = ?, updated_at = ? WHERE source = ?",
+            (state, time.time(), os.path.abspath(source_path))
+        )
+
+    def finish(self, source_paths):
+        """Deletes jobs whose playlist rewrites have been written."""
+        with self.lock:
+            self.connection.executemany(
+                "DELETE FROM jobs WHERE source = ?", [(os.path.abspath(path),) for path in source_paths]
+            )
+            self.connection.commit()
+
+    def discard(self, source_path):
+        """Forgets a job that failed before its output was committed."""
+        self.finish([source_path])
+
+    def jobs(self):
+        with self.lock:
+            return self.connection.execute("SELECT source, destination, staging, state FROM jobs").fetchall()
+
+    def _write(self, sql, parameters):
+        # Every transition is committed immediately: the journal is only useful if it survives a kill
+        with self.lock:
+            self.connection.execute(sql, parameters)
+            self.connection.commit()
+
+    def commit_output(self, source_path, staging_path, destination_path):
+        """Atomically moves a finished encode onto its destination and removes the source."""
+        self.set_state(source_path, ENCODED)
+        os.replace(staging_path, destination_path)
+        self.set_state(source_path, COMMITTED)
+        self.remove_source(source_path, destination_path)
+
+    def remove_source(self, source_path, destination_path):
+        # Re-encoding an MP3 in place replaces the source itself, so there is nothing left to remove
+        if not same_file_path(source_path, destination_path) and os.path.exists(source_path):
+            os.remove(source_path)
+        self.set_state(source_path, SOURCE_REMOVED)
+
+    def resume(self, rewriter):
+        """
+        Completes or rolls back the jobs left behind by an interrupted run.
+
+        Jobs that were still encoding are rolled back (the source is untouched and is remuxed again); jobs whose
+        encode had finished are committed; and the playlist rewrites of every committed job are queued on rewriter.
+
+        Returns:
+            int: The number of jobs that were resumed.
+        """
+        resumed = 0
+        for source_path, destination_path, staging_path, state in self.jobs():
+            resumed += 1
+            try:
+                if state == ENCODING:
+                    if os.path.exists(staging_path):
+                        os.remove(staging_path)
+                    self.discard(source_path)
+                    continue
+
+                if state == ENCODED:
+                    if os.path.exists(staging_path):
+                        os.replace(staging_path, destination_path)
+                    elif not os.path.exists(destination_path):
+                        # Nothing to commit; the source (if still present) will be remuxed again
+                        self.discard(source_path)
+                        continue
+                    self.set_state(source_path, COMMITTED)
+                    state = COMMITTED
+
+                if state == COMMITTED:
+                    self.remove_source(source_path, destination_path)
+
+                if not same_file_path(source_path, destination_path):
+                    rewriter.add(source_path, destination_path)
+                else:
+                    self.finish([source_path])
+            except OSError as e:
+                print(f"Could not resume remux of {source_path}: {e}")
+        return resumed
+
+    def remove_stale_staging_files(self, staging_paths):
+        """Deletes staging files that do not belong to an unfinished job."""
+        active = {os.path.normcase(staging) for _, _, staging, _ in self.jobs()}
+        removed = 0
+        for staging_path in staging_paths:
+            if os.path.normcase(os.path.abspath(staging_path)) not in active:
+                try:
+                    os.remove(staging_path)
+                    removed += 1
+                except OSError:
+                    pass
+        return removed
+
+    def close(self):
+        with self.lock:
+            self.connection.commit()
+            self.connection.close()
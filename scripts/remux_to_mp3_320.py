@@ -1,24 +1,62 @@
 # Remuxes all files in a directory to 320kbps MP3 format.
 # Also updates .m3u8 playlists and .sldl indexes with the new file extension.
-# Usage: python remux_to_mp3_320.py <directory_path>
+# Usage: python remux_to_mp3_320.py <directory_path> [workers] [ffmpeg|pyav|auto]
+#            [--max-encode-minutes M] [--max-bytes-written SIZE] [--plan [--output plan.json]]
+# With a budget (see run_budget.py), files are remuxed newest playlist folder first and the rest are left for a later
+# run once the budget is spent. --plan only reports what would be done (see run_plan.py).
 # If the directory path is not provided, the script will prompt the user to select a directory.
+# Probing and transcoding run across a pool of worker threads, defaulting to the number of CPU cores.
+# Files are encoded with ffmpeg or in-process with PyAV, whichever is faster here (see encoders.py); set REMUX_ENCODER to
+# pick one.
+# Loudness is measured in the same decode pass and written to each output as ReplayGain and R128 tags (see loudness.py).
+# Files that are already 320kbps MP3 are measured and tagged once; their loudness is cached in .probe_cache.sqlite.
+# Probe results are cached in the library's .probe_cache.sqlite, so unchanged files are not re-parsed on the next run.
+# Each conversion is recorded in the library's .remux_journal.sqlite, so an interrupted run is resumed where it stopped.
+# Probe and encode times for every file are recorded as run metrics (see run_metrics.py).
+# Files that are hard links of each other (see dedupe_library.py) are remuxed once, and the other links re-pointed at the result.
+# Sources that would be remuxed to the same file (song.flac and song.wav both become song.mp3) are remuxed once: an MP3
+# already at the destination wins, otherwise the first one found, and the others are skipped with an error logged.
 
+import argparse
 import os
-import subprocess
-import sys
 import time
-import shutil
 from mutagen import File
 from mutagen.mp3 import MP3
 from collections import defaultdict
 import traceback
-import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from log_error_to_file import log_error_to_file
+from playlist_index import PlaylistRewriter, normalise_path
+from probe_cache import ProbeCache
+from remux_journal import RemuxJournal, STAGING_SUFFIX, same_file_path
+from run_metrics import stage, timed
+from dedupe_library import link_duplicate
+from encoders import AUTO, ENCODERS, get_encoder, select_encoder
+import loudness
+from run_budget import RunBudget, estimate_seconds, estimate_transcode, folder_priority, parse_size
 
 # Dictionary to track file summaries
 file_summary = defaultdict(int)
+summary_lock = threading.Lock()
 
-def get_audio_info(file_path):
+# Number of converted files after which pending playlist rewrites are written out
+PLAYLIST_CHECKPOINT = 500
+
+AUDIO_EXTENSIONS = ('.mp3', '.flac', '.wav', '.aac', '.ogg')  # Add more formats as needed
+
+def get_audio_info(file_path, cache=None):
+    if cache is not None:
+        try:
+            return cache.probe(file_path, probe_audio_file)
+        except OSError as e:
+            error_message = f"Error processing {file_path}: {e}"
+            print(error_message)
+            log_error_to_file(__file__, error_message)
+            return None
+    return probe_audio_file(file_path)
+
+def probe_audio_file(file_path):
     try:
         audio = File(file_path)
         if audio is None:
@@ -26,7 +64,9 @@ def get_audio_info(file_path):
         
         file_info = {
             'format': audio.mime[0] if hasattr(audio, 'mime') else 'unknown',
-            'bitrate': None
+            'bitrate': None,
+            'duration': getattr(audio.info, 'length', None),
+            'codec': type(audio).__name__
         }
 
         # If it's an MP3 file, use MP3-specific processing
@@ -45,135 +85,344 @@ def get_audio_info(file_path):
         log_error_to_file(__file__, error_message)
         return None
 
-def update_m3u8_files(directory, old_file, new_file):
-    """Update all .m3u8 files in the directory to replace old_file with new_file."""
-    for subdir, _, files in os.walk(directory):
-        for file in files:
-            if file.lower().endswith('.m3u8'):
-                playlist_path = os.path.join(subdir, file)
-                try:
-                    with open(playlist_path, 'r', encoding='utf-8') as f:
-                        lines = f.readlines()
-                    
-                    # Check if the old_file is in the playlist
-                    if any(old_file in line for line in lines):
-                        # Replace old_file references with new_file
-                        updated_lines = [
-                            line.replace(old_file, new_file) for line in lines
-                        ]
-                        
-                        # Write back the updated lines to the file
-                        with open(playlist_path, 'w', encoding='utf-8') as f:
-                            f.writelines(updated_lines)
-
-                        print(f"Updated playlist: {playlist_path}")
-
-                except Exception as e:
-                    error_message = f"Error updating playlist {playlist_path}: {e}"
-                    print(error_message)
-                    log_error_to_file(__file__, error_message)
-
-def update_sldl_files(directory, old_file, new_file):
-    """Update all .sldl files in the directory to replace old_file with new_file."""
-    for subdir, _, files in os.walk(directory):
-        for file in files:
-            if file.lower().endswith('.sldl'):
-                sldl_path = os.path.join(subdir, file)
-                try:
-                    with open(sldl_path, 'r', encoding='utf-8') as f:
-                        # Read the single line, which starts with '#SLDL:'
-                        line = f.readline().strip()
-
-                    # Check if the old_file is in the SLDL line (ignoring the '#SLDL:' prefix)
-                    if old_file in line:
-                        # Replace old_file references with new_file
-                        updated_line = line.replace(old_file, new_file)
-
-                        # Write back the updated line to the file
-                        with open(sldl_path, 'w', encoding='utf-8') as f:
-                            f.write(f"#SLDL:{updated_line}")
-
-                        print(f"Updated SLDL file: {sldl_path}")
-
-                except Exception as e:
-                    error_message = f"Error updating SLDL file {sldl_path}: {e}"
-                    print(error_message)
-                    log_error_to_file(__file__, error_message)               
-
-
-def remux_to_320kbps_mp3(source_path, destination_path, directory):
+def remux_to_320kbps_mp3(source_path, destination_path, rewriter, journal, cache=None):
+    """Encodes source_path into destination_path. Returns its loudness, or None if it wasn't measured."""
     try:
         # Ensure destination folder exists
         os.makedirs(os.path.dirname(destination_path), exist_ok=True)
         
-        # Generate temporary file name for processing
-        temp_fd, temp_destination_path = tempfile.mkstemp(suffix=".mp3")
-        os.close(temp_fd)  # Close the file descriptor immediately
-
-        # ffmpeg command to remux to 320kbps MP3
-        command = [
-            'ffmpeg', '-y',  # Overwrite without prompting
-            '-i', source_path,  # Input file
-            '-b:a', '320k',  # Audio bitrate
-            '-map_metadata', '0',  # Copy metadata
-            '-vn',  # Exclude video (if any)
-            temp_destination_path  # Output temporary file
-        ]
-        
+        # Encode into a staging file next to the destination, so the final rename is atomic and stays on one volume
+        staging_path = journal.start(source_path, destination_path)
+
         try:
-            result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
-            # print(f"Subprocess finished with return code {result.returncode}")
-            # print(f"Subprocess stdout: {result.stdout.decode()}")
-            # print(f"Subprocess stderr: {result.stderr.decode()}")
-        except subprocess.CalledProcessError as e:
-            print(f"Subprocess failed with return code {e.returncode}")
-            print(f"Subprocess stdout: {e.stdout.decode()}")
-            print(f"Subprocess stderr: {e.stderr.decode()}")
+            measured = get_encoder().encode(source_path, staging_path, measure=loudness.enabled)
+            if measured is not None:
+                loudness.write_tags(staging_path, measured)
+        except Exception:
+            if os.path.exists(staging_path):
+                os.remove(staging_path)
+            journal.discard(source_path)
             raise
 
-        # Ensure the file handle is released
-        time.sleep(1)
-
         try:
-            shutil.move(temp_destination_path, destination_path)
-            print(f"File moved from {temp_destination_path} to {destination_path}")
+            # Rename onto the destination and remove the source, recording each step in the journal
+            journal.commit_output(source_path, staging_path, destination_path)
+            print(f"File moved from {staging_path} to {destination_path}")
         except OSError as e:
             print(f"Error moving file: {e}")
             raise
+        if measured is not None and cache is not None:
+            cache.put_loudness(os.stat(destination_path), measured)
         
-        # Update .m3u8 playlists and .sldl indexes with the new file extension
-        # old_file = os.path.relpath(source_path, directory)
-        # new_file = os.path.relpath(destination_path, directory)
-        old_file = os.path.relpath(source_path, directory)
-        destination_path = os.path.relpath(destination_path, directory)
+        # Queue the .m3u8 playlist and .sldl index updates; they are written in batches by the rewriter
         print("old file: ", source_path)
         print("new file: ", destination_path)
-        update_m3u8_files(directory, old_file, destination_path)
-        update_sldl_files(directory, old_file, destination_path)
-        
-        # Remove the original file after remuxing
-        os.remove(source_path)
+        if same_file_path(source_path, destination_path):
+            # Re-encoded in place: playlists already point at the right file
+            journal.finish([source_path])
+        else:
+            rewriter.add(source_path, destination_path)
+        return measured
     except Exception as e:
         print(f"Error remuxing {source_path}: {e}")
         raise
 
-def walk_directory(directory):
+def measure_loudness(file_path, cache=None, budget=None, audio_info=None):
+    """
+    Measures and tags a file that doesn't need remuxing, unless its loudness is already cached.
+
+    Returns:
+        bool: True if the file was measured, False if the cached result was still valid or the budget is spent.
+    """
+    stat = os.stat(file_path)
+    if cache is not None and cache.get_loudness(stat) is not None:
+        return False
+    if budget is not None and not budget.reserve(file_path, estimate_seconds(audio_info, stat.st_size) / 60):
+        return False
+    measured = get_encoder().analyse(file_path)
+    if measured is None:
+        log_error_to_file(__file__, f"Loudness of {file_path} could not be measured")
+        return True
+    loudness.write_tags(file_path, measured)
+    if cache is not None:
+        # Stored against the tagged file, so the tags just written don't make the entry stale
+        cache.put_loudness(os.stat(file_path), measured)
+    return True
+
+def process_file(file_path, rewriter, journal, cache=None, summary=None, budget=None):
+    """
+    Probe a single file, record it in the summary and remux it if it is not already 320kbps MP3.
+    With a budget, the file is left as it is if its estimated cost doesn't fit in what is left.
+
+    Returns:
+        tuple: (summary key, path of the resulting file, whether it was converted), or None if the file failed.
+    """
+    if summary is None:
+        summary = file_summary
+    try:
+        with timed("file", stage="remux", path=file_path) as timer:
+            probe_start = time.perf_counter()
+            audio_info = get_audio_info(file_path, cache)
+            timer.fields['probe_seconds'] = round(time.perf_counter() - probe_start, 4)
+            if audio_info:
+                # Update the summary
+                key = f"{audio_info['format']} - {audio_info['bitrate'] or 'Unknown Bitrate'}"
+                with summary_lock:
+                    summary[key] += 1
+                timer.fields.update(format=audio_info['format'], bitrate=audio_info['bitrate'], converted=False)
+
+                # Remux if not 320kbps MP3
+                if audio_info['format'] != 'audio/mp3' or audio_info['bitrate'] != '320kbps':
+                    destination_path = os.path.splitext(file_path)[0] + '.mp3'
+                    timer.bytes = os.path.getsize(file_path)
+                    cost = estimate_transcode(audio_info, timer.bytes)
+                    if budget is not None and not budget.reserve(file_path, *cost):
+                        timer.fields['deferred'] = True
+                        return key, file_path, False
+                    encode_start = time.perf_counter()
+                    measured = remux_to_320kbps_mp3(file_path, destination_path, rewriter, journal, cache)
+                    timer.fields.update(converted=True, encode_seconds=round(time.perf_counter() - encode_start, 4),
+                                        encoder=get_encoder().name)
+                    if measured is not None:
+                        timer.fields['loudness'] = measured['integrated']
+                    return key, destination_path, True
+                if loudness.enabled:
+                    loudness_start = time.perf_counter()
+                    try:
+                        if measure_loudness(file_path, cache, budget, audio_info):
+                            timer.fields['loudness_seconds'] = round(time.perf_counter() - loudness_start, 4)
+                    except Exception as e:
+                        # The file itself is fine; it is measured again on the next run
+                        log_error_to_file(__file__, f"Error measuring the loudness of {file_path}: {e}")
+                return key, file_path, False
+            else:
+                log_error_to_file(__file__, f"Error processing {file_path}: Audio info not found.")
+    except Exception as e:
+        # One failed file must not take down the rest of the pool
+        error_message = f"Error processing {file_path}: {e}\n{traceback.format_exc()}"
+        print(error_message)
+        log_error_to_file(__file__, error_message)
+    return None
+
+def group_hard_links(file_paths):
+    """Groups paths that are hard links to the same file (see dedupe_library.py), in walk order."""
+    groups = {}
+    for file_path in file_paths:
+        try:
+            stat = os.stat(file_path)
+            identity = (stat.st_dev, stat.st_ino)
+        except OSError:
+            identity = file_path
+        groups.setdefault(identity, []).append(file_path)
+    return list(groups.values())
+
+def destination_of(file_path):
+    return normalise_path(os.path.splitext(file_path)[0] + '.mp3')
+
+def split_destination_clashes(linked_groups):
+    """
+    Keeps one source per destination, so two jobs never write (or stage) the same .mp3. An MP3 that is already at its
+    destination is kept, otherwise the first source in walk order.
+
+    Returns:
+        tuple: (the groups with the clashing paths taken out, [(skipped path, path kept for its destination)])
+    """
+    owners = {
+        destination_of(file_path): file_path
+        for file_paths in linked_groups for file_path in file_paths
+        if normalise_path(file_path) == destination_of(file_path)
+    }
+    kept = []
+    clashes = []
+    for file_paths in linked_groups:
+        remaining = []
+        for file_path in file_paths:
+            owner = owners.setdefault(destination_of(file_path), file_path)
+            if owner == file_path:
+                remaining.append(file_path)
+            else:
+                clashes.append((file_path, owner))
+        if remaining:
+            kept.append(remaining)
+    return kept, clashes
+
+def process_linked_files(file_paths, rewriter, journal, cache=None, summary=None, budget=None):
+    """
+    Processes a group of hard links to one file: the file is probed and remuxed once, through its first path, and the
+    other paths are then linked to the result instead of being remuxed again.
+    """
+    if summary is None:
+        summary = file_summary
+    outcome = process_file(file_paths[0], rewriter, journal, cache, summary, budget)
+    if outcome is None:
+        return
+    key, result_path, converted = outcome
+
+    for duplicate_path in file_paths[1:]:
+        if converted:
+            destination_path = os.path.splitext(duplicate_path)[0] + '.mp3'
+            try:
+                link_duplicate(result_path, destination_path)
+                if not same_file_path(duplicate_path, destination_path):
+                    os.remove(duplicate_path)
+                    rewriter.add(duplicate_path, destination_path)
+                print(f"Linked {destination_path} -> {result_path}")
+            except OSError as e:
+                print(f"Could not link {duplicate_path} to {result_path} ({e}); remuxing it separately")
+                process_file(duplicate_path, rewriter, journal, cache, summary, budget)
+                continue
+        with summary_lock:
+            summary[key] += 1
+
+def find_audio_files(directory, staging_files=None):
+    """Yields the audio files under directory. Leftover staging files are appended to staging_files, if given."""
     for subdir, _, files in os.walk(directory):
         for file in files:
             file_path = os.path.join(subdir, file)
-            if file_path.lower().endswith(('.mp3', '.flac', '.wav', '.aac', '.ogg')):  # Add more formats as needed
-                audio_info = get_audio_info(file_path)
-                if audio_info:                 
-                    # Update the summary
-                    key = f"{audio_info['format']} - {audio_info['bitrate'] or 'Unknown Bitrate'}"
-                    file_summary[key] += 1
-
-                    # Remux if not 320kbps MP3
-                    if audio_info['format'] != 'audio/mp3' or audio_info['bitrate'] != '320kbps':
-                        destination_path = os.path.splitext(file_path)[0] + '.mp3'
-                        remux_to_320kbps_mp3(file_path, destination_path, directory)
-                else:
-                    log_error_to_file(__file__, f"Error processing {file_path}: Audio info not found.")
+            if file_path.lower().endswith(AUDIO_EXTENSIONS):
+                yield file_path
+            elif staging_files is not None and file.endswith(STAGING_SUFFIX):
+                staging_files.append(file_path)
+
+def find_audio_files_in(paths, staging_files=None):
+    """Returns the audio files in paths, which may be folders (searched recursively) or single files."""
+    audio_files = []
+    for path in paths:
+        if os.path.isdir(path):
+            audio_files.extend(find_audio_files(path, staging_files))
+        elif path.lower().endswith(AUDIO_EXTENSIONS) and os.path.isfile(path):
+            audio_files.append(path)
+    # A file may be listed both on its own and as part of its folder
+    return list(dict.fromkeys(audio_files))
+
+def walk_directory(directory, workers=1, paths=None, budget=None):
+    """
+    Remuxes the audio files under directory, or only those in paths (folders or files inside directory) if given.
+    With a budget, the newest playlist folders are remuxed first.
+    """
+    with stage("remux", directory=directory, workers=workers, scoped=paths is not None) as timer:
+        journal = RemuxJournal.for_directory(directory)
+        # Only the playlists next to the files being remuxed need re-reading when the walk is limited to some paths
+        folders = None if paths is None else [path if os.path.isdir(path) else os.path.dirname(path) for path in paths]
+        # Jobs are only finished once their playlist rewrites are on disk
+        rewriter = PlaylistRewriter(directory, checkpoint_every=PLAYLIST_CHECKPOINT, on_flush=journal.finish,
+                                    folders=folders)
+        cache = ProbeCache.for_directory(directory)
+        try:
+            # Complete whatever an interrupted run left behind before looking for new work
+            resumed = journal.resume(rewriter)
+            if resumed:
+                print(f"Resumed {resumed} interrupted remux job(s).")
+                rewriter.flush()
+
+            staging_files = []
+            if paths is None:
+                audio_files = list(find_audio_files(directory, staging_files))
+            else:
+                audio_files = find_audio_files_in(paths, staging_files)
+            timer.files = len(audio_files)
+            removed = journal.remove_stale_staging_files(staging_files)
+            if removed:
+                print(f"Removed {removed} stale staging file(s).")
+
+            # Hard-linked duplicates are only probed and remuxed once
+            linked_groups, clashes = split_destination_clashes(group_hard_links(audio_files))
+            for file_path, owner in clashes:
+                error_message = f"Skipping {file_path}: it would be remuxed to the same file as {owner}"
+                print(error_message)
+                log_error_to_file(__file__, error_message)
+            if budget is not None:
+                priority = folder_priority(directory)
+                linked_groups.sort(key=lambda file_paths: priority(file_paths[0]))
+            if workers <= 1:
+                for file_paths in linked_groups:
+                    process_linked_files(file_paths, rewriter, journal, cache, budget=budget)
+                return
+
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                # Consume the iterator so that every job has finished before the summary is printed
+                list(executor.map(
+                    lambda file_paths: process_linked_files(file_paths, rewriter, journal, cache, budget=budget),
+                    linked_groups
+                ))
+        finally:
+            # Write whatever substitutions are still pending, even if the walk was interrupted
+            rewriter.flush()
+            # Drop cache entries for files that no longer exist in the library (only known after a full walk)
+            if paths is None and 'audio_files' in locals():
+                cache.evict_missing(directory, audio_files)
+            cache.close()
+            journal.close()
+
+class StreamingRemuxer:
+    """
+    Probes and remuxes files one at a time as sldl reports them downloaded, instead of waiting for the final pass.
+
+    Register on_completion_event as a completion daemon listener. Playlist and index rewrites are held back until
+    finish(), because sldl may still be writing those files while downloads are in progress. A final
+    remux_to_mp3_320 sweep should still be run afterwards to catch anything the stream missed.
+    """
+
+    def __init__(self, directory, workers=None, budget=None):
+        self.directory = directory
+        self.budget = budget
+        os.makedirs(directory, exist_ok=True)
+        self.journal = RemuxJournal.for_directory(directory)
+        self.rewriter = PlaylistRewriter(directory, on_flush=self.journal.finish)
+        self.cache = ProbeCache.for_directory(directory)
+        # Kept separate from file_summary so the final sweep's summary only describes the library as it ends up
+        self.summary = defaultdict(int)
+        self.executor = ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1, thread_name_prefix="remux")
+        self.queued = set()
+        # Destination -> the file being remuxed to it, so two downloads never write the same .mp3
+        self.destinations = {}
+        self.queued_lock = threading.Lock()
+
+    def submit(self, file_path):
+        """Queues a single file for probing and remuxing."""
+        file_path = os.path.abspath(file_path)
+        with self.queued_lock:
+            if file_path in self.queued:
+                return
+            destination_path = destination_of(file_path)
+            # An MP3 already at the destination wins, as in walk_directory
+            if destination_path != normalise_path(file_path) and os.path.exists(destination_path):
+                self.destinations.setdefault(destination_path, destination_path)
+            owner = self.destinations.setdefault(destination_path, file_path)
+            if owner == file_path:
+                self.queued.add(file_path)
+        if owner != file_path:
+            error_message = f"Skipping {file_path}: it would be remuxed to the same file as {owner}"
+            print(error_message)
+            log_error_to_file(__file__, error_message)
+            return
+        self.executor.submit(process_file, file_path, self.rewriter, self.journal, self.cache, self.summary,
+                             self.budget)
+
+    def on_completion_event(self, file_details):
+        if file_details.get('state') != 'Downloaded':
+            return
+        file_path = file_details.get('path', '')
+        if file_path.lower().endswith(AUDIO_EXTENSIONS) and os.path.isfile(file_path):
+            self.submit(file_path)
+
+    def finish(self, folders=None):
+        """
+        Waits for queued files to finish, then writes the deferred playlist and index updates.
+
+        Args:
+            folders (list): Only read the playlists in these folders when writing the updates, if given.
+        """
+        with stage("streaming_remux_finish", directory=self.directory) as timer:
+            timer.files = len(self.queued)
+            try:
+                self.executor.shutdown(wait=True)
+                self.rewriter.folders = folders
+                self.rewriter.flush()
+            finally:
+                self.cache.close()
+                self.journal.close()
+        print(f"Remuxed {len(self.queued)} file(s) while downloading.")
 
 def print_summary():
     print("\n--- Summary ---")
@@ -184,27 +433,63 @@ def print_summary():
         print(f"{key}: {count}")
     print("-" * 50)
     
-def remux_to_mp3_320(directory):
+def remux_to_mp3_320(directory, workers=None, paths=None, budget=None):
+    """
+    Remuxes the files in directory to 320kbps MP3.
+
+    Args:
+        directory (str): The library folder.
+        workers (int): Number of files remuxed at once. Defaults to the number of CPU cores.
+        paths (list): Only remux the files in these folders or files (e.g. from a run manifest), if given.
+        budget (RunBudget): Limits on the encoding and writing done; files that don't fit are left for a later run.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+
     if os.path.isdir(directory):
         try:
-            walk_directory(directory)
+            walk_directory(directory, workers, paths, budget)
             print_summary()
+            if budget is not None and budget.limited:
+                print(budget.describe())
         except Exception as e:
             error_message = f"Unhandled error during execution: {e}"
             print(error_message)
             log_error_to_file(__file__, error_message)
     else:
-        error_message = f"Invalid directory. Please check the path and try again."
+        error_message = "Invalid directory. Please check the path and try again."
         print(error_message)
         log_error_to_file(__file__, error_message)
 
 # Entry point
 if __name__ == '__main__':
-    # Check if the directory is passed as an argument
-    if len(sys.argv) > 1:
-        directory = sys.argv[1]
+    parser = argparse.ArgumentParser(description="Remux the audio files in a directory to 320kbps MP3.")
+    parser.add_argument("directory", nargs="?", default=None, help="Directory to process (prompted for if omitted).")
+    parser.add_argument("workers", nargs="?", type=int, default=None,
+                        help="Number of files remuxed at once (default: number of CPU cores).")
+    parser.add_argument("encoder", nargs="?", choices=[AUTO, *ENCODERS], default=None,
+                        help="Encoder backend (default: REMUX_ENCODER, or auto).")
+    parser.add_argument("--max-encode-minutes", type=float, default=None,
+                        help="Stop starting new encodes once this many minutes of audio have been processed.")
+    parser.add_argument("--max-bytes-written", type=parse_size, default=None, metavar="SIZE",
+                        help="Stop starting new encodes once this much (e.g. 500M or 2G) would have been written.")
+    parser.add_argument("--plan", action="store_true", help="Only report what would be done, without doing it.")
+    parser.add_argument("--output", default=None, help="With --plan, write the full plan to this JSON file.")
+    args = parser.parse_args()
+
+    # Prompt the user for the directory if it wasn't passed as an argument
+    directory = args.directory or input("Enter the directory to process: ").strip()
+    if args.encoder:
+        select_encoder(args.encoder)
+    budget = None
+    if args.max_encode_minutes is not None or args.max_bytes_written is not None:
+        budget = RunBudget(args.max_encode_minutes, args.max_bytes_written)
+
+    if args.plan:
+        from run_plan import plan_library, print_plan, write_plan
+        plan = plan_library(directory, budget=budget)
+        print_plan(plan)
+        if args.output:
+            write_plan(plan, args.output)
     else:
-        # Prompt the user for the directory
-        directory = input("Enter the directory to process: ").strip()
-        
-    remux_to_mp3_320(directory)
+        remux_to_mp3_320(directory, args.workers, budget=budget)
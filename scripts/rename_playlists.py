@@ -5,41 +5,68 @@ import os
 import logging
 import sys
 from log_error_to_file import log_error_to_file
+from run_metrics import stage
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 
+SLDL_PLAYLIST_NAME = '_playlist.m3u8'
+
+def rename_playlist_in_folder(root, files):
+    """
+    Renames root's _playlist.m3u8 to the name of root, replacing the folder's other .m3u8 files.
+
+    Args:
+        root (str): The playlist folder.
+        files (list): The names of the files in root.
+
+    Returns:
+        str: The new playlist path, or None if the folder has no _playlist.m3u8.
+    """
+    # Filter the .m3u8 files in the current directory
+    m3u8_files = [f for f in files if f.endswith('.m3u8')]
+    if SLDL_PLAYLIST_NAME not in m3u8_files:
+        return None
+
+    # Remove other .m3u8 files in the current directory (except _playlist.m3u8)
+    for f in m3u8_files:
+        if f != SLDL_PLAYLIST_NAME:
+            file_path = os.path.join(root, f)
+            os.remove(file_path)
+            logging.info(f"Deleted: {file_path}")
+
+    # Rename _playlist.m3u8 to the name of the parent directory
+    parent_dir = os.path.basename(os.path.normpath(root))
+    new_name = os.path.join(root, f"{parent_dir}.m3u8")
+    old_name = os.path.join(root, SLDL_PLAYLIST_NAME)
+    os.rename(old_name, new_name)
+    logging.info(f"Renamed: {old_name} -> {new_name}")
+    return new_name
+
 def process_m3u8_files(directory):
     try:
         # Walk through the directory recursively
         for root, dirs, files in os.walk(directory):
-            # Filter the .m3u8 files in the current directory
-            m3u8_files = [f for f in files if f.endswith('.m3u8')]
-
-            # If there is a _playlist.m3u8 file
-            if '_playlist.m3u8' in m3u8_files:
-                # Remove other .m3u8 files in the current directory (except _playlist.m3u8)
-                for f in m3u8_files:
-                    if f != '_playlist.m3u8':
-                        file_path = os.path.join(root, f)
-                        os.remove(file_path)
-                        logging.info(f"Deleted: {file_path}")
-
-                # Rename _playlist.m3u8 to the name of the parent directory
-                parent_dir = os.path.basename(root)
-                new_name = os.path.join(root, f"{parent_dir}.m3u8")
-                old_name = os.path.join(root, '_playlist.m3u8')
-                os.rename(old_name, new_name)
-                logging.info(f"Renamed: {old_name} -> {new_name}")
-    
+            rename_playlist_in_folder(root, files)
+
     except Exception as e:
         error_message = f"Exception occurred: {str(e)}"
         log_error_to_file(__file__, error_message)
         
-def rename_playlists(top_level_directory):
+def rename_playlists(top_level_directory, folders=None):
+    """
+    Renames the _playlist.m3u8 files under top_level_directory, or only those in folders (e.g. from a run manifest)
+    if given.
+    """
     if os.path.isdir(top_level_directory):
         try:
-            process_m3u8_files(top_level_directory)
+            with stage("rename_playlists", directory=top_level_directory, scoped=folders is not None):
+                if folders is None:
+                    process_m3u8_files(top_level_directory)
+                else:
+                    for folder in folders:
+                        if os.path.isdir(folder):
+                            rename_playlist_in_folder(folder, os.listdir(folder))
         except Exception as e:
             error_message = f"Unhandled error during execution: {e}"
             logging.error(error_message)
@@ -2,84 +2,102 @@
 # The script reads the CSV file containing the list of tracks that have failed to download through slsk-batchdl.
 # It prompts the user to select a replacement file for each entry.
 # It then copies the replacement file to the destination directory and updates any .m3u8 and .sldl files with the new file path.
+# With --archive, your own music folders are indexed (see archive_index.py) and every failed download is matched against
+# them first: confident matches are replaced automatically, and likely matches are suggested when the dialog opens.
+# Usage: python replace_failed_downloads.py [--archive DIR [DIR ...]] [--batch]
+#   --batch applies the confident matches and exits without opening any dialogs.
 
+import argparse
 import os
-import csv
 import shutil
+import time
 from tkinter import Tk, filedialog
 import pyperclip
 import random
+from failed_downloads_store import FailedDownloadStore
+from playlist_index import replace_failed_tracks
+from archive_index import ArchiveIndex, match_failed_downloads, AUTO, AMBIGUOUS
 
 # Constants
 destination_dir = "../tracks_and_playlists"
 replaced_files_dir = os.path.join(destination_dir, "_replaced_files")
 
-# Ensure the replaced_files directory exists
-os.makedirs(replaced_files_dir, exist_ok=True)
-
-# Suppress root Tk window
-Tk().withdraw()
-
-def select_replacement_file(artist, title):
-    """Open a file browser to select a replacement file."""
+def select_replacement_file(artist, title, suggestions=None):
+    """Open a file browser to select a replacement file, starting at the best suggestion if there is one."""
     pyperclip.copy(f"{artist} {title}")
     print(f"Copied to clipboard: {artist} {title}")
+    dialog_options = {}
+    if suggestions:
+        print("Possible matches in your archive:")
+        for suggestion in suggestions:
+            print(f"  {suggestion.path}")
+        dialog_options = {'initialdir': os.path.dirname(suggestions[0].path),
+                          'initialfile': os.path.basename(suggestions[0].path)}
     print(f"Opening file browser to select replacement for: {title}")
-    return filedialog.askopenfilename(title=f"Select Replacement for: {artist} - {title}")
-
-def process_m3u8_files(track_title, new_file_path):
-    """Search and replace the failed track entry in .m3u8 files."""
-    print(f"Searching for .m3u8 files to update track: {track_title}")
-    for root, _, files in os.walk(destination_dir):
-        for file in files:
-            if file.endswith(".m3u8"):
-                file_path = os.path.join(root, file)
-                # print(f"Checking file: {file_path}")
-                updated = False
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    lines = f.readlines()
-                with open(file_path, 'w', encoding='utf-8') as f:
-                    for line in lines:
-                        if track_title in line:
-                            print(f"Replacing line in {file_path}: {line.strip()} with {new_file_path}")
-                            f.write(new_file_path + "\n")
-                            updated = True
-                        else:
-                            f.write(line)
-                if not updated:
-                    # print(f"No matching line found for track: {track_title} in {file_path}")
-                    pass
-
-def process_sldl_files(track_title, new_file_path):
-    """Search and update the failed track entry in .sldl files."""
-    print(f"Searching for .sldl files to update track: {track_title}")
-    for root, _, files in os.walk(destination_dir):
-        for file in files:
-            if file.endswith(".sldl"):
-                file_path = os.path.join(root, file)
-                # print(f"Checking file: {file_path}")
-                try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        content = f.read()
-                except UnicodeDecodeError:
-                    print(f"Error reading file: {file_path}. Trying 'latin1' encoding.")
-                    with open(file_path, 'r', encoding='latin1') as f:
-                        content = f.read()
-
-                if track_title in content:
-                    print(f"Found entry for {track_title} in {file_path}")
-                    entries = content.split(';')
-                    updated_entries = []
-                    for entry in entries:
-                        if track_title in entry:
-                            print(f"Updating entry: {entry}")
-                            parts = entry.split(',')
-                            parts[-3:] = ['0', '3', '0']
-                            updated_entries.append(','.join(parts))
-                        else:
-                            updated_entries.append(entry)
-                    with open(file_path, 'w', encoding='utf-8') as f:
-                        f.write(';'.join(updated_entries))
+    return filedialog.askopenfilename(title=f"Select Replacement for: {artist} - {title}", **dialog_options)
+
+def process_replacement(track_title, new_file_path, track_artist=None):
+    """Points the failed track's .sldl entries, and the .m3u8 lines that refer to them, at the replacement file."""
+    print(f"Searching for .sldl and .m3u8 files to update track: {track_title}")
+    replace_failed_tracks(destination_dir, {(track_title, track_artist): new_file_path})
+
+def copy_replacement(replacement_file):
+    """Copies the replacement file to the replaced_files directory and returns its new path."""
+    os.makedirs(replaced_files_dir, exist_ok=True)
+    dest_path = os.path.abspath(shutil.copy(replacement_file, replaced_files_dir))
+    print(f"Copied to {dest_path}")
+    return dest_path
+
+def find_archive_matches(rows, archive_dirs=None):
+    """
+    Updates the archive index and matches the failed downloads against it.
+
+    Args:
+        rows (list): Failed download rows.
+        archive_dirs (list): Archive folders to index. Defaults to the folders indexed on earlier runs.
+
+    Returns:
+        dict: (title, artist) -> Match.
+    """
+    with ArchiveIndex() as index:
+        archive_dirs = archive_dirs or index.roots()
+        if not archive_dirs:
+            print("No archive folders to search; pass them with --archive.")
+            return {}
+        for archive_dir in archive_dirs:
+            print(f"Updating archive index for {archive_dir}...")
+            updated, removed = index.update(archive_dir)
+            print(f"  {updated} file(s) indexed, {removed} removed")
+        tracks = index.tracks()
+
+    start = time.perf_counter()
+    matches = match_failed_downloads(rows, tracks)
+    print(f"Matched {len(rows)} failed download(s) against {len(tracks)} archive file(s) "
+          f"in {time.perf_counter() - start:.1f}s")
+    return {(match.row[1], match.row[2]): match for match in matches}
+
+def apply_archive_matches(store, matches):
+    """
+    Copies in the matched archive files and updates the playlists for all of them in one pass. Rows with an empty
+    title are skipped, as in the interactive loop.
+
+    Returns:
+        list: The matches that were applied.
+    """
+    matches = [match for match in matches if match.row[1].strip()]
+    replacements = {}
+    for match in matches:
+        track_title, track_artist = match.row[1], match.row[2]
+        print(f"Matched {track_artist} - {track_title} -> {match.track.path} (score {match.score})")
+        replacements[(track_title, track_artist)] = copy_replacement(match.track.path)
+
+    replace_failed_tracks(destination_dir, replacements)
+
+    with store.write_transaction():
+        for match in matches:
+            store.remove(match.row[1], match.row[2])
+    store.export_csv()
+    return matches
 
 def get_processing_order():
     """Prompt the user to select the processing order."""
@@ -90,31 +108,53 @@ def get_processing_order():
     choice = input("Enter 1, 2, or 3: ")
     return choice
 
-def main():
-    print("Starting script...")
-    input_file = "../failed_downloads.csv"
-    if not input_file:
-        print("No input file selected. Exiting.")
-        return
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="Replace failed downloads with files you already have.")
+    parser.add_argument("--archive", nargs="+", default=None, metavar="DIR",
+                        help="Archive folders to search for replacements. Indexed folders are remembered between runs.")
+    parser.add_argument("--batch", action="store_true",
+                        help="Only apply confident archive matches, without opening any file dialogs.")
+    return parser.parse_args(argv)
 
+def main(argv=None):
+    args = parse_arguments(argv)
+    print("Starting script...")
+    store = FailedDownloadStore()
+    input_file = store.csv_path
     print(f"Selected input file: {input_file}")
 
-    with open(input_file, 'r', encoding='utf-8') as f:
-        reader = csv.reader(f)
-        rows = list(reader)
-
-    order_choice = get_processing_order()
-    if order_choice == '1':
-        rows_to_process = rows
-    elif order_choice == '2':
-        rows_to_process = reversed(rows)
-    elif order_choice == '3':
-        rows_to_process = random.sample(rows, len(rows))
-    else:
-        print("Invalid choice. Exiting.")
-        return
-
     try:
+        rows = store.rows()
+
+        matches = {}
+        if args.archive or args.batch:
+            matches = find_archive_matches(rows, args.archive)
+            confident = [match for match in matches.values() if match.status == AUTO]
+            if confident:
+                confident = apply_archive_matches(store, confident)
+            applied = {(match.row[1], match.row[2]) for match in confident}
+            rows = [row for row in rows if (row[1], row[2]) not in applied]
+            ambiguous = sum(1 for match in matches.values() if match.status == AMBIGUOUS)
+            print(f"Replaced {len(confident)} track(s) from the archive; "
+                  f"{ambiguous} possible match(es) need checking and {len(rows) - ambiguous} track(s) have no match.")
+
+        if args.batch:
+            return
+
+        # Suppress root Tk window
+        Tk().withdraw()
+
+        order_choice = get_processing_order()
+        if order_choice == '1':
+            rows_to_process = rows
+        elif order_choice == '2':
+            rows_to_process = reversed(rows)
+        elif order_choice == '3':
+            rows_to_process = random.sample(rows, len(rows))
+        else:
+            print("Invalid choice. Exiting.")
+            return
+
         for row in rows_to_process:
             track_title = row[1]
             track_artist = row[2]
@@ -123,7 +163,8 @@ def main():
                 continue
 
             print(f"Processing track: {track_title}")
-            replacement_file = select_replacement_file(track_artist, track_title)
+            match = matches.get((track_title, track_artist))
+            replacement_file = select_replacement_file(track_artist, track_title, match.candidates if match else None)
 
             if not replacement_file:
                 print(f"No file selected for {track_title}. Skipping.")
@@ -131,30 +172,22 @@ def main():
 
             print(f"Selected replacement file: {replacement_file}")
             # Copy the replacement file to the replaced_files directory
-            dest_path = os.path.abspath(shutil.copy(replacement_file, replaced_files_dir))
-            print(f"Copied to {dest_path}")
-
-            # Update .m3u8 files
-            process_m3u8_files(track_title, dest_path)
-
-            # Update .sldl files
-            process_sldl_files(track_title, dest_path)
+            dest_path = copy_replacement(replacement_file)
 
-            # Remove processed row from the list
-            rows.remove(row)
+            # Update the .sldl entries and the .m3u8 lines that refer to them
+            process_replacement(track_title, dest_path, track_artist)
 
-            # Update the input file after each row is processed
-            with open(input_file, 'w', encoding='utf-8', newline='') as f:
-                writer = csv.writer(f)
-                writer.writerows(rows)
+            # Remove processed row from the failed downloads and update the input file
+            store.remove(track_title, track_artist)
+            store.export_csv()
 
     except KeyboardInterrupt:
         print("\nProcess interrupted by user. Saving progress and exiting...")
         # Save the remaining rows to the input file
-        with open(input_file, 'w', encoding='utf-8', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerows(rows)
+        store.export_csv()
         print("Progress saved. Exiting.")
+    finally:
+        store.close()
 
 if __name__ == "__main__":
     main()
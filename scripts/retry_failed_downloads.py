@@ -0,0 +1,200 @@
+# Retries failed downloads automatically, without re-syncing the playlists they came from.
+# Pending entries in the failed downloads store are grouped by failure reason and by how long ago they were added, and
+# each group is written to one CSV and passed to a single sldl run, instead of re-running sldl on every playlist with a
+# missing track. The results are read back from the index sldl writes for the batch and applied through
+# process_completed_download.process_download (the same remove/append logic as the on-complete hook). The indexes and
+# playlists that listed a recovered track are pointed at the downloaded file with playlist_index.replace_failed_tracks,
+# as replace_failed_downloads.py does for manual imports.
+# Entries back off exponentially: an entry is first retried RETRY_BASE_HOURS after it failed (so a track whose peers
+# were offline during one night's run is retried on the next), and after its nth retry it waits
+# RETRY_BASE_HOURS * 2^n hours, up to MAX_RETRY_DAYS. Failures that a retry can't fix (INVALID_REASONS) are left alone.
+# Retried tracks are downloaded to ../tracks_and_playlists/_retried_downloads/<batch>.
+# Usage: python retry_failed_downloads.py [--dry-run] [--ignore-backoff]
+
+import argparse
+import csv
+import os
+import shlex
+import subprocess
+import time
+from collections import defaultdict
+from failed_downloads_store import FailedDownloadStore
+from log_error_to_file import log_error_to_file
+from playlist_index import replace_failed_tracks
+from process_completed_download import process_download
+from run_metrics import stage, timed
+from sldl_index import SldlIndex, STATE_ALREADY_EXISTS, STATE_DOWNLOADED, STATE_FAILED, STATE_NOT_FOUND_LAST_TIME
+
+# Command used to run sldl. Set SLDL_COMMAND to use a specific build, or a stand-in (see benchmark.py)
+SLDL_COMMAND = shlex.split(os.environ.get("SLDL_COMMAND", "sldl"))
+
+LIBRARY = '../tracks_and_playlists/'
+RETRY_DIR = os.path.join(LIBRARY, '_retried_downloads')
+BATCH_DIR = 'retry_batches'
+
+RETRY_BASE_HOURS = 12
+MAX_RETRY_DAYS = 30
+
+# Failure reasons that searching again won't fix
+INVALID_REASONS = {'InvalidSearchString'}
+
+# Extra sldl arguments per failure reason
+REASON_ARGUMENTS = {
+    # Nothing matched the search conditions last time, so search harder
+    'NoSuitableFileFound': ['--desperate'],
+}
+
+# (maximum age in days, label), newest first. Newer failures are the likeliest to recover, so they are retried first.
+AGE_GROUPS = [(1, 'last day'), (7, 'last week'), (30, 'last month'), (None, 'older')]
+
+# sldl's index states, as the on-complete hook reports them
+HOOK_STATES = {
+    STATE_DOWNLOADED: 'Downloaded',
+    STATE_FAILED: 'Failed',
+    STATE_ALREADY_EXISTS: 'Exists',
+    STATE_NOT_FOUND_LAST_TIME: 'NotFoundLastTime',
+}
+
+def retry_delay(attempts):
+    """Returns the seconds to wait after an entry's attempts-th retry before the next one."""
+    return min(RETRY_BASE_HOURS * 3600 * 2 ** attempts, MAX_RETRY_DAYS * 86400)
+
+def due_at(entry):
+    if entry['next_retry_at'] is not None:
+        return entry['next_retry_at']
+    return entry['added_at'] + RETRY_BASE_HOURS * 3600
+
+def age_group(entry, now):
+    age_days = (now - entry['added_at']) / 86400
+    for max_days, label in AGE_GROUPS:
+        if max_days is None or age_days < max_days:
+            return label
+
+def plan_batches(entries, now=None, ignore_backoff=False):
+    """
+    Groups the entries that are due for a retry.
+
+    Returns:
+        list: (failure reason, age group, entries) for each batch, newest age group first.
+    """
+    now = now or time.time()
+    groups = defaultdict(list)
+    for entry in entries:
+        if entry['failure_reason'] in INVALID_REASONS or not entry['title']:
+            continue
+        if not ignore_backoff and due_at(entry) > now:
+            continue
+        groups[(entry['failure_reason'] or 'Unknown', age_group(entry, now))].append(entry)
+    order = [label for _, label in AGE_GROUPS]
+    return [
+        (reason, age, groups[(reason, age)])
+        for reason, age in sorted(groups, key=lambda key: (order.index(key[1]), key[0]))
+    ]
+
+def batch_name(reason, age):
+    return f"{reason} ({age})"
+
+def write_batch_csv(csv_path, entries):
+    """Writes entries as an sldl CSV input, with the columns sldl recognises by name."""
+    with open(csv_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Artist', 'Title', 'Album', 'Length'])
+        for entry in entries:
+            writer.writerow([entry['artist'], entry['title'], entry['album'], entry['length']])
+
+def run_sldl(args):
+    subprocess.run([*SLDL_COMMAND, *args], check=True)
+
+def apply_results(batch_folder, entries, store):
+    """
+    Applies sldl's results for a batch to the store and returns {(title, artist): downloaded file} for the recovered
+    tracks.
+    """
+    index_path = os.path.join(batch_folder, '_index.sldl')
+    if not os.path.isfile(index_path):
+        return {}
+    index = SldlIndex.load(index_path)
+    recovered = {}
+    for entry in entries:
+        matches = index.find_by_title(entry['title'], entry['artist'])
+        if not matches or matches[-1].state not in HOOK_STATES:
+            continue
+        result = matches[-1]
+        file_path = index.resolve(result) or ''
+        state = HOOK_STATES[result.state]
+        process_download({
+            'path': file_path, 'title': entry['title'], 'artist': entry['artist'], 'album': entry['album'],
+            'uri': entry['uri'], 'length': entry['length'], 'failure-reason': entry['failure_reason'], 'state': state,
+        }, store)
+        if state in ('Downloaded', 'Exists') and file_path:
+            recovered[(entry['title'], entry['artist'])] = file_path
+    return recovered
+
+def retry_failed_downloads(run=None, dry_run=False, ignore_backoff=False):
+    """
+    Retries the failed downloads that are due, one sldl run per batch.
+
+    Args:
+        run (callable): Runs sldl with a list of arguments. Defaults to running SLDL_COMMAND; the playlist scheduler's
+            run_sldl can be passed to use one of its download slots.
+        dry_run (bool): Only print the batches.
+        ignore_backoff (bool): Retry every entry, even if it isn't due yet.
+
+    Returns:
+        tuple: (number of entries retried, number recovered)
+    """
+    run = run or run_sldl
+    retried = recovered_count = 0
+    with stage("retry_failed_downloads", dry_run=dry_run) as timer, FailedDownloadStore() as store:
+        now = time.time()
+        batches = plan_batches(store.retry_candidates(), now, ignore_backoff)
+        if not batches:
+            print("No failed downloads are due for a retry.")
+        for reason, age, entries in batches:
+            name = batch_name(reason, age)
+            print(f"Retrying {len(entries)} failed download(s): {name}")
+            if dry_run:
+                continue
+
+            os.makedirs(BATCH_DIR, exist_ok=True)
+            csv_path = os.path.join(BATCH_DIR, name + '.csv')
+            write_batch_csv(csv_path, entries)
+            # Counted before sldl runs, so an entry that crashes sldl still backs off
+            with store.write_transaction():
+                for entry in entries:
+                    store.record_retry(entry['title'], entry['artist'],
+                                       now + retry_delay(entry['retry_attempts'] + 1))
+            try:
+                with timed("retry_batch", stage="retry_failed_downloads", batch=name) as batch_timer:
+                    batch_timer.files = len(entries)
+                    run(["--path", RETRY_DIR, *REASON_ARGUMENTS.get(reason, []), csv_path])
+            except (OSError, subprocess.CalledProcessError) as e:
+                error_message = f"sldl failed on retry batch {name}: {e}"
+                print(error_message)
+                log_error_to_file(__file__, error_message)
+                continue
+            finally:
+                os.remove(csv_path)
+
+            # sldl names the batch's folder after the CSV
+            recovered = apply_results(os.path.join(RETRY_DIR, name), entries, store)
+            if recovered:
+                replace_failed_tracks(LIBRARY, recovered)
+            retried += len(entries)
+            recovered_count += len(recovered)
+            print(f"Recovered {len(recovered)} of {len(entries)}.")
+        if not dry_run:
+            store.export_csv()
+        timer.files = retried
+        timer.fields['recovered'] = recovered_count
+    return retried, recovered_count
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Retry failed downloads in batches, backing off between attempts.")
+    parser.add_argument("--dry-run", action="store_true", help="Only list the batches that would be retried.")
+    parser.add_argument("--ignore-backoff", action="store_true",
+                        help="Retry every failed download now, even if it isn't due yet.")
+    args = parser.parse_args()
+    retried, recovered = retry_failed_downloads(dry_run=args.dry_run, ignore_backoff=args.ignore_backoff)
+    if not args.dry_run:
+        print(f"Retried {retried} failed download(s); {recovered} recovered.")
@@ -0,0 +1,114 @@
+# Per-run limits on remux work, so a maintenance run fits in a fixed window on a shared host.
+# A budget caps the minutes of audio encoded (or decoded to measure loudness) and the bytes written. Before each file is
+# encoded, its cost is estimated from the probe data (duration, and 320kbps worth of output per second) and reserved;
+# a file that doesn't fit is deferred to a later run. Files are offered newest playlist folder first (by the folder's
+# modification time), so the playlists that were just synced are the ones made import-ready.
+# run_plan.py applies the same estimates and ordering to report what a run would do without doing it.
+
+import os
+import re
+import threading
+
+# Output bitrate of a remux, in bits per second
+OUTPUT_BITRATE = 320000
+
+# Bitrate assumed for files whose duration couldn't be read (uncompressed CD audio, so estimates err on the short side)
+FALLBACK_BITRATE = 1411200
+
+SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+def parse_size(text):
+    """Parses a byte count such as 500M, 2G or 1048576."""
+    match = re.fullmatch(r'\s*([\d.]+)\s*([KMGT]?)i?B?\s*', str(text), re.IGNORECASE)
+    if not match:
+        raise ValueError(f"Not a size: {text!r} (use e.g. 500M or 2G)")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
+
+def format_size(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(size) < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+def estimate_seconds(audio_info, size):
+    """Returns the duration of a file from its probe data, or an estimate from its size if that is missing."""
+    if audio_info and audio_info.get('duration'):
+        return audio_info['duration']
+    return size * 8 / FALLBACK_BITRATE
+
+def estimate_transcode(audio_info, size):
+    """Returns (minutes of audio to encode, bytes written) for remuxing a file."""
+    seconds = estimate_seconds(audio_info, size)
+    return seconds / 60, int(seconds * OUTPUT_BITRATE / 8)
+
+def folder_priority(directory):
+    """
+    Returns a sort key for paths inside directory: paths in the most recently modified top-level folder come first.
+    """
+    directory = os.path.abspath(directory)
+    mtimes = {}
+
+    def key(file_path):
+        relative = os.path.relpath(os.path.abspath(file_path), directory)
+        top = relative.split(os.sep, 1)[0]
+        if top not in mtimes:
+            try:
+                mtimes[top] = os.stat(os.path.join(directory, top)).st_mtime
+            except OSError:
+                mtimes[top] = 0
+        return -mtimes[top], file_path
+
+    return key
+
+class RunBudget:
+    """
+    Limits the minutes of audio encoded and the bytes written in one run. Safe to share between threads.
+
+    Args:
+        max_encode_minutes (float): Minutes of audio that may be encoded or measured. None for no limit.
+        max_bytes_written (int): Bytes that may be written. None for no limit.
+    """
+
+    def __init__(self, max_encode_minutes=None, max_bytes_written=None):
+        self.max_encode_minutes = max_encode_minutes
+        self.max_bytes_written = max_bytes_written
+        self.lock = threading.Lock()
+        self.encode_minutes = 0.0
+        self.bytes_written = 0
+        self.deferred = []
+
+    @property
+    def limited(self):
+        return self.max_encode_minutes is not None or self.max_bytes_written is not None
+
+    def reserve(self, file_path, minutes, bytes_written=0):
+        """
+        Takes a file's estimated cost out of the budget. Returns False, and records the file as deferred, if it
+        doesn't fit in what is left.
+        """
+        with self.lock:
+            over_minutes = (self.max_encode_minutes is not None
+                            and self.encode_minutes + minutes > self.max_encode_minutes)
+            over_bytes = (self.max_bytes_written is not None
+                          and self.bytes_written + bytes_written > self.max_bytes_written)
+            if over_minutes or over_bytes:
+                self.deferred.append(file_path)
+                return False
+            self.encode_minutes += minutes
+            self.bytes_written += bytes_written
+            return True
+
+    def summary(self):
+        return {
+            'encode_minutes': round(self.encode_minutes, 2),
+            'bytes_written': self.bytes_written,
+            'deferred': len(self.deferred),
+        }
+
+    def describe(self):
+        """Returns a one-line description of what was spent, for the end of a run."""
+        text = f"Budget used: {self.encode_minutes:.1f} min encoded, {format_size(self.bytes_written)} written"
+        if self.deferred:
+            text += f"; {len(self.deferred)} file(s) deferred to a later run"
+        return text + "."
@@ -0,0 +1,137 @@
+# Records which playlist folders and files a run of download_and_process_playlists.py created or changed, so that
+# renaming, remuxing and playlist rewriting only have to look at those instead of walking the whole library.
+# Changes come from two places: sldl's completion events (each downloaded file and its folder), and a comparison of the
+# library's playlist folders before and after the downloads, which catches folders sldl wrote to without reporting a
+# download (e.g. a new _playlist.m3u8). Only the top-level folders and their sldl playlist and index files are looked
+# at, so taking the snapshot costs a few stats per playlist rather than one per track.
+# The manifest is kept in ../run_manifest.json while the run goes on and is only deleted once post-processing has
+# finished, so the changes of an interrupted run are picked up by the next one.
+
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+MANIFEST_PATH = '../run_manifest.json'
+
+# Files whose modification time shows that sldl has written to a playlist folder
+SLDL_FILE_NAMES = ('_index.sldl', '_playlist.m3u8')
+
+# Minimum time between saves while completion events are coming in
+SAVE_INTERVAL = 5
+
+def folder_snapshot(library):
+    """Returns {playlist folder: (folder mtime, sldl file mtimes)} for the top-level folders of the library."""
+    snapshot = {}
+    try:
+        entries = list(os.scandir(library))
+    except OSError:
+        return snapshot
+    for entry in entries:
+        try:
+            if not entry.is_dir(follow_symlinks=False):
+                continue
+            signature = [entry.stat().st_mtime_ns]
+        except OSError:
+            continue
+        for file_name in SLDL_FILE_NAMES:
+            try:
+                signature.append(os.stat(os.path.join(entry.path, file_name)).st_mtime_ns)
+            except OSError:
+                signature.append(None)
+        snapshot[os.path.abspath(entry.path)] = tuple(signature)
+    return snapshot
+
+class RunManifest:
+    """
+    The folders and files changed by the current run (and by earlier runs whose post-processing didn't finish).
+
+    Register on_completion_event as a completion daemon listener, call collect_folder_changes() once the downloads
+    have finished, and clear() once post-processing is done.
+    """
+
+    def __init__(self, library, path=MANIFEST_PATH):
+        self.library = os.path.abspath(library)
+        self.path = path
+        self.lock = threading.Lock()
+        self.folders = set()
+        self.files = set()
+        self.started_at = datetime.now().isoformat(timespec='seconds')
+        self.last_saved = 0
+        self.load()
+        self.snapshot = folder_snapshot(self.library)
+
+    def load(self):
+        """Picks up the changes left by a run whose post-processing didn't finish."""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                previous = json.load(f)
+        except (OSError, ValueError):
+            return
+        if previous.get('library') != self.library:
+            return
+        self.folders.update(previous.get('folders', []))
+        self.files.update(previous.get('files', []))
+        if self.folders or self.files:
+            print(f"Including {len(self.folders)} folder(s) changed by an earlier unfinished run "
+                  f"(started {previous.get('started_at')}).")
+
+    def add_file(self, file_path):
+        file_path = os.path.abspath(file_path)
+        with self.lock:
+            self.files.add(file_path)
+            self.folders.add(os.path.dirname(file_path))
+
+    def add_folder(self, folder):
+        with self.lock:
+            self.folders.add(os.path.abspath(folder))
+
+    def on_completion_event(self, file_details):
+        file_path = file_details.get('path', '')
+        if file_path and os.path.isfile(file_path):
+            self.add_file(file_path)
+            if time.monotonic() - self.last_saved >= SAVE_INTERVAL:
+                self.save()
+
+    def collect_folder_changes(self):
+        """Adds the playlist folders that were created or written to since the manifest was created."""
+        for folder, signature in folder_snapshot(self.library).items():
+            if self.snapshot.get(folder) != signature:
+                self.add_folder(folder)
+        self.save()
+
+    def sorted_folders(self):
+        """Returns the changed folders that still exist, without folders that are inside another changed folder."""
+        with self.lock:
+            folders = sorted(folder for folder in self.folders if os.path.isdir(folder))
+        outermost = []
+        for folder in folders:
+            if not outermost or not folder.startswith(os.path.join(outermost[-1], '')):
+                outermost.append(folder)
+        return outermost
+
+    def save(self):
+        with self.lock:
+            manifest = {
+                'library': self.library,
+                'started_at': self.started_at,
+                'folders': sorted(self.folders),
+                'files': sorted(self.files),
+            }
+            self.last_saved = time.monotonic()
+            # Written to a temporary file first so an interrupted save never leaves a truncated manifest
+            temporary_path = self.path + '.tmp'
+            with open(temporary_path, 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, indent=2)
+            os.replace(temporary_path, self.path)
+
+    def clear(self):
+        """Deletes the saved manifest once its changes have been post-processed."""
+        with self.lock:
+            self.folders.clear()
+            self.files.clear()
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,156 @@
+# Records structured timing events for a run as JSON lines in scripts/metrics/YYYY-MM-DD_metrics.jsonl (next to
+# error_logs), whatever the working directory.
+# Each line is one event: a stage (e.g. "remux", "rename_playlists"), a playlist, or a single file, with its duration
+# and, where known, the number of files and bytes processed and the resulting throughput. Every event carries the
+# run's id, so the events of one nightly run (including the sldl completion hooks it spawns) can be grouped together.
+#
+# Profiling is opt-in per stage: set PROFILE_STAGES to a comma-separated list of stage names (or "all"), or pass
+# --profile-stage to download_and_process_playlists.py. A profiled stage is run under cProfile and tracemalloc, and
+# the results are written to metrics/profiles/. cProfile only sees the thread that runs the stage, so the work of
+# worker threads shows up as time spent waiting on them; tracemalloc covers every thread.
+# Set RUN_METRICS=0 to turn event recording off.
+
+import cProfile
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+METRICS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "metrics")
+PROFILES_DIR = os.path.join(METRICS_DIR, "profiles")
+
+# Number of allocation sites listed in a stage's tracemalloc report
+TRACEMALLOC_TOP = 25
+
+ENABLED = os.environ.get("RUN_METRICS", "1") != "0"
+
+# Shared with the processes this one starts, so that their events belong to the same run
+RUN_ID = os.environ.setdefault("RUN_ID", f"{datetime.now().strftime('%Y%m%dT%H%M%S')}-{os.getpid()}")
+
+write_lock = threading.Lock()
+profile_lock = threading.Lock()
+
+def profiled_stages():
+    return {name.strip() for name in os.environ.get("PROFILE_STAGES", "").split(",") if name.strip()}
+
+def enable_profiling(stage_names):
+    """Profiles the given stages in this process and the processes it starts."""
+    os.environ["PROFILE_STAGES"] = ",".join(sorted(profiled_stages() | set(stage_names)))
+
+def emit(event, **fields):
+    """Appends one event to today's metrics file."""
+    if not ENABLED:
+        return
+    record = {
+        "time": datetime.now().isoformat(timespec="milliseconds"),
+        "run_id": RUN_ID,
+        "pid": os.getpid(),
+        "event": event,
+        **fields,
+    }
+    line = json.dumps(record, default=str) + "\n"
+    try:
+        with write_lock:
+            os.makedirs(METRICS_DIR, exist_ok=True)
+            with open(os.path.join(METRICS_DIR, f"{datetime.now().strftime('%Y-%m-%d')}_metrics.jsonl"), "a",
+                      encoding="utf-8") as file:
+                file.write(line)
+    except OSError:
+        # Metrics must never stop a run
+        pass
+
+def throughput(count, seconds):
+    return round(count / seconds, 3) if count and seconds > 0 else None
+
+class Timer:
+    """
+    Measures a block of work. Set `files` and `bytes` (or add to them) inside the block, and update `fields` with
+    anything else, to have them recorded with the duration.
+    """
+
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+        self.fields = {}
+        self.start = time.perf_counter()
+        self.seconds = None
+
+    def stop(self):
+        self.seconds = time.perf_counter() - self.start
+        return self.seconds
+
+    def summary(self):
+        summary = {"seconds": round(self.seconds, 4)}
+        if self.files:
+            summary.update(files=self.files, files_per_second=throughput(self.files, self.seconds))
+        if self.bytes:
+            summary.update(bytes=self.bytes, bytes_per_second=throughput(self.bytes, self.seconds))
+        summary.update(self.fields)
+        return summary
+
+@contextmanager
+def timed(event, **fields):
+    """Times the block and records it as an event, along with whether it raised."""
+    timer = Timer()
+    status = "ok"
+    try:
+        yield timer
+    except BaseException as e:
+        status = type(e).__name__
+        raise
+    finally:
+        timer.stop()
+        emit(event, status=status, **fields, **timer.summary())
+
+@contextmanager
+def stage(name, **fields):
+    """
+    Times a stage of the run, profiling it if it was selected in PROFILE_STAGES.
+
+    Example:
+        with stage("remux", directory=directory) as timer:
+            timer.files = convert_everything()
+    """
+    selected = profiled_stages()
+    if (name in selected or "all" in selected) and profile_lock.acquire(blocking=False):
+        # Only one stage is profiled at a time: cProfile and tracemalloc are process-wide
+        try:
+            with timed("stage", stage=name, **fields) as timer, profile(name) as profile_fields:
+                # Filled in when profiling stops, before the stage's event is recorded
+                timer.fields = profile_fields
+                yield timer
+        finally:
+            profile_lock.release()
+    else:
+        with timed("stage", stage=name, **fields) as timer:
+            yield timer
+
+@contextmanager
+def profile(name):
+    """Runs the block under cProfile and tracemalloc and writes both reports to PROFILES_DIR."""
+    os.makedirs(PROFILES_DIR, exist_ok=True)
+    prefix = os.path.join(PROFILES_DIR, f"{RUN_ID}_{name}")
+    profile_fields = {}
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profile_fields
+    finally:
+        profiler.disable()
+        profiler.dump_stats(prefix + ".prof")
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        if started_tracing:
+            tracemalloc.stop()
+        with open(prefix + "_memory.txt", "w", encoding="utf-8") as file:
+            file.write(f"Peak traced memory: {peak} bytes\n\n")
+            for statistic in snapshot.statistics("lineno")[:TRACEMALLOC_TOP]:
+                file.write(f"{statistic}\n")
+        profile_fields.update(profile=prefix + ".prof", memory_report=prefix + "_memory.txt", peak_memory_bytes=peak)
+        print(f"Profile for {name} written to {prefix}.prof (open it with `python -m pstats`)")
@@ -0,0 +1,205 @@
+# Works out what a remux pass over the library would do, without doing it.
+# The library is walked and probed the same way remux_to_mp3_320.py does it (probe results come from the library's
+# .probe_cache.sqlite where they are still valid), and the plan lists:
+#   * transcodes: every file that would be remuxed, with the bytes read and written and the minutes of audio encoded,
+#     and the hard links that would be re-pointed at the result instead of being remuxed again
+#   * loudness measurements: 320kbps MP3s whose loudness isn't cached yet (see loudness.py)
+#   * renames: the _playlist.m3u8 files that would be renamed after their folder
+#   * playlist rewrites: the .m3u8 playlists and .sldl indexes that would be updated to point at the remuxed files
+#   * destination clashes: files that would be skipped because another file is remuxed to the same .mp3
+# Work is listed in the order a budgeted run takes it (newest playlist folder first); with a budget (see run_budget.py)
+# the items that wouldn't fit are marked as deferred.
+# Usage: python run_plan.py [<directory>] [--max-encode-minutes M] [--max-bytes-written SIZE] [--output plan.json]
+
+import argparse
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import loudness
+from playlist_index import build_index, normalise_path
+from probe_cache import ProbeCache
+from remux_to_mp3_320 import (find_audio_files, find_audio_files_in, get_audio_info, group_hard_links,
+                              split_destination_clashes)
+from rename_playlists import SLDL_PLAYLIST_NAME
+from run_budget import RunBudget, estimate_seconds, estimate_transcode, folder_priority, format_size, parse_size
+from run_metrics import stage
+
+# Probing waits on the disk rather than the CPU, so more threads than cores pay off
+DEFAULT_WORKERS = 16
+
+def plan_renames(directory, folders=None):
+    """Returns the playlist renames rename_playlists.py would make, as {'from', 'to', 'deleted'} dictionaries."""
+    renames = []
+    walk = os.walk(directory) if folders is None else (
+        (folder, None, os.listdir(folder)) for folder in folders if os.path.isdir(folder)
+    )
+    for root, _, files in walk:
+        if SLDL_PLAYLIST_NAME not in files:
+            continue
+        renames.append({
+            'from': os.path.join(root, SLDL_PLAYLIST_NAME),
+            'to': os.path.join(root, f"{os.path.basename(os.path.normpath(root))}.m3u8"),
+            'deleted': sorted(os.path.join(root, f) for f in files if f.endswith('.m3u8') and f != SLDL_PLAYLIST_NAME),
+        })
+    return renames
+
+def plan_file(file_paths, cache):
+    """Probes the first of a group of hard links and returns (stat, probe data), or (None, None) if it can't be read."""
+    try:
+        return os.stat(file_paths[0]), get_audio_info(file_paths[0], cache)
+    except OSError:
+        return None, None
+
+def plan_library(directory, paths=None, budget=None, workers=DEFAULT_WORKERS):
+    """
+    Plans a remux pass over directory, or over only the folders and files in paths if given.
+
+    Args:
+        budget (RunBudget): Limits to apply. Only its limits are used; what it has spent is left untouched.
+
+    Returns:
+        dict: The plan; see the module comment.
+    """
+    budget = RunBudget(budget.max_encode_minutes, budget.max_bytes_written) if budget else RunBudget()
+    folders = None if paths is None else [path if os.path.isdir(path) else os.path.dirname(path) for path in paths]
+    transcodes = []
+    measurements = []
+    unreadable = []
+
+    with stage("plan", directory=directory, scoped=paths is not None) as timer:
+        audio_files = list(find_audio_files(directory)) if paths is None else find_audio_files_in(paths)
+        linked_groups, clashes = split_destination_clashes(group_hard_links(audio_files))
+        priority = folder_priority(directory)
+        linked_groups.sort(key=lambda file_paths: priority(file_paths[0]))
+        timer.files = len(audio_files)
+
+        cache = ProbeCache.for_directory(directory)
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                probes = list(executor.map(lambda file_paths: plan_file(file_paths, cache), linked_groups))
+
+            for file_paths, (stat, audio_info) in zip(linked_groups, probes):
+                if audio_info is None:
+                    unreadable.extend(file_paths)
+                    continue
+                if audio_info['format'] != 'audio/mp3' or audio_info['bitrate'] != '320kbps':
+                    minutes, bytes_written = estimate_transcode(audio_info, stat.st_size)
+                    transcodes.append({
+                        'path': file_paths[0],
+                        'destination': os.path.splitext(file_paths[0])[0] + '.mp3',
+                        'format': audio_info['format'],
+                        'bitrate': audio_info['bitrate'],
+                        'encode_minutes': round(minutes, 2),
+                        'bytes_read': stat.st_size,
+                        'bytes_written': bytes_written,
+                        'links': file_paths[1:],
+                        'deferred': not budget.reserve(file_paths[0], minutes, bytes_written),
+                    })
+                elif loudness.enabled and cache.get_loudness(stat) is None:
+                    minutes = estimate_seconds(audio_info, stat.st_size) / 60
+                    measurements.append({
+                        'path': file_paths[0],
+                        'encode_minutes': round(minutes, 2),
+                        'bytes_read': stat.st_size,
+                        'deferred': not budget.reserve(file_paths[0], minutes),
+                    })
+        finally:
+            cache.close()
+
+        renames = plan_renames(directory, folders)
+        rewrites = plan_rewrites(directory, folders, transcodes, renames)
+
+    return {
+        'directory': os.path.abspath(directory),
+        'generated_at': datetime.now().isoformat(timespec='seconds'),
+        'budget': {'max_encode_minutes': budget.max_encode_minutes, 'max_bytes_written': budget.max_bytes_written},
+        'totals': plan_totals(transcodes, measurements, renames, rewrites),
+        'transcodes': transcodes,
+        'loudness_measurements': measurements,
+        'renames': renames,
+        'playlist_rewrites': rewrites,
+        'unreadable': unreadable,
+        'destination_clashes': [{'path': path, 'kept': owner} for path, owner in clashes],
+    }
+
+def plan_rewrites(directory, folders, transcodes, renames):
+    """
+    Returns {playlist or index file: number of its references that would change} for the transcodes that aren't
+    deferred. Playlists are listed under the names they will have after the renames.
+    """
+    renamed = {normalise_path(rename['from']): rename['to'] for rename in renames}
+    deleted = {normalise_path(path) for rename in renames for path in rename['deleted']}
+    index = build_index(directory, folders)
+    rewrites = {}
+    for transcode in transcodes:
+        if transcode['deferred']:
+            continue
+        for file_path in [transcode['path'], *transcode['links']]:
+            if normalise_path(file_path) == normalise_path(os.path.splitext(file_path)[0] + '.mp3'):
+                # Re-encoded in place: the references don't change
+                continue
+            for playlist_path in index.get(normalise_path(file_path), ()):
+                if normalise_path(playlist_path) in deleted:
+                    continue
+                playlist_path = renamed.get(normalise_path(playlist_path), playlist_path)
+                rewrites[playlist_path] = rewrites.get(playlist_path, 0) + 1
+    return dict(sorted(rewrites.items()))
+
+def plan_totals(transcodes, measurements, renames, rewrites):
+    planned = [transcode for transcode in transcodes if not transcode['deferred']]
+    planned_measurements = [measurement for measurement in measurements if not measurement['deferred']]
+    return {
+        'transcodes': len(planned),
+        'links': sum(len(transcode['links']) for transcode in planned),
+        'loudness_measurements': len(planned_measurements),
+        'deferred': len(transcodes) - len(planned) + len(measurements) - len(planned_measurements),
+        'encode_minutes': round(sum(item['encode_minutes'] for item in planned + planned_measurements), 2),
+        'bytes_read': sum(item['bytes_read'] for item in planned + planned_measurements),
+        'bytes_written': sum(transcode['bytes_written'] for transcode in planned),
+        'renames': len(renames),
+        'playlist_rewrites': len(rewrites),
+    }
+
+def print_plan(plan):
+    totals = plan['totals']
+    print("\n--- Plan ---")
+    print(f"Transcodes: {totals['transcodes']} ({totals['links']} hard link(s) re-pointed at the results)")
+    print(f"Loudness measurements: {totals['loudness_measurements']}")
+    print(f"Audio to encode or measure: {totals['encode_minutes']:.1f} min")
+    print(f"Estimated reads: {format_size(totals['bytes_read'])}, writes: {format_size(totals['bytes_written'])}")
+    print(f"Playlist renames: {totals['renames']}, playlist and index rewrites: {totals['playlist_rewrites']}")
+    if totals['deferred']:
+        print(f"Deferred by the budget: {totals['deferred']} file(s)")
+    if plan['unreadable']:
+        print(f"Unreadable files (skipped): {len(plan['unreadable'])}")
+    if plan['destination_clashes']:
+        print(f"Files remuxed to the same name as another (skipped): {len(plan['destination_clashes'])}")
+    print("-" * 50)
+
+def write_plan(plan, output_path):
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(plan, f, indent=2)
+    print(f"Plan written to {output_path}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Report what a remux pass over the library would do.")
+    parser.add_argument("directory", nargs="?", default="../tracks_and_playlists/",
+                        help="Library directory (default ../tracks_and_playlists/).")
+    parser.add_argument("--max-encode-minutes", type=float, default=None,
+                        help="Mark the files beyond this many minutes of audio as deferred.")
+    parser.add_argument("--max-bytes-written", type=parse_size, default=None, metavar="SIZE",
+                        help="Mark the files beyond this much (e.g. 500M or 2G) written as deferred.")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help=f"Number of files probed at once (default {DEFAULT_WORKERS}).")
+    parser.add_argument("--output", default=None, help="Write the full plan to this JSON file.")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.directory):
+        print(f"The provided path is not a valid directory: {args.directory}")
+    else:
+        plan = plan_library(args.directory, budget=RunBudget(args.max_encode_minutes, args.max_bytes_written),
+                            workers=max(1, args.workers))
+        print_plan(plan)
+        if args.output:
+            write_plan(plan, args.output)
@@ -0,0 +1,158 @@
+# Reads and writes sldl's .sldl index files.
+# An index is "#SLDL:" followed by ';'-terminated entries of eight comma-separated fields:
+#   path,artist,album,title,length,tracktype,state,failurereason
+# Fields containing a comma, semicolon or quote are wrapped in double quotes, with quotes doubled.
+# Entries are parsed into SldlEntry objects that can be looked up by track path or by exact title. Only entries that were
+# changed are re-serialised, so an index is written back byte-for-byte unchanged apart from the edits, and save()
+# leaves files whose content did not change untouched.
+
+import os
+
+SLDL_PREFIX = '#SLDL:'
+
+FIELDS = ['path', 'artist', 'album', 'title', 'length', 'tracktype', 'state', 'failure_reason']
+
+# sldl's track states, as written in the state field
+STATE_INITIAL = '0'
+STATE_DOWNLOADED = '1'
+STATE_FAILED = '2'
+STATE_ALREADY_EXISTS = '3'
+STATE_NOT_FOUND_LAST_TIME = '4'
+
+def split_fields(text, separator):
+    """Splits text on separator, ignoring separators inside double-quoted fields. Quotes are kept."""
+    parts = []
+    current = []
+    quoted = False
+    for character in text:
+        if character == '"':
+            quoted = not quoted
+        elif character == separator and not quoted:
+            parts.append(''.join(current))
+            current = []
+            continue
+        current.append(character)
+    parts.append(''.join(current))
+    return parts
+
+def unquote(field):
+    if len(field) >= 2 and field.startswith('"') and field.endswith('"'):
+        return field[1:-1].replace('""', '"')
+    return field
+
+def quote(value):
+    value = '' if value is None else str(value)
+    if any(character in value for character in ',;"'):
+        return '"' + value.replace('"', '""') + '"'
+    return value
+
+def normalise_title(text):
+    return ' '.join((text or '').split()).casefold()
+
+class SldlEntry:
+    """One track in an index. Read fields as attributes; change them with set()."""
+
+    def __init__(self, raw):
+        self.raw = raw
+        fields = [unquote(field) for field in split_fields(raw, ',')]
+        self.fields = fields + [''] * (len(FIELDS) - len(fields))
+        self.changed = False
+
+    def __getattr__(self, name):
+        if name in FIELDS:
+            return self.fields[FIELDS.index(name)]
+        raise AttributeError(name)
+
+    def set(self, **values):
+        for name, value in values.items():
+            index = FIELDS.index(name)
+            value = '' if value is None else str(value)
+            if self.fields[index] != value:
+                self.fields[index] = value
+                self.changed = True
+
+    def serialise(self):
+        if not self.changed:
+            return self.raw
+        return ','.join(quote(field) for field in self.fields)
+
+class SldlIndex:
+    """
+    An .sldl index loaded into memory, with its entries looked up by exact title or by the file they refer to.
+
+    The lookups reflect the index as it was loaded: edit paths and titles through set(), then save().
+    """
+
+    def __init__(self, file_path, text):
+        self.file_path = file_path
+        self.directory = os.path.dirname(file_path)
+        self.text = text
+        self.prefix = SLDL_PREFIX if text.startswith(SLDL_PREFIX) else ''
+        body = text[len(self.prefix):]
+        self.trailing_separator = body.endswith(';')
+        if self.trailing_separator:
+            body = body[:-1]
+        self.entries = [SldlEntry(raw) for raw in split_fields(body, ';')] if body.strip() else []
+        # Lookups are built once, so applying a large batch of edits costs one dictionary lookup per edit
+        self.by_title = {}
+        self.by_path = {}
+        for entry in self.entries:
+            self.by_title.setdefault(normalise_title(entry.title), []).append(entry)
+            resolved = self.resolve(entry)
+            if resolved:
+                self.by_path.setdefault(os.path.normcase(resolved), []).append(entry)
+
+    @classmethod
+    def load(cls, file_path):
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                return cls(file_path, f.read())
+        except UnicodeDecodeError:
+            with open(file_path, 'r', encoding='latin1') as f:
+                return cls(file_path, f.read())
+
+    def resolve(self, entry):
+        """Returns the absolute path an entry refers to, or None if it has no file."""
+        if not entry.path.strip():
+            return None
+        return os.path.normpath(os.path.abspath(os.path.join(self.directory, entry.path.strip())))
+
+    def find_by_title(self, title, artist=None):
+        """Returns the entries whose title (and artist, if given) match exactly, ignoring case and spacing."""
+        artist = normalise_title(artist) if artist else None
+        return [
+            entry for entry in self.by_title.get(normalise_title(title), [])
+            if artist is None or normalise_title(entry.artist) == artist
+        ]
+
+    def find_by_path(self, file_path):
+        """Returns the entries that refer to file_path."""
+        return self.by_path.get(os.path.normcase(os.path.normpath(os.path.abspath(file_path))), [])
+
+    def relative_path(self, file_path):
+        """Returns file_path in the form sldl writes it: relative to the index's folder where possible."""
+        try:
+            return os.path.relpath(file_path, self.directory)
+        except ValueError:
+            # On another drive
+            return os.path.abspath(file_path)
+
+    def serialise(self):
+        body = ';'.join(entry.serialise() for entry in self.entries)
+        return self.prefix + body + (';' if self.trailing_separator else '')
+
+    def save(self):
+        """Writes the index back if any entry changed. Returns True if the file was written."""
+        text = self.serialise()
+        if text == self.text:
+            return False
+        with open(self.file_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        self.text = text
+        return True
+
+def find_sldl_files(directory):
+    for root, _, files in os.walk(directory):
+        for file in files:
+            if file.lower().endswith('.sldl'):
+                yield os.path.join(root, file)
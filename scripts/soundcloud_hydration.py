@@ -0,0 +1,120 @@
+# Extracts a SoundCloud playlist's tracks from the structured data embedded in the playlist page.
+# SoundCloud server-renders a `window.__sc_hydration` JSON blob containing the playlist and a public API client id.
+# Only the first few tracks are included in full; the rest are ID stubs, which are resolved through the tracks API in
+# batches. This avoids a browser, scrolling and HTML parsing entirely, and returns the complete track list for long
+# sets that lazy-loading DOM scrolls can truncate.
+# Both the page URL and the API base URL can point at a local stand-in server serving saved HTML/JSON fixtures:
+# set SOUNDCLOUD_API_BASE (e.g. http://127.0.0.1:8000/api) and pass the local page URL.
+# tests/test_soundcloud_hydration.py does this with the fixtures in tests/fixtures/soundcloud.
+
+import json
+import logging
+import os
+import re
+import requests
+
+SOUNDCLOUD_API_BASE = os.environ.get("SOUNDCLOUD_API_BASE", "https://api-v2.soundcloud.com")
+
+# The tracks endpoint accepts at most 50 ids per request
+TRACK_BATCH_SIZE = 50
+REQUEST_TIMEOUT = 30
+
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
+                  "Chrome/131.0 Safari/537.36",
+}
+
+HYDRATION_PATTERN = re.compile(r"window\.__sc_hydration\s*=\s*(\[.*?\])\s*;\s*</script>", re.DOTALL)
+
+class HydrationError(Exception):
+    """Raised when a page does not contain usable hydration data."""
+
+def parse_hydration(html):
+    """Returns the list of hydratable entries embedded in a SoundCloud page."""
+    match = HYDRATION_PATTERN.search(html)
+    if not match:
+        raise HydrationError("No __sc_hydration data found in page")
+    try:
+        return json.loads(match.group(1))
+    except ValueError as e:
+        raise HydrationError(f"Malformed __sc_hydration data: {e}") from e
+
+def find_hydratable(hydration, name):
+    for entry in hydration:
+        if entry.get("hydratable") == name:
+            return entry.get("data")
+    return None
+
+def is_complete_track(track):
+    return bool(track.get("title")) and bool((track.get("user") or {}).get("username"))
+
+def fetch_tracks_by_id(session, track_ids, client_id, api_base=SOUNDCLOUD_API_BASE):
+    """
+    Resolves track IDs to full track objects in batches.
+
+    Returns:
+        dict: track id -> track object, for every track the API returned.
+    """
+    tracks = {}
+    for start in range(0, len(track_ids), TRACK_BATCH_SIZE):
+        batch = track_ids[start:start + TRACK_BATCH_SIZE]
+        response = session.get(
+            f"{api_base}/tracks",
+            params={"ids": ",".join(str(track_id) for track_id in batch), "client_id": client_id},
+            headers=HEADERS,
+            timeout=REQUEST_TIMEOUT,
+        )
+        response.raise_for_status()
+        for track in response.json():
+            tracks[track["id"]] = track
+    return tracks
+
+def extract_playlist_tracks(url, session=None, api_base=SOUNDCLOUD_API_BASE):
+    """
+    Returns the playlist's tracks as [artist, track] rows, in playlist order.
+
+    Args:
+        url (str): The URL of the SoundCloud playlist page.
+        session (requests.Session): Optional session to reuse connections across playlists.
+        api_base (str): Base URL of the SoundCloud API.
+
+    Raises:
+        HydrationError: If the page has no usable playlist data.
+        requests.RequestException: If the page or the tracks API cannot be fetched.
+    """
+    session = session or requests.Session()
+    logging.info(f"Fetching playlist page: {url}")
+    response = session.get(url, headers=HEADERS, timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+
+    hydration = parse_hydration(response.text)
+    playlist = find_hydratable(hydration, "playlist")
+    if not playlist or "tracks" not in playlist:
+        raise HydrationError("Page has no playlist hydration data")
+
+    tracks = playlist["tracks"]
+    stub_ids = [track["id"] for track in tracks if not is_complete_track(track)]
+    if stub_ids:
+        api_client = find_hydratable(hydration, "apiClient") or {}
+        client_id = api_client.get("id")
+        if not client_id:
+            raise HydrationError("Page has no API client id to resolve track stubs with")
+        logging.debug(f"Resolving {len(stub_ids)} track stubs in batches of {TRACK_BATCH_SIZE}.")
+        resolved = fetch_tracks_by_id(session, stub_ids, client_id, api_base)
+        tracks = [track if is_complete_track(track) else resolved.get(track["id"], track) for track in tracks]
+
+    data = []
+    for track in tracks:
+        if not is_complete_track(track):
+            # Removed or region-blocked tracks are dropped, the same as the DOM path does
+            logging.warning(f"Could not resolve track {track.get('id')}; skipping it.")
+            continue
+        artist = track["user"]["username"].strip()
+        title = track["title"].strip()
+        logging.debug(f"Found track: Artist = {artist}, Track = {title}")
+        data.append([artist, title])
+
+    declared_count = playlist.get("track_count")
+    if declared_count is not None and len(data) < declared_count:
+        logging.warning(f"Resolved {len(data)} of {declared_count} declared tracks for {url}.")
+    return data
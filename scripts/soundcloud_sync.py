@@ -0,0 +1,84 @@
+# Incremental sync for SoundCloud playlists.
+# A snapshot of each playlist's (artist, track) list is kept after every successful sldl run. On the next run the
+# scraped CSV handed to sldl is cut down to the tracks added since that snapshot, plus any of the playlist's tracks
+# still pending in the failed downloads list, so sldl's expensive desperate-mode searches only run for those.
+# The snapshot is only replaced once sldl has finished successfully; until then the new list waits in a .pending file.
+# Delete a playlist's snapshot (soundcloud_playlists/snapshots/<name>.csv) to force a full re-sync of it.
+
+import csv
+import os
+from failed_downloads_store import FailedDownloadStore
+
+SNAPSHOT_DIR = os.path.join("soundcloud_playlists", "snapshots")
+
+def track_key(artist, track):
+    return (artist.strip().casefold(), track.strip().casefold())
+
+def read_tracks(csv_path):
+    """Reads [artist, track] rows from a CSV written by convert_soundcloud_to_csv, skipping the header."""
+    with open(csv_path, 'r', newline='', encoding='utf-8') as file:
+        reader = csv.reader(file)
+        next(reader, None)
+        return [row[:2] for row in reader if len(row) >= 2]
+
+def write_tracks(csv_path, rows):
+    temp_path = csv_path + '.tmp'
+    with open(temp_path, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        writer.writerow(['Artist', 'Track'])  # Write the header
+        writer.writerows(rows)
+    os.replace(temp_path, csv_path)
+
+def snapshot_path(csv_path):
+    return os.path.join(SNAPSHOT_DIR, os.path.basename(csv_path))
+
+def pending_snapshot_path(csv_path):
+    return snapshot_path(csv_path) + '.pending'
+
+def prepare_incremental_csv(csv_path, store=None):
+    """
+    Rewrites a freshly scraped playlist CSV in place so it only lists tracks sldl still needs to look for.
+
+    The full scraped list is set aside as the pending snapshot; call commit_snapshot once sldl has succeeded.
+    The CSV keeps its file name because sldl names the playlist folder after it.
+
+    Returns:
+        tuple: (number of tracks left to download, number of tracks in the playlist)
+    """
+    scraped = read_tracks(csv_path)
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    write_tracks(pending_snapshot_path(csv_path), scraped)
+
+    previous_path = snapshot_path(csv_path)
+    if not os.path.exists(previous_path):
+        # First sync of this playlist: everything is new
+        return len(scraped), len(scraped)
+    known = {track_key(artist, track) for artist, track in read_tracks(previous_path)}
+
+    owns_store = store is None
+    if owns_store:
+        store = FailedDownloadStore()
+    try:
+        # sldl reports CSV tracks with the Track column as {title} and the Artist column as {artist}
+        wanted = [
+            [artist, track] for artist, track in scraped
+            if track_key(artist, track) not in known or store.contains(track, artist)
+        ]
+    finally:
+        if owns_store:
+            store.close()
+
+    write_tracks(csv_path, wanted)
+    return len(wanted), len(scraped)
+
+def commit_snapshot(csv_path):
+    """Makes the pending snapshot for a playlist current. Call only after sldl has finished successfully."""
+    pending_path = pending_snapshot_path(csv_path)
+    if os.path.exists(pending_path):
+        os.replace(pending_path, snapshot_path(csv_path))
+
+def discard_snapshot(csv_path):
+    """Drops the pending snapshot after a failed run, so the same tracks are tried again next time."""
+    pending_path = pending_snapshot_path(csv_path)
+    if os.path.exists(pending_path):
+        os.remove(pending_path)
@@ -0,0 +1,153 @@
+# Generates a synthetic workspace for benchmark.py: a tracks_and_playlists library laid out the way sldl writes it,
+# a failed_downloads.csv next to it, and an empty scripts folder to run from (so `../` paths resolve as they do in a real
+# checkout). Audio files are tiny but valid MP3, FLAC and WAV files, so Mutagen probes them exactly as it would real ones.
+# Generation is deterministic for a given seed.
+# Usage: python synthetic_library.py <output directory> [tracks] [playlists] [failed downloads]
+
+import csv
+import os
+import random
+import struct
+import sys
+import wave
+
+# Default share of each kind of file in the library
+DEFAULT_FORMAT_MIX = {'mp3_320': 0.6, 'mp3_256': 0.05, 'mp3_192': 0.05, 'flac': 0.2, 'wav': 0.1}
+
+# MPEG-1 Layer III bitrate index for each bitrate in kbps
+MP3_BITRATE_INDEX = {32: 1, 40: 2, 48: 3, 56: 4, 64: 5, 80: 6, 96: 7, 112: 8, 128: 9, 160: 10, 192: 11, 224: 12,
+                     256: 13, 320: 14}
+SAMPLE_RATE = 44100
+
+def write_mp3(path, kbps=320, frames=8):
+    """Writes a silent constant-bitrate MPEG-1 Layer III stream."""
+    header = bytes([0xFF, 0xFB, MP3_BITRATE_INDEX[kbps] << 4, 0xC4])
+    frame_length = 144 * kbps * 1000 // SAMPLE_RATE
+    with open(path, 'wb') as f:
+        for _ in range(frames):
+            f.write(header + b'\x00' * (frame_length - len(header)))
+
+def write_flac(path, seconds=180):
+    """Writes a FLAC stream header; the declared length is what Mutagen reports as the duration."""
+    stream_info = bytearray(34)
+    struct.pack_into('>HH', stream_info, 0, 4096, 4096)
+    channels, bits_per_sample, total_samples = 2, 16, SAMPLE_RATE * seconds
+    packed = (SAMPLE_RATE << 44) | ((channels - 1) << 41) | ((bits_per_sample - 1) << 36) | total_samples
+    stream_info[10:18] = packed.to_bytes(8, 'big')
+    with open(path, 'wb') as f:
+        # Last-metadata-block flag set, block type 0 (STREAMINFO)
+        f.write(b'fLaC' + bytes([0x80]) + len(stream_info).to_bytes(3, 'big') + bytes(stream_info))
+        f.write(b'\x00' * 64)
+
+def write_wav(path, seconds=0.05):
+    with wave.open(path, 'wb') as w:
+        w.setnchannels(2)
+        w.setsampwidth(2)
+        w.setframerate(SAMPLE_RATE)
+        w.writeframes(b'\x00' * int(SAMPLE_RATE * seconds) * 4)
+
+def write_audio(path, kind):
+    if kind.startswith('mp3_'):
+        write_mp3(path, int(kind[len('mp3_'):]))
+    elif kind == 'flac':
+        write_flac(path)
+    elif kind == 'wav':
+        write_wav(path)
+    else:
+        raise ValueError(f"Unknown format: {kind}")
+
+def parse_format_mix(text):
+    """Parses 'mp3_320=0.6,flac=0.4' into a format mix dictionary."""
+    mix = {}
+    for part in text.split(','):
+        kind, _, share = part.partition('=')
+        mix[kind.strip()] = float(share)
+    return mix
+
+def extension_for(kind):
+    return '.mp3' if kind.startswith('mp3_') else f'.{kind}'
+
+def generate_workspace(root, tracks=1000, playlists=20, failed=500, format_mix=None, seed=0):
+    """
+    Creates a synthetic workspace under root.
+
+    Args:
+        root (str): Directory to create the workspace in. Must not contain a previous workspace.
+        tracks (int): Number of downloaded audio files, spread evenly across the playlists.
+        playlists (int): Number of playlist folders, each with a _playlist.m3u8 and an _index.sldl.
+        failed (int): Number of failed downloads, listed in failed_downloads.csv and in the playlists' indexes.
+        format_mix (dict): Share of each format ('mp3_<kbps>', 'flac' or 'wav'). Defaults to DEFAULT_FORMAT_MIX.
+        seed (int): Seed for the random choices, so that the same arguments always give the same workspace.
+
+    Returns:
+        dict: Paths of the workspace's 'library', 'scripts' folder and 'failed_downloads' CSV, and the
+            'failed_rows' written to the CSV.
+    """
+    format_mix = format_mix or DEFAULT_FORMAT_MIX
+    rng = random.Random(seed)
+    kinds = list(format_mix)
+    weights = [format_mix[kind] for kind in kinds]
+
+    library = os.path.join(root, 'tracks_and_playlists')
+    scripts = os.path.join(root, 'scripts')
+    os.makedirs(library)
+    os.makedirs(scripts)
+
+    playlists = max(1, playlists)
+    playlist_dirs = [os.path.join(library, f"Playlist {index:04d}") for index in range(playlists)]
+    entries = {playlist_dir: [] for playlist_dir in playlist_dirs}
+    for playlist_dir in playlist_dirs:
+        os.makedirs(playlist_dir)
+
+    for index in range(tracks):
+        playlist_dir = playlist_dirs[index % playlists]
+        artist = f"Artist {rng.randrange(max(1, tracks // 10))}"
+        title = f"Track {index:06d}"
+        kind = rng.choices(kinds, weights)[0]
+        file_name = f"{artist} - {title}{extension_for(kind)}"
+        write_audio(os.path.join(playlist_dir, file_name), kind)
+        entries[playlist_dir].append((file_name, artist, title, None))
+
+    failed_rows = []
+    for index in range(failed):
+        playlist_dir = playlist_dirs[index % playlists]
+        artist = f"Missing Artist {index % 997}"
+        title = f"Missing Track {index:06d}"
+        failure_reason = rng.choice(['NoSuitableFileFound', 'AllDownloadsFailed', 'InvalidSearchString'])
+        entries[playlist_dir].append((None, artist, title, failure_reason))
+        failed_rows.append([
+            os.path.join(playlist_dir, f"{artist} - {title}"), title, artist, '', '', str(rng.randrange(120, 480)),
+            failure_reason, 'Failed'
+        ])
+
+    for playlist_dir, playlist_entries in entries.items():
+        rng.shuffle(playlist_entries)
+        with open(os.path.join(playlist_dir, '_playlist.m3u8'), 'w', encoding='utf-8') as f:
+            for file_name, artist, title, failure_reason in playlist_entries:
+                if file_name:
+                    f.write(f"{file_name}\n")
+                else:
+                    f.write(f"# Failed: {artist} - {title} [{failure_reason}]\n")
+
+        sldl_entries = []
+        for file_name, artist, title, failure_reason in playlist_entries:
+            if file_name:
+                sldl_entries.append(f"{file_name},{artist},,{title},180,0,1,0")
+            else:
+                sldl_entries.append(f",{artist},,{title},180,0,2,3")
+        with open(os.path.join(playlist_dir, '_index.sldl'), 'w', encoding='utf-8') as f:
+            f.write('#SLDL:' + ';'.join(sldl_entries) + ';')
+
+    failed_downloads = os.path.join(root, 'failed_downloads.csv')
+    with open(failed_downloads, 'w', newline='', encoding='utf-8') as f:
+        csv.writer(f).writerows(failed_rows)
+
+    return {'library': library, 'scripts': scripts, 'failed_downloads': failed_downloads, 'failed_rows': failed_rows}
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("Usage: python synthetic_library.py <output directory> [tracks] [playlists] [failed downloads]")
+        sys.exit(1)
+    counts = [int(argument) for argument in sys.argv[2:5]]
+    workspace = generate_workspace(sys.argv[1], *counts)
+    print(f"Created synthetic library in {workspace['library']}")
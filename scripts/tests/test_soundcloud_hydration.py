@@ -0,0 +1,155 @@
+# Tests soundcloud_hydration.py against saved pages and tracks API responses (tests/fixtures/soundcloud), served from a
+# local stand-in server with SOUNDCLOUD_API_BASE pointed at it:
+#   * playlist.html: a 120-track set whose page includes the first 5 tracks in full and the rest as ID stubs
+#   * tracks.json: the tracks API's objects for the stubs, minus two tracks that were removed from SoundCloud
+#   * playlist_rendered.html: a rendered page with no hydration data, for the DOM fallback
+# Usage: python -m unittest discover tests (or pytest tests), from the scripts folder.
+
+import csv
+import json
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES_DIR = os.path.join(SCRIPTS_DIR, 'tests', 'fixtures', 'soundcloud')
+
+CLIENT_ID = 'fixtureClientId0123456789abcdef'
+# Stub ids that tracks.json leaves out, as the API does for removed or region-blocked tracks
+REMOVED_IDS = {1000060, 1000111}
+
+PAGES = {
+    '/fixture-user/sets/fixture-set': 'playlist.html',
+    '/fixture-user/sets/short-set': 'playlist_rendered.html',
+}
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name), 'rb') as f:
+        return f.read()
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Serves the fixture pages, and the tracks API from tracks.json. Every tracks API request is recorded."""
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path in PAGES:
+            self.reply(200, 'text/html; charset=utf-8', read_fixture(PAGES[url.path]))
+        elif url.path == '/api/tracks':
+            query = parse_qs(url.query)
+            ids = [int(track_id) for track_id in query.get('ids', [''])[0].split(',') if track_id]
+            self.server.track_requests.append((ids, query.get('client_id', [None])[0]))
+            tracks = {track['id']: track for track in json.loads(read_fixture('tracks.json'))}
+            body = json.dumps([tracks[track_id] for track_id in ids if track_id in tracks]).encode('utf-8')
+            self.reply(200, 'application/json', body)
+        else:
+            self.reply(404, 'text/plain', b'Not found')
+
+    def reply(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+server.track_requests = []
+BASE_URL = f"http://127.0.0.1:{server.server_port}"
+
+# Both are read when the scripts are imported
+os.environ['SOUNDCLOUD_API_BASE'] = f"{BASE_URL}/api"
+os.environ['RUN_METRICS'] = '0'
+sys.path.insert(0, SCRIPTS_DIR)
+import requests  # noqa: E402
+import soundcloud_hydration  # noqa: E402
+from convert_soundcloud_to_csv import scrape_soundcloud_playlist  # noqa: E402
+from soundcloud_hydration import HydrationError, TRACK_BATCH_SIZE, extract_playlist_tracks  # noqa: E402
+
+def setUpModule():
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+def tearDownModule():
+    server.shutdown()
+    server.server_close()
+
+class StandInScraper:
+    """Stands in for SoundCloudScraper: the "rendered" page is fetched from the stand-in server instead of a browser."""
+
+    def __init__(self):
+        self.http_session = requests.Session()
+        self.rendered = []
+
+    def get_page_source(self, url):
+        self.rendered.append(url)
+        return self.http_session.get(url, timeout=10).text
+
+class ExtractPlaylistTracksTest(unittest.TestCase):
+
+    def setUp(self):
+        server.track_requests.clear()
+        self.api_tracks = json.loads(read_fixture('tracks.json'))
+
+    def test_api_base_comes_from_the_environment(self):
+        self.assertEqual(soundcloud_hydration.SOUNDCLOUD_API_BASE, f"{BASE_URL}/api")
+
+    def test_resolves_stubs_in_batches(self):
+        rows = extract_playlist_tracks(f"{BASE_URL}/fixture-user/sets/fixture-set")
+
+        batches = [ids for ids, _ in server.track_requests]
+        self.assertEqual([len(ids) for ids in batches], [TRACK_BATCH_SIZE, TRACK_BATCH_SIZE, 15])
+        self.assertEqual({client_id for _, client_id in server.track_requests}, {CLIENT_ID})
+        # Only the stubs are looked up, each once, in playlist order
+        self.assertEqual([track_id for ids in batches for track_id in ids], list(range(1000005, 1000120)))
+
+        self.assertEqual(len(rows), 118)
+        self.assertEqual(rows[5:], [[track['user']['username'], track['title']] for track in self.api_tracks])
+
+    def test_drops_stubs_missing_from_the_api_response(self):
+        with self.assertLogs(level='WARNING') as logs:
+            rows = extract_playlist_tracks(f"{BASE_URL}/fixture-user/sets/fixture-set")
+
+        self.assertEqual(len(rows), 120 - len(REMOVED_IDS))
+        for track_id in REMOVED_IDS:
+            self.assertTrue(any(f"Could not resolve track {track_id}" in line for line in logs.output))
+        self.assertTrue(any("Resolved 118 of 120 declared tracks" in line for line in logs.output))
+
+    def test_page_without_hydration_data_raises(self):
+        with self.assertRaises(HydrationError):
+            extract_playlist_tracks(f"{BASE_URL}/fixture-user/sets/short-set")
+        self.assertEqual(server.track_requests, [])
+
+class ScrapeFallbackTest(unittest.TestCase):
+
+    def test_falls_back_to_the_rendered_page(self):
+        scraper = StandInScraper()
+        url = f"{BASE_URL}/fixture-user/sets/short-set"
+        with tempfile.TemporaryDirectory() as directory:
+            output_csv = os.path.join(directory, 'short-set.csv')
+            scrape_soundcloud_playlist(url, output_csv, scraper)
+            with open(output_csv, newline='', encoding='utf-8') as f:
+                rows = list(csv.reader(f))
+
+        self.assertEqual(scraper.rendered, [url])
+        self.assertEqual(rows[0], ['Artist', 'Track'])
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[1][0], "Floating Points")
+
+    def test_hydration_data_skips_the_browser(self):
+        scraper = StandInScraper()
+        with tempfile.TemporaryDirectory() as directory:
+            output_csv = os.path.join(directory, 'fixture-set.csv')
+            scrape_soundcloud_playlist(f"{BASE_URL}/fixture-user/sets/fixture-set", output_csv, scraper)
+            with open(output_csv, newline='', encoding='utf-8') as f:
+                rows = list(csv.reader(f))
+
+        self.assertEqual(scraper.rendered, [])
+        self.assertEqual(len(rows), 1 + 118)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,341 @@
+# Watches the library folder and keeps it import-ready while files arrive, instead of waiting for the batch passes.
+# sldl's _playlist.m3u8 files are renamed after their folder (see rename_playlists.py) as soon as they appear, and new
+# audio files are probed and remuxed to 320kbps MP3 (see remux_to_mp3_320.py) by a fixed number of worker threads.
+# Changes are picked up with the watchdog package (inotify on Linux) if it is installed, and by re-listing the library
+# every few seconds if it isn't. A file is only handled once it has stopped changing for SETTLE_SECONDS, so files that
+# are still being written are left alone. Playlist and index rewrites for remuxed files are written once the queue
+# drains. As in remux_to_mp3_320.py, only one source is remuxed to each .mp3: a file whose destination is already taken
+# (by an MP3 on disk, or by another file being remuxed) is skipped with an error logged.
+# Usage: python watch_library.py [<directory>] [--workers N] [--poll SECONDS] [--catch-up]
+
+import argparse
+import os
+import queue
+import threading
+import time
+from collections import defaultdict
+from log_error_to_file import log_error_to_file
+from playlist_index import PlaylistRewriter, normalise_path
+from probe_cache import ProbeCache
+from remux_journal import RemuxJournal
+from remux_to_mp3_320 import AUDIO_EXTENSIONS, PLAYLIST_CHECKPOINT, destination_of, process_file
+from rename_playlists import SLDL_PLAYLIST_NAME, rename_playlist_in_folder
+from run_metrics import emit
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    FileSystemEventHandler = object
+    Observer = None
+
+# How long a file must go without changing before it is handled
+SETTLE_SECONDS = 2.0
+
+# How often the library is re-listed when watchdog isn't available
+POLL_INTERVAL = 5.0
+
+# How often settled files are looked for
+TICK_SECONDS = 0.5
+
+# Files waiting for a worker, per worker; further files stay pending until there is room
+QUEUE_PER_WORKER = 4
+
+def file_signature(file_path):
+    """Returns (size, mtime_ns) for file_path, or None if it no longer exists."""
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+def is_watched(file_path):
+    name = os.path.basename(file_path)
+    return name == SLDL_PLAYLIST_NAME or name.lower().endswith(AUDIO_EXTENSIONS)
+
+class LibraryEventHandler(FileSystemEventHandler):
+    """Forwards watchdog events for new and changed files to a callback."""
+
+    def __init__(self, notify):
+        super().__init__()
+        self.notify = notify
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self.notify(event.src_path)
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self.notify(event.src_path)
+
+    def on_moved(self, event):
+        # Files renamed into place (e.g. a finished download or remux) arrive as moves
+        if not event.is_directory:
+            self.notify(event.dest_path)
+
+def scan_watched_files(directory):
+    """Yields (path, (size, mtime_ns)) for every playlist and audio file under directory."""
+    pending = [directory]
+    while pending:
+        folder = pending.pop()
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            pending.append(entry.path)
+                        elif is_watched(entry.path):
+                            stat = entry.stat()
+                            yield entry.path, (stat.st_size, stat.st_mtime_ns)
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+
+class PollingObserver:
+    """
+    Fallback for when watchdog isn't installed: re-lists the library and reports new and changed files.
+    Has the same start(), stop() and join() as a watchdog Observer.
+    """
+
+    def __init__(self, directory, notify, interval=POLL_INTERVAL):
+        self.directory = directory
+        self.notify = notify
+        self.interval = interval
+        self.stopping = threading.Event()
+        self.thread = None
+        self.known = dict(scan_watched_files(directory))
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            current = dict(scan_watched_files(self.directory))
+            for file_path, signature in current.items():
+                if self.known.get(file_path) != signature:
+                    self.notify(file_path)
+            self.known = current
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="library-poll", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+
+    def join(self):
+        if self.thread is not None:
+            self.thread.join()
+
+class LibraryWatcher:
+    """
+    Renames sldl playlists and remuxes new audio files in directory as they land.
+
+    Args:
+        directory (str): The library folder.
+        workers (int): Number of files remuxed at once.
+        poll_interval (float): Re-list the library this often instead of using watchdog. Defaults to watchdog if it is
+            installed.
+        catch_up (bool): Also handle the files that are already in the library when the watcher starts.
+    """
+
+    def __init__(self, directory, workers=None, poll_interval=None, catch_up=False):
+        self.directory = directory
+        self.workers = workers or os.cpu_count() or 1
+        self.poll_interval = poll_interval
+        self.catch_up = catch_up
+        self.journal = RemuxJournal.for_directory(directory)
+        self.rewriter = PlaylistRewriter(directory, checkpoint_every=PLAYLIST_CHECKPOINT,
+                                         on_flush=self.journal.finish)
+        self.cache = ProbeCache.for_directory(directory)
+        self.summary = defaultdict(int)
+        # path -> (when it last changed, its (size, mtime_ns) at that point)
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+        self.queue = queue.Queue(maxsize=self.workers * QUEUE_PER_WORKER)
+        # Files queued or being remuxed, so repeated events for them aren't queued twice
+        self.in_progress = set()
+        # Destination -> the file queued or being remuxed to it, so two files never write the same .mp3
+        self.destinations = {}
+        self.in_progress_lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.stopped = False
+        self.observer = None
+        self.worker_threads = []
+        self.renamed = 0
+        self.remuxed = 0
+
+    def notify(self, file_path):
+        """Records that file_path was created or changed; it is handled once it has settled."""
+        if not is_watched(file_path):
+            return
+        with self.pending_lock:
+            self.pending[os.path.abspath(file_path)] = (time.monotonic(), file_signature(file_path))
+
+    def start(self):
+        # Complete whatever an interrupted run left behind before watching for new work
+        resumed = self.journal.resume(self.rewriter)
+        if resumed:
+            print(f"Resumed {resumed} interrupted remux job(s).")
+            self.rewriter.flush()
+
+        if self.poll_interval is None and Observer is not None:
+            self.observer = Observer()
+            self.observer.schedule(LibraryEventHandler(self.notify), self.directory, recursive=True)
+            mode = "watchdog"
+        else:
+            self.observer = PollingObserver(self.directory, self.notify, self.poll_interval or POLL_INTERVAL)
+            mode = f"polling every {self.observer.interval:g}s"
+        if self.catch_up:
+            for file_path, _ in scan_watched_files(self.directory):
+                self.notify(file_path)
+        self.observer.start()
+
+        for index in range(self.workers):
+            thread = threading.Thread(target=self.work, name=f"watch-remux-{index}", daemon=True)
+            thread.start()
+            self.worker_threads.append(thread)
+        print(f"Watching {self.directory} ({mode}, {self.workers} worker(s)). Press Ctrl+C to stop.")
+        return self
+
+    def run(self):
+        """Handles settled files until stop() is called or Ctrl+C is pressed."""
+        try:
+            while not self.stopping.wait(TICK_SECONDS):
+                self.tick()
+        except KeyboardInterrupt:
+            print("\nStopping watcher...")
+        finally:
+            self.stop()
+
+    def tick(self):
+        now = time.monotonic()
+        with self.pending_lock:
+            settled = [
+                (file_path, signature) for file_path, (changed_at, signature) in self.pending.items()
+                if now - changed_at >= SETTLE_SECONDS
+            ]
+
+        for file_path, signature in settled:
+            current = file_signature(file_path)
+            with self.pending_lock:
+                if self.pending.get(file_path, (None, None))[1] != signature:
+                    # Another event arrived in the meantime
+                    continue
+                if current is None:
+                    del self.pending[file_path]
+                    continue
+                if current != signature:
+                    # Still being written, even though no event said so (e.g. on network shares)
+                    self.pending[file_path] = (now, current)
+                    continue
+            if self.dispatch(file_path):
+                with self.pending_lock:
+                    if self.pending.get(file_path, (None, None))[1] == signature:
+                        del self.pending[file_path]
+
+        with self.pending_lock:
+            idle = not self.pending
+        if idle and self.queue.unfinished_tasks == 0:
+            # Nothing is arriving or being remuxed, so sldl is unlikely to be writing playlists right now
+            self.rewriter.flush()
+
+    def dispatch(self, file_path):
+        """Handles one settled file. Returns False if it has to wait (the remux queue is full)."""
+        if os.path.basename(file_path) == SLDL_PLAYLIST_NAME:
+            folder = os.path.dirname(file_path)
+            try:
+                new_path = rename_playlist_in_folder(folder, os.listdir(folder))
+                if new_path:
+                    self.renamed += 1
+                    print(f"Renamed playlist: {new_path}")
+            except OSError as e:
+                error_message = f"Error renaming playlist in {folder}: {e}"
+                print(error_message)
+                log_error_to_file(__file__, error_message)
+            return True
+
+        destination_path = destination_of(file_path)
+        in_place = destination_path == normalise_path(file_path)
+        with self.in_progress_lock:
+            if file_path in self.in_progress:
+                # Already waiting for a worker; the worker probes it as it is now
+                return True
+            owner = self.destinations.get(destination_path)
+            if owner is None and not in_place and os.path.exists(destination_path):
+                owner = destination_path
+            if owner is not None and owner != file_path and in_place:
+                # The remux writing this file hasn't finished yet; it is probed once it has
+                return False
+        if owner is not None and owner != file_path:
+            error_message = f"Skipping {file_path}: it would be remuxed to the same file as {owner}"
+            print(error_message)
+            log_error_to_file(__file__, error_message)
+            return True
+        try:
+            self.queue.put_nowait(file_path)
+        except queue.Full:
+            return False
+        with self.in_progress_lock:
+            self.in_progress.add(file_path)
+            self.destinations[destination_path] = file_path
+        return True
+
+    def work(self):
+        while True:
+            file_path = self.queue.get()
+            try:
+                if file_path is None:
+                    return
+                with self.in_progress_lock:
+                    self.in_progress.discard(file_path)
+                try:
+                    if os.path.isfile(file_path):
+                        # Files that are already 320kbps MP3 (including the results of earlier remuxes) are only probed
+                        outcome = process_file(file_path, self.rewriter, self.journal, self.cache, self.summary)
+                        if outcome is not None and outcome[2]:
+                            self.remuxed += 1
+                finally:
+                    with self.in_progress_lock:
+                        destination_path = destination_of(file_path)
+                        # Still owned if another event for the file queued it again meanwhile
+                        if self.destinations.get(destination_path) == file_path and file_path not in self.in_progress:
+                            del self.destinations[destination_path]
+            finally:
+                self.queue.task_done()
+
+    def stop(self):
+        """Stops watching, finishes the files already queued and writes the pending playlist updates."""
+        if self.stopped:
+            return
+        self.stopped = True
+        self.stopping.set()
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer.join()
+        for _ in self.worker_threads:
+            self.queue.put(None)
+        for thread in self.worker_threads:
+            thread.join()
+        try:
+            self.rewriter.flush()
+        finally:
+            self.cache.close()
+            self.journal.close()
+        emit("watch", directory=self.directory, renamed=self.renamed, remuxed=self.remuxed)
+        print(f"Renamed {self.renamed} playlist(s) and remuxed {self.remuxed} file(s).")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rename playlists and remux audio files as they land in the library.")
+    parser.add_argument("directory", nargs="?", default="../tracks_and_playlists/",
+                        help="Library directory (default ../tracks_and_playlists/).")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Number of files remuxed at once (default: number of CPU cores).")
+    parser.add_argument("--poll", type=float, default=None, metavar="SECONDS",
+                        help="Re-list the library this often instead of using watchdog.")
+    parser.add_argument("--catch-up", action="store_true",
+                        help="Also handle the files already in the library when the watcher starts.")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.directory):
+        print(f"The provided path is not a valid directory: {args.directory}")
+    else:
+        LibraryWatcher(args.directory, args.workers, args.poll, args.catch_up).start().run()